@@ -0,0 +1,104 @@
+"""
+Almacén de ficheros adjuntos direccionado por contenido.
+
+Cada fichero se guarda en ADJUNTOS_DIR con el SHA-256 de su contenido como
+nombre, repartido en subdirectorios por sus primeros caracteres
+(``ab/cd/abcd...``), así que un mismo fichero subido varias veces ocupa una
+sola copia. En la base de datos solo se guardan los metadatos (tabla
+``adjuntos`` de database.py).
+
+La subida se lee por bloques y se escribe en un fichero temporal dentro del
+propio almacén mientras se calcula el hash; al terminar se mueve a su sitio
+con os.replace, que es atómico, así que nunca se sirve un fichero a medias ni
+se carga entero en memoria.
+
+Los ficheros no se borran al eliminar un mensaje: otros adjuntos pueden
+apuntar al mismo contenido.
+"""
+import hashlib
+import os
+import tempfile
+
+# Directorio del almacén y tamaño máximo de cada adjunto
+ADJUNTOS_DIR = os.environ.get(
+    'ADJUNTOS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'adjuntos')
+)
+ADJUNTOS_MAX_BYTES = int(os.environ.get('ADJUNTOS_MAX_BYTES', 25 * 2**20))
+
+TAMANO_BLOQUE = 64 * 1024
+
+
+class AdjuntoDemasiadoGrande(ValueError):
+    """La subida supera el tamaño máximo del almacén"""
+
+
+class AlmacenAdjuntos:
+    """
+    Ficheros adjuntos guardados por su SHA-256.
+
+    Args:
+        raiz: Directorio del almacén (se crea si no existe)
+        max_bytes: Tamaño máximo de cada fichero
+    """
+
+    def __init__(self, raiz=ADJUNTOS_DIR, max_bytes=ADJUNTOS_MAX_BYTES):
+        self.raiz = raiz
+        self.max_bytes = max_bytes
+        self._temporales = os.path.join(raiz, 'tmp')
+
+    def ruta_de(self, sha256):
+        """Ruta del fichero con ese hash, exista o no"""
+        return os.path.join(self.raiz, sha256[:2], sha256[2:4], sha256)
+
+    def guardar(self, flujo):
+        """
+        Guarda el contenido de un flujo leyéndolo por bloques.
+
+        Args:
+            flujo: Objeto con read(n), como ``request.stream``
+
+        Returns:
+            tuple: (sha256, tamaño en bytes)
+
+        Raises:
+            AdjuntoDemasiadoGrande: Si el contenido supera ``max_bytes``
+            ValueError: Si el contenido está vacío
+        """
+        os.makedirs(self._temporales, exist_ok=True)
+        descriptor, temporal = tempfile.mkstemp(dir=self._temporales)
+        try:
+            resumen = hashlib.sha256()
+            tamano = 0
+            with os.fdopen(descriptor, 'wb') as destino:
+                while True:
+                    bloque = flujo.read(TAMANO_BLOQUE)
+                    if not bloque:
+                        break
+                    tamano += len(bloque)
+                    if tamano > self.max_bytes:
+                        raise AdjuntoDemasiadoGrande(
+                            f"El adjunto supera el tamaño máximo de {self.max_bytes} bytes"
+                        )
+                    resumen.update(bloque)
+                    destino.write(bloque)
+                # La fila de la base de datos no debe sobrevivir al fichero
+                destino.flush()
+                os.fsync(destino.fileno())
+            if not tamano:
+                raise ValueError("El adjunto está vacío")
+
+            sha256 = resumen.hexdigest()
+            ruta = self.ruta_de(sha256)
+            if os.path.exists(ruta):
+                # Ya estaba guardado: basta con la copia existente
+                os.remove(temporal)
+            else:
+                os.makedirs(os.path.dirname(ruta), exist_ok=True)
+                # mkstemp lo crea solo legible por el propietario
+                os.chmod(temporal, 0o644)
+                os.replace(temporal, ruta)
+            return sha256, tamano
+        except BaseException:
+            if os.path.exists(temporal):
+                os.remove(temporal)
+            raise
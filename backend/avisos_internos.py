@@ -0,0 +1,74 @@
+"""
+Canal de avisos internos del backend para otros procesos (por ejemplo el frontend).
+
+Publica eventos ligeros, como los cambios de pertenencia a salas, que los
+procesos suscritos reciben como Server-Sent Events. Cada proceso del frontend
+mantiene su propia suscripción, así que todos sus workers reciben todos los
+avisos.
+
+Los avisos se guardan en un búfer circular con un número de secuencia; si un
+suscriptor se queda tan atrás que sus avisos ya no están en el búfer recibe un
+aviso ``reset`` y debe descartar todo lo que tenga en caché.
+"""
+import json
+import threading
+import time
+from collections import deque
+
+
+class CanalAvisos:
+    """
+    Búfer de avisos con número de secuencia y suscripción por SSE.
+
+    Args:
+        socketio: Instancia de flask_socketio.SocketIO (se usa su sleep para no
+            bloquear el servidor sea cual sea el modo asíncrono)
+        capacidad: Número de avisos que se conservan para los suscriptores
+        intervalo: Segundos entre comprobaciones de avisos nuevos
+        latido: Segundos entre comentarios de keep-alive cuando no hay avisos
+    """
+
+    def __init__(self, socketio, capacidad=1000, intervalo=0.5, latido=15):
+        self.socketio = socketio
+        self.intervalo = intervalo
+        self.latido = latido
+        self._avisos = deque(maxlen=capacidad)
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def publicar(self, tipo, datos):
+        """Publica un aviso para todos los suscriptores"""
+        with self._lock:
+            self._seq += 1
+            self._avisos.append((self._seq, dict(datos, tipo=tipo)))
+
+    def _avisos_desde(self, seq):
+        with self._lock:
+            if self._avisos and self._avisos[0][0] > seq + 1:
+                # Se han perdido avisos que ya no están en el búfer
+                return [(self._avisos[-1][0], {"tipo": "reset"})]
+            return [(s, datos) for s, datos in self._avisos if s > seq]
+
+    def suscribir(self, desde_seq=None):
+        """
+        Generador de Server-Sent Events con los avisos posteriores a desde_seq.
+        Si desde_seq es None se empieza por los avisos que se publiquen a partir
+        de ahora.
+        """
+        with self._lock:
+            seq = self._seq if desde_seq is None else desde_seq
+
+        # Primer mensaje: confirma la suscripción y su posición
+        yield f"id: {seq}\nevent: suscrito\ndata: {{}}\n\n"
+        ultimo_envio = time.monotonic()
+
+        while True:
+            for seq, datos in self._avisos_desde(seq):
+                yield f"id: {seq}\ndata: {json.dumps(datos)}\n\n"
+                ultimo_envio = time.monotonic()
+
+            if time.monotonic() - ultimo_envio >= self.latido:
+                yield ": latido\n\n"
+                ultimo_envio = time.monotonic()
+
+            self.socketio.sleep(self.intervalo)
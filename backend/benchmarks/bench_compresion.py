@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Mide el tamaño de la base de datos y la latencia del historial con mensajes comprimidos.
+
+Parte del conjunto de datos de bench_database.py y sustituye una fracción de
+los mensajes por registros pegados (trazas de error, líneas de log de acceso
+y de aplicación) hechos con unas pocas plantillas, como los que se repiten
+entre salas. Después, para cada variante de compresion.py (sin compresión,
+zlib y zstd, con y sin diccionario compartido) hace una copia, la comprime con
+``compresion.comprimir``, ejecuta VACUUM y mide:
+
+- el tamaño del fichero y, si SQLite tiene la tabla virtual dbstat, el de la
+  tabla de mensajes;
+- la latencia de ``get_mensajes_paginados`` (páginas de 50 mensajes desde
+  puntos aleatorios, los mismos en todas las variantes) con una sesión limpia
+  en cada llamada, como una petición del servidor.
+
+Las copias se guardan en benchmarks/.datos y se borran al terminar.
+
+Uso:
+    python benchmarks/bench_compresion.py --tamano mediano --fraccion 0.1
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import compresion  # noqa: E402
+from database import DatabaseManager  # noqa: E402
+from bench_database import DIRECTORIO_DATOS, SEMILLA, TAMANOS, preparar_datos  # noqa: E402
+
+LONGITUD_MAXIMA = 1000
+TAMANO_PAGINA = 50
+
+MODULOS = ("servidor", "colas_socket", "lecturas", "database", "services/mensajes", "services/salas")
+FUNCIONES = ("enviar", "difundir", "agregar_mensaje", "marcar_leidos", "procesar_lote", "get_session")
+ERRORES = (
+    "OperationalError: database is locked",
+    "KeyError: 'sala_id'",
+    "TimeoutError: no se recibió respuesta en 30 s",
+    "ConnectionResetError: [Errno 104] Connection reset by peer",
+)
+RUTAS = ("/api/rooms", "/api/rooms/{n}/messages", "/api/rooms/{n}/read", "/api/user/me", "/socket.io/")
+
+
+def traza(rnd):
+    lineas = ["Traceback (most recent call last):"]
+    for _ in range(rnd.randint(3, 8)):
+        lineas.append(f'  File "/srv/silenda/backend/{rnd.choice(MODULOS)}.py", '
+                      f'line {rnd.randint(10, 1400)}, in {rnd.choice(FUNCIONES)}')
+        lineas.append(f"    resultado = {rnd.choice(FUNCIONES)}(sala_id, usuario_id)")
+    lineas.append(rnd.choice(ERRORES))
+    return lineas
+
+
+def log_acceso(rnd):
+    return [
+        f'10.0.{rnd.randint(0, 9)}.{rnd.randint(1, 254)} - - [02/Mar/2025:10:{rnd.randint(0, 59):02d}:'
+        f'{rnd.randint(0, 59):02d} +0000] "GET {rnd.choice(RUTAS).format(n=rnd.randint(1, 999))} HTTP/1.1" '
+        f'{rnd.choice((200, 200, 200, 304, 404, 502))} {rnd.randint(120, 9000)} "-" '
+        f'"Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0 Safari/537.36"'
+        for _ in range(rnd.randint(3, 9))
+    ]
+
+
+def log_aplicacion(rnd):
+    return [
+        f"2025-03-02T10:{rnd.randint(0, 59):02d}:{rnd.randint(0, 59):02d}.{rnd.randint(0, 999):03d}Z "
+        f"{rnd.choice(('INFO', 'WARNING', 'ERROR'))} [worker-{rnd.randint(0, 7)}] "
+        f"{rnd.choice(MODULOS)}.{rnd.choice(FUNCIONES)} - lote {rnd.randint(1, 99999)} procesado en "
+        f"{rnd.randint(1, 5000)} ms ({rnd.randint(0, 500)} mensajes, {rnd.randint(0, 3)} reintentos)"
+        for _ in range(rnd.randint(4, 12))
+    ]
+
+
+def registro_pegado(rnd):
+    """Texto de un registro pegado en el chat, de como mucho LONGITUD_MAXIMA caracteres"""
+    return "\n".join(rnd.choice((traza, log_acceso, log_aplicacion))(rnd))[:LONGITUD_MAXIMA]
+
+
+def preparar_texto(tamano, fraccion):
+    """Copia del conjunto de datos con una fracción de los mensajes sustituidos por registros"""
+    ruta = os.path.join(DIRECTORIO_DATOS, f"compresion-{tamano}-{fraccion}-texto.db")
+    shutil.copyfile(preparar_datos(tamano), ruta)
+    rnd = random.Random(SEMILLA)
+    conn = sqlite3.connect(ruta)
+    try:
+        ids = [fila[0] for fila in conn.execute("SELECT id FROM mensajes")]
+        elegidos = rnd.sample(ids, int(len(ids) * fraccion))
+        with conn:
+            conn.executemany("UPDATE mensajes SET contenido = ? WHERE id = ?",
+                             ((registro_pegado(rnd), mensaje_id) for mensaje_id in elegidos))
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+    return ruta
+
+
+def variantes(ruta_texto, umbral):
+    """Nombre de cada variante -> Codec, con los diccionarios entrenados con la copia en texto"""
+    conn = sqlite3.connect(ruta_texto)
+    compresion.registrar_funciones(conn)
+    try:
+        textos = [texto.encode('utf-8') for texto in compresion.muestras(conn, umbral, 10000)]
+    finally:
+        conn.close()
+
+    resultado = {"texto": compresion.Codec()}
+    for algoritmo in compresion.algoritmos_disponibles():
+        resultado[algoritmo] = compresion.Codec(algoritmo, umbral=umbral)
+        if textos:
+            resultado[f"{algoritmo}+diccionario"] = compresion.Codec(
+                algoritmo, umbral=umbral, diccionario=compresion.crear_diccionario(textos, algoritmo))
+    return resultado
+
+
+def tamano_mensajes(ruta):
+    """Bytes de la tabla de mensajes según dbstat, o None si no está disponible"""
+    conn = sqlite3.connect(ruta)
+    try:
+        return conn.execute("SELECT SUM(pgsize) FROM dbstat WHERE name = 'mensajes'").fetchone()[0]
+    except sqlite3.OperationalError:
+        return None
+    finally:
+        conn.close()
+
+
+def puntos_de_lectura(ruta, paginas):
+    """Pares (sala_id, antes_de_id) repartidos por el tiempo, iguales en todas las variantes"""
+    rnd = random.Random(SEMILLA)
+    conn = sqlite3.connect(ruta)
+    try:
+        minimo, maximo = conn.execute("SELECT MIN(id), MAX(id) FROM mensajes").fetchone()
+        puntos = []
+        for _ in range(paginas):
+            fila = conn.execute("SELECT sala_id, id FROM mensajes WHERE id >= ? ORDER BY id LIMIT 1",
+                                (rnd.randint(minimo, maximo),)).fetchone()
+            # La página termina en el mensaje elegido
+            puntos.append((fila[0], fila[1] + 1))
+    finally:
+        conn.close()
+    return puntos
+
+
+def medir_historial(ruta, puntos, calentamiento):
+    """Milisegundos de cada página de historial"""
+    gestor = DatabaseManager(f"sqlite:///{ruta}")
+    session = gestor.Session()
+    DatabaseManager.set_session(session)
+    tiempos = []
+    try:
+        for i, (sala_id, antes_de_id) in enumerate(puntos[:calentamiento] + puntos):
+            session.expunge_all()
+            inicio = time.perf_counter()
+            # El contenido se descomprime al cargar cada fila
+            gestor.get_mensajes_paginados(sala_id, antes_de_id=antes_de_id, limite=TAMANO_PAGINA)
+            if i >= calentamiento:
+                tiempos.append((time.perf_counter() - inicio) * 1000)
+    finally:
+        session.close()
+        DatabaseManager.set_session(None)
+        gestor.engine.dispose()
+    return tiempos
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--tamano', default='mediano', choices=list(TAMANOS), help='Conjunto de datos generado')
+    parser.add_argument('--fraccion', type=float, default=0.1, help='Fracción de mensajes que son registros pegados')
+    parser.add_argument('--umbral', type=int, default=compresion.UMBRAL, help='COMPRESION_UMBRAL de las variantes')
+    parser.add_argument('--paginas', type=int, default=500, help='Páginas de historial medidas por variante')
+    parser.add_argument('--calentamiento', type=int, default=50)
+    args = parser.parse_args()
+
+    ruta_texto = preparar_texto(args.tamano, args.fraccion)
+    puntos = puntos_de_lectura(ruta_texto, args.paginas)
+    codec_original = compresion.codec
+    copias = []
+    filas = []
+    try:
+        for nombre, codec in variantes(ruta_texto, args.umbral).items():
+            ruta = ruta_texto.replace("-texto.db", f"-{nombre.replace('+', '-')}.db")
+            if ruta != ruta_texto:
+                shutil.copyfile(ruta_texto, ruta)
+                copias.append(ruta)
+            compresion.codec = codec
+            inicio = time.perf_counter()
+            comprimidos, total = compresion.comprimir(ruta)
+            segundos = time.perf_counter() - inicio
+            conn = sqlite3.connect(ruta)
+            conn.execute("VACUUM")
+            conn.close()
+            tiempos = sorted(medir_historial(ruta, puntos, args.calentamiento))
+            filas.append((nombre, os.path.getsize(ruta), tamano_mensajes(ruta), comprimidos, total, segundos,
+                          statistics.median(tiempos), tiempos[int(len(tiempos) * 0.95) - 1]))
+    finally:
+        compresion.codec = codec_original
+        for ruta in copias + [ruta_texto]:
+            os.remove(ruta)
+
+    base, base_mensajes = filas[0][1], filas[0][2]
+    print(f"\nConjunto '{args.tamano}', {args.fraccion:.0%} de registros pegados, umbral {args.umbral} bytes, "
+          f"{args.paginas} páginas de {TAMANO_PAGINA}")
+    print(f"{'VARIANTE':<18} {'FICHERO MiB':>12} {'MENSAJES MiB':>13} {'AHORRO':>8} {'COMPRIMIDOS':>12} "
+          f"{'COMPRIMIR s':>12} {'P50 ms':>8} {'P95 ms':>8}")
+    print("-" * 100)
+    for nombre, tamano, mensajes, comprimidos, total, segundos, p50, p95 in filas:
+        ahorro = 1 - (mensajes / base_mensajes if mensajes and base_mensajes else tamano / base)
+        print(f"{nombre:<18} {tamano / 2**20:>12.1f} "
+              f"{(f'{mensajes / 2**20:.1f}' if mensajes else '-'):>13} {ahorro:>8.0%} "
+              f"{comprimidos / total:>12.1%} {segundos:>12.1f} {p50:>8.2f} {p95:>8.2f}")
+    if compresion.zstandard is None:
+        print("\nzstandard no está instalado: solo se ha medido zlib (pip install zstandard).")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Mide las consultas más frecuentes de DatabaseManager sobre datos generados.
+
+Para cada tamaño de conjunto de datos se genera (una sola vez, se guarda en
+benchmarks/.datos) una base de datos con ``generar_datos.py`` y se cronometra
+cada operación con parámetros aleatorios pero reproducibles. Cada llamada usa
+una sesión recién limpiada, como una petición del servidor. Las escrituras
+(``agregar_mensaje``) se deshacen al terminar para no alterar los datos.
+
+Los resultados se guardan en JSON junto con el commit medido, y ``--comparar``
+marca las operaciones cuya mediana ha empeorado más que el umbral entre dos
+ficheros de resultados (sale con código 1 si hay alguna).
+
+Uso:
+    python benchmarks/bench_database.py --tamanos pequeno,mediano --salida base.json
+    python benchmarks/bench_database.py --comparar base.json nuevo.json --umbral 0.2
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from argparse import Namespace
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import func  # noqa: E402
+
+from database import DatabaseManager, Mensaje, Sala, usuarios_salas  # noqa: E402
+import generar_datos  # noqa: E402
+
+DIRECTORIO_DATOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.datos')
+
+# Parámetros de generar_datos.py de cada tamaño
+TAMANOS = {
+    "pequeno": {"usuarios": 1000, "salas": 100, "mensajes": 10000},
+    "mediano": {"usuarios": 10000, "salas": 1000, "mensajes": 200000},
+    "grande": {"usuarios": 50000, "salas": 5000, "mensajes": 2000000},
+}
+SEMILLA = 42
+
+
+def preparar_datos(tamano):
+    """Devuelve la ruta de la base de datos del tamaño indicado, generándola si no existe"""
+    parametros = TAMANOS[tamano]
+    ruta = os.path.join(
+        DIRECTORIO_DATOS,
+        f"{tamano}-{parametros['usuarios']}-{parametros['salas']}-{parametros['mensajes']}-{SEMILLA}.db"
+    )
+    if not os.path.exists(ruta):
+        os.makedirs(DIRECTORIO_DATOS, exist_ok=True)
+        print(f"Generando el conjunto '{tamano}'...")
+        temporal = ruta + ".tmp"
+        generar_datos.generar(Namespace(
+            db=temporal, membresias=parametros["usuarios"] * 5, zipf=1.1, dias=90,
+            semilla=SEMILLA, sobrescribir=True, **parametros
+        ))
+        os.replace(temporal, ruta)
+    return ruta
+
+
+class Escenario:
+    """Datos de referencia para elegir los parámetros de cada operación"""
+
+    def __init__(self, session, rnd):
+        self.rnd = rnd
+        self.membresias = session.query(usuarios_salas.c.sala_id, usuarios_salas.c.usuario_id).all()
+        self.admins = (session.query(usuarios_salas.c.sala_id, usuarios_salas.c.usuario_id)
+                       .filter(usuarios_salas.c.rol == 'admin').all())
+        self.num_usuarios = session.query(func.max(usuarios_salas.c.usuario_id)).scalar()
+        # La sala más grande es el peor caso de paginación y de listado de miembros
+        self.sala_grande = session.query(Sala.id).order_by(Sala.message_count.desc()).limit(1).scalar()
+        total = session.query(func.count(Mensaje.id)).filter(Mensaje.sala_id == self.sala_grande).scalar()
+        self.mensaje_profundo = (
+            session.query(Mensaje.id)
+            .filter(Mensaje.sala_id == self.sala_grande)
+            .order_by(Mensaje.id)
+            .offset(total // 10)
+            .limit(1)
+            .scalar()
+        )
+
+    def membresia(self):
+        return self.rnd.choice(self.membresias)
+
+    def usuario(self):
+        return self.rnd.randint(1, self.num_usuarios)
+
+
+def operaciones(gestor, esc):
+    """Operación a medir -> función sin argumentos que la ejecuta una vez"""
+    return {
+        "es_miembro": lambda: gestor.es_miembro(*esc.membresia()),
+        "es_miembro_no": lambda: gestor.es_miembro(esc.membresia()[0], esc.usuario()),
+        "es_admin": lambda: gestor.es_admin(*esc.rnd.choice(esc.admins)),
+        "listar_salas": lambda: gestor.listar_salas(usuario_id=esc.membresia()[1]),
+        "get_mensajes_paginados": lambda: gestor.get_mensajes_paginados(esc.sala_grande, limite=50),
+        "get_mensajes_paginados_profundo": lambda: gestor.get_mensajes_paginados(
+            esc.sala_grande, antes_de_id=esc.mensaje_profundo, limite=50),
+        "buscar_usuarios_por_nombre": lambda: gestor.buscar_usuarios_por_nombre(
+            f"usuario{esc.usuario():07d}"[:-2]),
+        "agregar_mensaje": lambda: gestor.agregar_mensaje("mensaje de prueba", *esc.membresia()),
+        "listar_usuarios_de_sala": lambda: gestor.listar_usuarios_de_sala(esc.sala_grande),
+    }
+
+
+def medir(funcion, session, repeticiones, calentamiento):
+    """Tiempos en microsegundos de cada llamada, con la sesión limpia antes de cada una"""
+    tiempos = []
+    for i in range(calentamiento + repeticiones):
+        session.expunge_all()
+        inicio = time.perf_counter()
+        funcion()
+        transcurrido = time.perf_counter() - inicio
+        if i >= calentamiento:
+            tiempos.append(transcurrido * 1e6)
+    return tiempos
+
+
+def resumir(tiempos):
+    ordenados = sorted(tiempos)
+    return {
+        "n": len(ordenados),
+        "mediana_us": round(statistics.median(ordenados), 1),
+        "p95_us": round(ordenados[int(len(ordenados) * 0.95) - 1], 1),
+        "min_us": round(ordenados[0], 1),
+    }
+
+
+def ejecutar(tamano, repeticiones, calentamiento, filtro):
+    ruta = preparar_datos(tamano)
+    gestor = DatabaseManager(f"sqlite:///{ruta}")
+    session = gestor.Session()
+    DatabaseManager.set_session(session)
+    rnd = random.Random(SEMILLA)
+    resultados = {}
+    try:
+        esc = Escenario(session, rnd)
+        for nombre, funcion in operaciones(gestor, esc).items():
+            if filtro and nombre not in filtro:
+                continue
+            resultados[nombre] = resumir(medir(funcion, session, repeticiones, calentamiento))
+            # Deshace las escrituras para que cada operación vea los mismos datos
+            session.rollback()
+    finally:
+        session.rollback()
+        session.close()
+        DatabaseManager.set_session(None)
+        gestor.engine.dispose()
+    return resultados
+
+
+def commit_actual():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def imprimir(resultados):
+    for tamano, medidas in resultados.items():
+        print(f"\n=== {tamano} ===")
+        print(f"{'OPERACIÓN':<34} {'MEDIANA µs':>12} {'P95 µs':>12} {'MIN µs':>10}")
+        print("-" * 72)
+        for nombre, m in medidas.items():
+            print(f"{nombre:<34} {m['mediana_us']:>12.1f} {m['p95_us']:>12.1f} {m['min_us']:>10.1f}")
+
+
+def comparar(ruta_base, ruta_nuevo, umbral):
+    """Imprime la variación de cada mediana y devuelve las regresiones"""
+    with open(ruta_base) as f:
+        base = json.load(f)
+    with open(ruta_nuevo) as f:
+        nuevo = json.load(f)
+
+    print(f"Base: {base.get('commit')}  Nuevo: {nuevo.get('commit')}  Umbral: +{umbral:.0%}")
+    regresiones = []
+    for tamano, medidas in nuevo["resultados"].items():
+        anteriores = base["resultados"].get(tamano, {})
+        print(f"\n=== {tamano} ===")
+        print(f"{'OPERACIÓN':<34} {'BASE µs':>10} {'NUEVO µs':>10} {'CAMBIO':>9}")
+        print("-" * 68)
+        for nombre, m in medidas.items():
+            if nombre not in anteriores:
+                print(f"{nombre:<34} {'-':>10} {m['mediana_us']:>10.1f} {'nueva':>9}")
+                continue
+            antes = anteriores[nombre]["mediana_us"]
+            cambio = m["mediana_us"] / antes - 1 if antes else 0.0
+            marca = ""
+            if cambio > umbral:
+                marca = "  << REGRESIÓN"
+                regresiones.append((tamano, nombre, cambio))
+            print(f"{nombre:<34} {antes:>10.1f} {m['mediana_us']:>10.1f} {cambio:>+9.1%}{marca}")
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--tamanos', default='pequeno,mediano',
+                        help=f"Conjuntos de datos separados por comas ({', '.join(TAMANOS)})")
+    parser.add_argument('--operaciones', default='', help='Solo estas operaciones, separadas por comas')
+    parser.add_argument('--repeticiones', type=int, default=200, help='Llamadas medidas por operación')
+    parser.add_argument('--calentamiento', type=int, default=20, help='Llamadas previas sin medir')
+    parser.add_argument('--salida', help='Fichero JSON donde guardar los resultados')
+    parser.add_argument('--comparar', nargs=2, metavar=('BASE', 'NUEVO'),
+                        help='Compara dos ficheros de resultados en lugar de medir')
+    parser.add_argument('--umbral', type=float, default=0.2,
+                        help='Empeoramiento relativo de la mediana que se considera regresión')
+    args = parser.parse_args()
+
+    if args.comparar:
+        regresiones = comparar(*args.comparar, args.umbral)
+        if regresiones:
+            print(f"\n{len(regresiones)} regresiones por encima del {args.umbral:.0%}.")
+            sys.exit(1)
+        print("\nSin regresiones.")
+        return
+
+    tamanos = [t.strip() for t in args.tamanos.split(',') if t.strip()]
+    desconocidos = [t for t in tamanos if t not in TAMANOS]
+    if desconocidos:
+        parser.error(f"Tamaños desconocidos: {', '.join(desconocidos)}")
+    filtro = {o.strip() for o in args.operaciones.split(',') if o.strip()}
+
+    resultados = {t: ejecutar(t, args.repeticiones, args.calentamiento, filtro) for t in tamanos}
+    imprimir(resultados)
+
+    if args.salida:
+        with open(args.salida, 'w') as f:
+            json.dump({
+                "commit": commit_actual(),
+                "fecha": datetime.now().isoformat(timespec='seconds'),
+                "python": sys.version.split()[0],
+                "repeticiones": args.repeticiones,
+                "resultados": resultados,
+            }, f, indent=2)
+        print(f"\nResultados guardados en {args.salida}")
+
+
+if __name__ == '__main__':
+    main()
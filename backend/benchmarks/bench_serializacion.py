@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Compara el tamaño de los eventos de Socket.IO y el coste de codificarlos en
+el servidor con JSON y con MessagePack.
+
+Simula la difusión de eventos ``nuevo_mensaje`` a una sala con muchos miembros
+tal y como la hace ``colas_socket.py``: con JSON python-socketio codifica el
+paquete una vez por cada conexión a la que se emite; con MessagePack los datos
+se codifican una sola vez por evento (``CargaEvento``) y por cada conexión solo
+se codifica la cabecera del paquete binario.
+
+Uso:
+    python benchmarks/bench_serializacion.py --eventos 2000 --miembros 200
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from serializacion import CargaEvento, FORMATO_MSGPACK, a_compacto, msgpack  # noqa: E402
+
+PALABRAS = ("hola", "que", "tal", "reunion", "mañana", "despliegue", "error", "listo",
+            "revisad", "el", "la", "de", "en", "servidor", "cliente", "ok", "gracias")
+
+
+def generar_eventos(cantidad, longitud_media, semilla):
+    """Genera eventos nuevo_mensaje con el mismo formato que emite server.py"""
+    rnd = random.Random(semilla)
+    inicio = datetime(2025, 1, 1)
+    eventos = []
+    for i in range(cantidad):
+        palabras = max(1, int(rnd.expovariate(1 / max(1, longitud_media // 6))))
+        eventos.append({
+            'id': 1_000_000 + i,
+            'contenido': " ".join(rnd.choice(PALABRAS) for _ in range(palabras)),
+            'fecha_envio': (inicio + timedelta(seconds=i * 3)).isoformat(),
+            'usuario_id': rnd.randint(1, 5000),
+            'sala_id': 42,
+            'seq': 5_000_000 + i,
+        })
+    return eventos
+
+
+def paquete_json(evento, datos):
+    """Paquete de texto de Socket.IO tal y como lo codifica python-socketio"""
+    return '42' + json.dumps([evento, datos], separators=(',', ':'))
+
+
+def paquete_binario(evento):
+    """Cabecera del paquete binario de Socket.IO con un adjunto"""
+    return '451-' + json.dumps([evento, {'_placeholder': True, 'num': 0}], separators=(',', ':'))
+
+
+def medir_tamanos(eventos):
+    """Bytes medios por evento: (paquete completo, solo los datos)"""
+    paquetes = sum(len(paquete_json('nuevo_mensaje', e).encode('utf-8')) for e in eventos)
+    datos = sum(len(json.dumps(e, separators=(',', ':')).encode('utf-8')) for e in eventos)
+    resultado = {"json": (paquetes / len(eventos), datos / len(eventos))}
+    if msgpack is not None:
+        cabecera = len(paquete_binario('nuevo_mensaje').encode('utf-8'))
+        datos = sum(len(msgpack.packb(a_compacto(e), use_bin_type=True)) for e in eventos)
+        resultado["msgpack"] = ((datos + cabecera * len(eventos)) / len(eventos), datos / len(eventos))
+    return resultado
+
+
+def medir_codificacion(eventos, miembros):
+    inicio = time.perf_counter()
+    for datos in eventos:
+        for _ in range(miembros):
+            paquete_json('nuevo_mensaje', datos)
+    resultado = {"json": time.perf_counter() - inicio}
+
+    if msgpack is not None:
+        inicio = time.perf_counter()
+        for datos in eventos:
+            carga = CargaEvento(datos)
+            for _ in range(miembros):
+                carga.para(FORMATO_MSGPACK)
+                paquete_binario('nuevo_mensaje')
+        resultado["msgpack"] = time.perf_counter() - inicio
+    return resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--eventos', type=int, default=2000, help='Eventos a difundir')
+    parser.add_argument('--miembros', type=int, default=200, help='Conexiones en la sala')
+    parser.add_argument('--longitud', type=int, default=80, help='Longitud media del mensaje en caracteres')
+    parser.add_argument('--semilla', type=int, default=1)
+    args = parser.parse_args()
+
+    eventos = generar_eventos(args.eventos, args.longitud, args.semilla)
+    tamanos = medir_tamanos(eventos)
+    tiempos = medir_codificacion(eventos, args.miembros)
+    envios = args.eventos * args.miembros
+
+    print(f"Eventos: {args.eventos}  Miembros por sala: {args.miembros}  Envíos: {envios}")
+    print(f"{'FORMATO':<10} {'BYTES/PAQUETE':>14} {'BYTES/DATOS':>12} {'CPU TOTAL (s)':>14} {'µs/ENVÍO':>10}")
+    print("-" * 64)
+    for formato, (paquete, datos) in tamanos.items():
+        print(f"{formato:<10} {paquete:>14.1f} {datos:>12.1f} {tiempos[formato]:>14.3f} "
+              f"{tiempos[formato] / envios * 1e6:>10.2f}")
+
+    if msgpack is None:
+        print("\nmsgpack no está instalado: solo se ha medido JSON (pip install msgpack).")
+    else:
+        ahorro_paquete = 1 - tamanos["msgpack"][0] / tamanos["json"][0]
+        ahorro_datos = 1 - tamanos["msgpack"][1] / tamanos["json"][1]
+        print(f"\nMessagePack reduce el paquete un {ahorro_paquete:.0%} (los datos un {ahorro_datos:.0%}) "
+              f"y la CPU de codificación x{tiempos['json'] / tiempos['msgpack']:.1f}.")
+
+
+if __name__ == '__main__':
+    main()
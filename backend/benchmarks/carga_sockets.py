@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+"""
+Prueba de carga de la difusión de mensajes por Socket.IO en una sola máquina.
+
+Crea una base de datos temporal con ``--clientes`` usuarios repartidos en
+salas de los tamaños indicados, arranca el servidor en un subproceso sobre
+esa base de datos y conecta un cliente de Socket.IO autenticado por usuario,
+repartidos entre varios procesos. Después envía mensajes con
+``POST /api/rooms/<id>/messages`` al ritmo pedido y mide:
+
+- latencia de extremo a extremo: desde justo antes del POST hasta que cada
+  miembro conectado recibe ``nuevo_mensaje`` (percentiles)
+- entregas perdidas: las esperadas (miembros conectados de la sala de cada
+  mensaje aceptado) menos las recibidas, y los ``resync_necesario`` recibidos
+- latencia y errores del POST
+- CPU media y RSS máxima del proceso del servidor
+
+Los tokens se firman aquí con el mismo JWT_SECRET_KEY que se pasa al
+servidor, así que no hace falta calcular un hash de clave por cliente. Sin el
+paquete websocket-client los clientes usan long polling, que carga más al
+servidor que WebSocket; conviene instalarlo para medir el transporte de
+producción.
+
+Uso:
+    python benchmarks/carga_sockets.py --clientes 200 --salas 1x200,10x20 --ritmo 50 --duracion 20
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import secrets
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import psutil
+except ImportError:  # psutil es opcional: en Linux se lee /proc
+    psutil = None
+
+DIRECTORIO_BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DIRECTORIO_BACKEND)
+
+# Código que ejecuta el subproceso del servidor
+LANZADOR = """
+import sys
+import server
+server.db.init_db()
+server.socketio.run(server.app, host='127.0.0.1', port=int(sys.argv[1]),
+                    allow_unsafe_werkzeug=True, log_output=False)
+"""
+
+PREFIJO = "carga"
+
+
+def parsear_salas(especificacion):
+    """'1x200,10x20' -> [200, 20, 20, ...]: número de salas x miembros por sala"""
+    tamanos = []
+    for parte in especificacion.split(','):
+        cantidad, _, tamano = parte.strip().partition('x')
+        tamanos.extend([int(tamano)] * int(cantidad))
+    return tamanos
+
+
+def preparar_db(ruta, clientes, tamanos):
+    """Crea usuarios y salas y devuelve {sala_id: [usuario_id, ...]}"""
+    from database import DatabaseManager, Usuario, Sala, usuarios_salas
+
+    gestor = DatabaseManager(f"sqlite:///{ruta}")
+    gestor.init_db()
+    miembros = {}
+    siguiente = 0
+    for sala_id, tamano in enumerate(tamanos, start=1):
+        # Miembros consecutivos y circulares: todos los clientes acaban en alguna sala
+        miembros[sala_id] = [(siguiente + i) % clientes + 1 for i in range(min(tamano, clientes))]
+        siguiente = (siguiente + tamano) % clientes
+
+    with gestor.engine.begin() as conn:
+        conn.execute(Usuario.__table__.insert(), [
+            {"id": i, "nombre": f"carga{i:06d}", "clave": "-"} for i in range(1, clientes + 1)
+        ])
+        conn.execute(Sala.__table__.insert(), [
+            {"id": sala_id, "nombre": f"carga{sala_id}", "privada": False, "member_count": len(ids)}
+            for sala_id, ids in miembros.items()
+        ])
+        conn.execute(usuarios_salas.insert(), [
+            {"usuario_id": u, "sala_id": sala_id, "rol": "miembro"}
+            for sala_id, ids in miembros.items() for u in ids
+        ])
+    gestor.engine.dispose()
+    return miembros
+
+
+def emitir_tokens(secreto, usuario_ids):
+    """Tokens de acceso equivalentes a los de /api/auth/login"""
+    from flask import Flask
+    from flask_jwt_extended import JWTManager, create_access_token
+
+    app = Flask(__name__)
+    app.config['JWT_SECRET_KEY'] = secreto
+    JWTManager(app)
+    with app.app_context():
+        return {u: create_access_token(identity=str(u)) for u in usuario_ids}
+
+
+def puerto_libre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class MonitorProceso(threading.Thread):
+    """Muestrea cada segundo el tiempo de CPU y la memoria residente de un proceso"""
+
+    def __init__(self, pid, intervalo=1.0):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.intervalo = intervalo
+        self.rss_max = 0
+        self.cpu_inicial = None
+        self.cpu_final = None
+        self._parar = threading.Event()
+
+    def _leer(self):
+        """(segundos de CPU, bytes de RSS)"""
+        if psutil is not None:
+            proceso = psutil.Process(self.pid)
+            tiempos = proceso.cpu_times()
+            return tiempos.user + tiempos.system, proceso.memory_info().rss
+        with open(f"/proc/{self.pid}/stat") as f:
+            campos = f.read().rsplit(')', 1)[1].split()
+        cpu = (int(campos[11]) + int(campos[12])) / os.sysconf('SC_CLK_TCK')
+        with open(f"/proc/{self.pid}/status") as f:
+            rss = next(int(l.split()[1]) * 1024 for l in f if l.startswith('VmRSS:'))
+        return cpu, rss
+
+    def medir_desde_ahora(self):
+        self.cpu_inicial, _ = self._leer()
+        self.inicio = time.monotonic()
+
+    def run(self):
+        while not self._parar.wait(self.intervalo):
+            try:
+                _, rss = self._leer()
+            except (OSError, StopIteration):
+                return
+            self.rss_max = max(self.rss_max, rss)
+
+    def detener(self):
+        self.cpu_final, _ = self._leer()
+        self.fin = time.monotonic()
+        self._parar.set()
+
+    def cpu_media(self):
+        """Porcentaje de un núcleo usado entre medir_desde_ahora() y detener()"""
+        return 100 * (self.cpu_final - self.cpu_inicial) / max(1e-9, self.fin - self.inicio)
+
+
+def trabajador(url, tokens, conectados, resultados, fin):
+    """
+    Proceso con una parte de los clientes. Informa de los usuarios que han
+    conectado, recibe hasta que se activa ``fin`` y devuelve las latencias.
+    """
+    import socketio
+
+    latencias = []
+    recibidos = set()
+    resyncs = [0]
+    lock = threading.Lock()
+    clientes = []
+    ids_conectados = []
+
+    for usuario_id, token in tokens:
+        cliente = socketio.Client(reconnection=False)
+
+        def al_recibir(datos, usuario_id=usuario_id):
+            ahora = time.time()
+            partes = str(datos.get('contenido', '')).split()
+            if len(partes) == 2 and partes[0] == PREFIJO:
+                with lock:
+                    if (usuario_id, datos.get('id')) not in recibidos:
+                        recibidos.add((usuario_id, datos.get('id')))
+                        latencias.append(ahora - float(partes[1]))
+
+        def al_resync(_datos):
+            with lock:
+                resyncs[0] += 1
+
+        cliente.on('nuevo_mensaje', al_recibir)
+        cliente.on('resync_necesario', al_resync)
+        try:
+            cliente.connect(f"{url}?token={token}", auth={}, wait_timeout=10)
+            clientes.append(cliente)
+            ids_conectados.append(usuario_id)
+        except Exception as e:
+            print(f"Cliente {usuario_id} no pudo conectar: {e}", file=sys.stderr)
+
+    conectados.put(ids_conectados)
+    fin.wait()
+    with lock:
+        resultados.put({"latencias": latencias, "recibidos": len(recibidos), "resyncs": resyncs[0]})
+    for cliente in clientes:
+        try:
+            cliente.disconnect()
+        except Exception:
+            pass
+
+
+def percentiles(valores):
+    if not valores:
+        return {}
+    ordenados = sorted(valores)
+    n = len(ordenados)
+    return {
+        "p50": ordenados[int(n * 0.50) - 1 if n > 1 else 0],
+        "p95": ordenados[max(0, int(n * 0.95) - 1)],
+        "p99": ordenados[max(0, int(n * 0.99) - 1)],
+        "max": ordenados[-1],
+    }
+
+
+def enviar_mensajes(url, miembros, tokens, ritmo, duracion, hilos, rnd):
+    """Envía mensajes al ritmo pedido; devuelve (aceptados [(sala_id)], latencias POST, errores)"""
+    import requests
+
+    salas = list(miembros)
+    locales = threading.local()
+    aceptados, latencias, errores = [], [], [0]
+    lock = threading.Lock()
+
+    def enviar(sala_id, usuario_id):
+        sesion = getattr(locales, 'sesion', None)
+        if sesion is None:
+            sesion = locales.sesion = requests.Session()
+        inicio = time.time()
+        try:
+            respuesta = sesion.post(
+                f"{url}/api/rooms/{sala_id}/messages",
+                json={"contenido": f"{PREFIJO} {inicio!r}"},
+                headers={"Authorization": f"Bearer {tokens[usuario_id]}"},
+                timeout=30,
+            )
+            ok = respuesta.status_code == 201
+        except requests.RequestException:
+            ok = False
+        with lock:
+            if ok:
+                aceptados.append(sala_id)
+                latencias.append(time.time() - inicio)
+            else:
+                errores[0] += 1
+
+    total = int(ritmo * duracion)
+    with ThreadPoolExecutor(max_workers=hilos) as ejecutor:
+        comienzo = time.monotonic()
+        for i in range(total):
+            # Envíos programados a intervalos regulares, sin acumular retraso
+            espera = comienzo + i / ritmo - time.monotonic()
+            if espera > 0:
+                time.sleep(espera)
+            sala_id = rnd.choice(salas)
+            ejecutor.submit(enviar, sala_id, rnd.choice(miembros[sala_id]))
+    transcurrido = time.monotonic() - comienzo
+    return aceptados, latencias, errores[0], transcurrido
+
+
+def esperar_servidor(url, proceso, limite=30):
+    import requests
+
+    fin = time.monotonic() + limite
+    while time.monotonic() < fin:
+        if proceso.poll() is not None:
+            raise SystemExit("El servidor terminó al arrancar")
+        try:
+            if requests.get(f"{url}/hola", timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise SystemExit("El servidor no respondió a tiempo")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--clientes', type=int, default=100, help='Sockets conectados (uno por usuario)')
+    parser.add_argument('--salas', default='1x100,10x10', help='Salas como CANTIDADxMIEMBROS separadas por comas')
+    parser.add_argument('--ritmo', type=float, default=20, help='Mensajes por segundo')
+    parser.add_argument('--duracion', type=float, default=10, help='Segundos enviando mensajes')
+    parser.add_argument('--procesos', type=int, default=max(1, min(4, (os.cpu_count() or 2) - 1)),
+                        help='Procesos entre los que se reparten los clientes')
+    parser.add_argument('--hilos-envio', type=int, default=8, help='Peticiones POST simultáneas como máximo')
+    parser.add_argument('--espera', type=float, default=3, help='Segundos de margen para las últimas entregas')
+    parser.add_argument('--semilla', type=int, default=1)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.semilla)
+    tamanos = parsear_salas(args.salas)
+
+    with tempfile.TemporaryDirectory() as directorio:
+        ruta_db = os.path.join(directorio, 'carga.db')
+        miembros = preparar_db(ruta_db, args.clientes, tamanos)
+        secreto = secrets.token_hex(32)
+        tokens = emitir_tokens(secreto, range(1, args.clientes + 1))
+
+        puerto = puerto_libre()
+        url = f"http://127.0.0.1:{puerto}"
+        registro = open(os.path.join(directorio, 'servidor.log'), 'w')
+        servidor = subprocess.Popen(
+            [sys.executable, '-c', LANZADOR, str(puerto)], cwd=DIRECTORIO_BACKEND,
+            env=dict(os.environ, DATABASE_URL=f"sqlite:///{ruta_db}", JWT_SECRET_KEY=secreto),
+            stdout=subprocess.DEVNULL, stderr=registro,
+        )
+        monitor = MonitorProceso(servidor.pid)
+        trabajadores = []
+        fin = multiprocessing.Event()
+        try:
+            esperar_servidor(url, servidor)
+            monitor.start()
+
+            conectados_q, resultados_q = multiprocessing.Queue(), multiprocessing.Queue()
+            todos = list(tokens.items())
+            for i in range(args.procesos):
+                parte = todos[i::args.procesos]
+                proceso = multiprocessing.Process(
+                    target=trabajador, args=(url, parte, conectados_q, resultados_q, fin), daemon=True
+                )
+                proceso.start()
+                trabajadores.append(proceso)
+
+            inicio_conexion = time.monotonic()
+            conectados = set()
+            for _ in trabajadores:
+                conectados.update(conectados_q.get())
+            segundos_conexion = time.monotonic() - inicio_conexion
+            print(f"Conectados {len(conectados)}/{args.clientes} clientes en {segundos_conexion:.1f}s "
+                  f"({len(tamanos)} salas, {args.procesos} procesos)")
+
+            monitor.medir_desde_ahora()
+            aceptados, latencias_post, errores, transcurrido = enviar_mensajes(
+                url, miembros, tokens, args.ritmo, args.duracion, args.hilos_envio, rnd
+            )
+            time.sleep(args.espera)
+            monitor.detener()
+
+            fin.set()
+            resultados = [resultados_q.get(timeout=60) for _ in trabajadores]
+        finally:
+            fin.set()
+            for proceso in trabajadores:
+                proceso.join(timeout=10)
+            servidor.terminate()
+            servidor.wait(timeout=10)
+            registro.close()
+
+    latencias = [l for r in resultados for l in r["latencias"]]
+    recibidos = sum(r["recibidos"] for r in resultados)
+    resyncs = sum(r["resyncs"] for r in resultados)
+    esperados = sum(sum(1 for u in miembros[sala_id] if u in conectados) for sala_id in aceptados)
+    perdidos = esperados - recibidos
+
+    print(f"Mensajes aceptados {len(aceptados)} en {transcurrido:.1f}s "
+          f"({len(aceptados) / transcurrido:.1f}/s, objetivo {args.ritmo:g}/s), errores {errores}")
+    print(f"Entregas: esperadas {esperados}, recibidas {recibidos}, perdidas {perdidos} "
+          f"({perdidos / max(1, esperados):.2%}), resync_necesario {resyncs}")
+
+    print(f"\n{'LATENCIA (ms)':<26} {'P50':>9} {'P95':>9} {'P99':>9} {'MÁX':>9}")
+    print("-" * 66)
+    for nombre, valores in (("POST mensaje", latencias_post), ("entrega extremo a extremo", latencias)):
+        p = percentiles(valores)
+        if p:
+            print(f"{nombre:<26} " + " ".join(f"{p[k] * 1000:>9.1f}" for k in ("p50", "p95", "p99", "max")))
+
+    print(f"\nServidor: CPU media {monitor.cpu_media():.0f}% de un núcleo, "
+          f"RSS máxima {monitor.rss_max / 2**20:.0f} MiB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Comprueba los planes de ejecución de las consultas de DatabaseManager.
+
+Ejecuta cada operación de DatabaseManager contra una base de datos generada
+(la misma que usa bench_database.py), recoge las sentencias SQL que emite y
+obtiene su ``EXPLAIN QUERY PLAN`` con los mismos parámetros. Falla (código de
+salida 1) si:
+
+- alguna sentencia recorre entera (``SCAN``) una tabla grande y la operación
+  no lo tiene permitido de forma explícita en ``OPERACIONES``;
+- la operación no usa los índices que se esperan de ella.
+
+Así, un cambio en una consulta o en los índices que la haga recorrer una
+tabla completa se detecta antes de llegar a producción. Se ejecuta como una
+prueba más:
+
+    python benchmarks/comprobar_planes.py            # conjunto 'mediano'
+    python benchmarks/comprobar_planes.py --tamano pequeno -v
+"""
+import argparse
+import os
+import random
+import re
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event  # noqa: E402
+
+from database import DatabaseManager  # noqa: E402
+from bench_database import Escenario, TAMANOS, preparar_datos  # noqa: E402
+
+# Tablas que crecen con el uso: recorrerlas enteras no escala
+TABLAS_GRANDES = {'usuarios', 'salas', 'usuarios_salas', 'mensajes', 'eventos_sala', 'room_summary', 'adjuntos'}
+
+# Índices automáticos de las claves primarias compuestas y únicas
+PK_USUARIOS_SALAS = 'sqlite_autoindex_usuarios_salas_1'
+UNICO_USUARIOS_NOMBRE = 'sqlite_autoindex_usuarios_1'
+
+# Operación -> (llamada, índices que deben aparecer en su plan, SCAN permitidos {tabla: motivo})
+OPERACIONES = {
+    "get_usuario_por_nombre": (
+        lambda g, e: g.get_usuario_por_nombre(f"usuario{e.usuario():07d}"), {UNICO_USUARIOS_NOMBRE}, {}),
+    "get_usuario_por_id": (lambda g, e: g.get_usuario_por_id(e.usuario()), set(), {}),
+    "listar_usuarios": (
+        lambda g, e: g.listar_usuarios(), set(), {'usuarios': 'devuelve todos los usuarios'}),
+    "buscar_usuarios_por_nombre": (
+        lambda g, e: g.buscar_usuarios_por_nombre(f"usuario{e.usuario():07d}"[:-2]),
+        {'ix_usuarios_nombre_minusculas'}, {}),
+    "get_sala_por_id": (lambda g, e: g.get_sala_por_id(e.sala_grande), set(), {}),
+    "listar_salas_usuario": (
+        lambda g, e: g.listar_salas(usuario_id=e.membresia()[1]), {PK_USUARIOS_SALAS}, {}),
+    "listar_salas_publicas": (
+        lambda g, e: g.listar_salas(solo_publicas=True), set(), {'salas': 'devuelve todas las salas públicas'}),
+    "listar_salas_con_no_leidos": (
+        lambda g, e: g.listar_salas_con_no_leidos(e.membresia()[1]),
+        {PK_USUARIOS_SALAS, 'ix_mensajes_sala_id'}, {}),
+    "es_admin": (lambda g, e: g.es_admin(*e.rnd.choice(e.admins)), {PK_USUARIOS_SALAS}, {}),
+    "es_miembro": (lambda g, e: g.es_miembro(*e.membresia()), {PK_USUARIOS_SALAS}, {}),
+    "listar_usuarios_de_sala": (
+        lambda g, e: g.listar_usuarios_de_sala(e.sala_grande), {'ix_usuarios_salas_sala_leido'}, {}),
+    "listar_miembros_de_sala": (
+        lambda g, e: g.listar_miembros_de_sala(e.sala_grande), {'ix_usuarios_salas_sala_leido'}, {}),
+    "listar_marcas_de_lectura": (
+        lambda g, e: g.listar_marcas_de_lectura(e.sala_grande, e.mensaje_profundo),
+        {'ix_usuarios_salas_sala_leido'}, {}),
+    "marcar_leidos": (
+        lambda g, e: g.marcar_leidos([(*reversed(e.membresia()), e.mensaje_profundo)]), {PK_USUARIOS_SALAS}, {}),
+    "get_eventos_desde": (lambda g, e: g.get_eventos_desde(e.sala_grande, 0, 100), {'ix_eventos_sala_sala_id'}, {}),
+    "purgar_eventos_sala": (
+        lambda g, e: g.purgar_eventos(501, e.sala_grande), {'ix_eventos_sala_sala_id'}, {}),
+    "purgar_eventos": (
+        lambda g, e: g.purgar_eventos(501), {'ix_eventos_sala_sala_id'},
+        {'salas': 'recorre todas las salas', 'eventos_sala': 'busca eventos de salas eliminadas'}),
+    "get_ultimo_evento": (lambda g, e: g.get_ultimo_evento(e.sala_grande), {'ix_eventos_sala_sala_id'}, {}),
+    "get_mensajes_por_sala": (
+        lambda g, e: g.get_mensajes_por_sala(e.sala_grande, 50), {'ix_mensajes_sala_id'}, {}),
+    "get_mensajes_paginados": (
+        lambda g, e: g.get_mensajes_paginados(e.sala_grande, limite=50),
+        {'ix_mensajes_sala_id', 'ix_adjuntos_mensaje_id'}, {}),
+    "get_mensajes_paginados_profundo": (
+        lambda g, e: g.get_mensajes_paginados(e.sala_grande, antes_de_id=e.mensaje_profundo, limite=50),
+        {'ix_mensajes_sala_id', 'ix_adjuntos_mensaje_id'}, {}),
+    "get_mensaje_por_id": (lambda g, e: g.get_mensaje_por_id(e.mensaje_profundo), set(), {}),
+    "get_adjunto_por_id": (lambda g, e: g.get_adjunto_por_id(1), set(), {}),
+    "agregar_mensaje": (lambda g, e: g.agregar_mensaje("prueba", *e.membresia()), set(), {}),
+    "actualizar_mensaje": (lambda g, e: g.actualizar_mensaje(e.mensaje_profundo, "editado"), set(), {}),
+    "eliminar_mensaje_por_id": (
+        lambda g, e: g.eliminar_mensaje_por_id(e.mensaje_profundo), {'ix_adjuntos_mensaje_id'}, {}),
+    "recalcular_contadores_sala": (
+        lambda g, e: g.recalcular_contadores_salas(e.sala_grande),
+        {'ix_mensajes_sala_id', 'ix_usuarios_salas_sala_leido'}, {}),
+    "recalcular_resumen_sala": (
+        lambda g, e: g.recalcular_resumenes_salas(e.sala_grande), {'ix_mensajes_sala_id'}, {}),
+}
+
+PATRON_TABLA = re.compile(r'^(SCAN|SEARCH) (\w+)(?: AS \w+)?(?: USING (?:COVERING )?INDEX (\w+))?')
+PATRON_ALIAS = re.compile(r'_\d+$')
+
+
+class RegistroSentencias:
+    """Guarda las sentencias que ejecuta el motor mientras está activo"""
+
+    def __init__(self, engine):
+        self.sentencias = []
+        self.activo = False
+        event.listen(engine, 'before_cursor_execute', self._anotar)
+
+    def _anotar(self, conn, cursor, sql, parametros, contexto, executemany):
+        if not self.activo or sql.lstrip().upper().startswith(('PRAGMA', 'EXPLAIN', 'SAVEPOINT', 'RELEASE')):
+            return
+        if executemany:
+            parametros = parametros[0] if parametros else ()
+        self.sentencias.append((sql, parametros))
+
+
+def plan_de(conn, sql, parametros):
+    """Filas de EXPLAIN QUERY PLAN como texto"""
+    return [fila[3] for fila in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}", parametros)]
+
+
+def analizar(plan, permitidos):
+    """Devuelve (índices usados, SCAN no permitidos, avisos)"""
+    indices, scans, avisos = set(), [], []
+    for detalle in plan:
+        if detalle.startswith('USE TEMP B-TREE'):
+            avisos.append(detalle)
+        coincidencia = PATRON_TABLA.match(detalle)
+        if not coincidencia:
+            continue
+        operacion, tabla, indice = coincidencia.groups()
+        tabla = PATRON_ALIAS.sub('', tabla)
+        if indice:
+            indices.add(indice)
+        if operacion == 'SCAN' and tabla in TABLAS_GRANDES and tabla not in permitidos:
+            scans.append(detalle)
+    return indices, scans, avisos
+
+
+def comprobar(tamano, detallado):
+    ruta = preparar_datos(tamano)
+    gestor = DatabaseManager(f"sqlite:///{ruta}")
+    # Crea en la base de datos generada los índices añadidos después de generarla
+    gestor.init_db()
+    registro = RegistroSentencias(gestor.engine)
+    session = gestor.Session()
+    # Las operaciones que confirman la transacción no deben cambiar los datos
+    session.commit = session.flush
+    DatabaseManager.set_session(session)
+    esc = Escenario(session, random.Random(1))
+    fallos = 0
+
+    try:
+        for nombre, (llamada, esperados, permitidos) in OPERACIONES.items():
+            registro.sentencias.clear()
+            registro.activo = True
+            try:
+                llamada(gestor, esc)
+            finally:
+                registro.activo = False
+
+            indices, problemas, avisos = set(), [], []
+            conn = session.connection()
+            for sql, parametros in registro.sentencias:
+                usados, scans, temporales = analizar(plan_de(conn, sql, parametros), permitidos)
+                indices |= usados
+                problemas += [f"{scan}  <-  {' '.join(sql.split())[:120]}" for scan in scans]
+                avisos += temporales
+            faltan = esperados - indices
+            session.rollback()
+            session.expunge_all()
+
+            correcto = not problemas and not faltan
+            fallos += not correcto
+            print(f"{'OK   ' if correcto else 'FALLO'} {nombre}")
+            for problema in problemas:
+                print(f"        recorre una tabla grande: {problema}")
+            if faltan:
+                print(f"        no usa los índices esperados: {', '.join(sorted(faltan))}")
+            if detallado:
+                for sql, parametros in registro.sentencias:
+                    print(f"        {' '.join(sql.split())[:150]}")
+                    for detalle in plan_de(session.connection(), sql, parametros):
+                        print(f"          - {detalle}")
+                session.rollback()
+            elif avisos:
+                print(f"        aviso: {'; '.join(sorted(set(avisos)))}")
+    finally:
+        session.rollback()
+        session.close()
+        DatabaseManager.set_session(None)
+        gestor.engine.dispose()
+    return fallos
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--tamano', default='mediano', choices=list(TAMANOS), help='Conjunto de datos generado')
+    parser.add_argument('-v', '--detallado', action='store_true', help='Muestra cada sentencia con su plan')
+    args = parser.parse_args()
+
+    fallos = comprobar(args.tamano, args.detallado)
+    if fallos:
+        print(f"\n{fallos} operaciones con planes no válidos.")
+        sys.exit(1)
+    print(f"\nLos planes de las {len(OPERACIONES)} operaciones son correctos.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Reproduce contra un backend el tráfico capturado con CAPTURA_TRAFICO.
+
+Lee el NDJSON que escribe ``captura_trafico.py`` y repite cada petición con
+el mismo método, ruta y cuerpo (ya saneados), respetando los intervalos
+originales a la velocidad pedida (1x, 10x...) o tan rápido como permita la
+concurrencia (``--velocidad max``). Al final muestra, por endpoint, el
+rendimiento, la latencia y las respuestas con un estado distinto del
+capturado.
+
+Cada petición se firma con un token del usuario que la hizo, generado con el
+JWT_SECRET_KEY del backend de destino, así que hay que reproducir contra una
+copia de los mismos datos (por ejemplo importada con exportar_importar.py).
+Las peticiones de inicio de sesión no se reproducen por defecto porque las
+claves se capturan saneadas.
+
+Uso:
+    JWT_SECRET_KEY=... python benchmarks/reproducir_trafico.py captura.ndjson \\
+        --url http://127.0.0.1:5000 --velocidad 10 --concurrencia 32
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+# Rutas cuyo cuerpo lleva credenciales saneadas y no se pueden repetir
+RUTAS_AUTENTICACION = ('/api/auth/login', '/api/auth/register')
+
+
+def leer_captura(ruta, incluir_autenticacion, limite=None):
+    registros = []
+    with open(ruta, encoding='utf-8') as f:
+        for linea in f:
+            if not linea.strip():
+                continue
+            registro = json.loads(linea)
+            if not incluir_autenticacion and registro['ruta'].startswith(RUTAS_AUTENTICACION):
+                continue
+            registros.append(registro)
+            if limite and len(registros) >= limite:
+                break
+    # Se escriben al terminar cada petición: se reordenan por momento de llegada
+    registros.sort(key=lambda r: r['t'] - r.get('ms', 0) / 1000)
+    return registros
+
+
+class Firmante:
+    """Tokens de acceso por usuario, firmados con el secreto del backend"""
+
+    def __init__(self, secreto, token_fijo=None):
+        self.token_fijo = token_fijo
+        self._tokens = {}
+        self._lock = threading.Lock()
+        self._app = None
+        if secreto:
+            from flask import Flask
+            from flask_jwt_extended import JWTManager
+
+            self._app = Flask(__name__)
+            self._app.config['JWT_SECRET_KEY'] = secreto
+            JWTManager(self._app)
+
+    def token(self, usuario):
+        if usuario is None or self._app is None:
+            return self.token_fijo
+        with self._lock:
+            if usuario not in self._tokens:
+                from flask_jwt_extended import create_access_token
+                with self._app.app_context():
+                    self._tokens[usuario] = create_access_token(identity=str(usuario))
+            return self._tokens[usuario]
+
+
+def percentil(ordenados, p):
+    return ordenados[max(0, int(len(ordenados) * p) - 1)]
+
+
+def reproducir(registros, url, velocidad, concurrencia, firmante, verificar_tls):
+    import requests
+
+    resultados = defaultdict(list)  # endpoint -> [(ms, estado, estado_capturado)]
+    retrasos = []
+    errores_red = defaultdict(int)
+    lock = threading.Lock()
+    huecos = threading.BoundedSemaphore(concurrencia)
+    locales = threading.local()
+
+    def ejecutar(registro, clave):
+        try:
+            sesion = getattr(locales, 'sesion', None)
+            if sesion is None:
+                sesion = locales.sesion = requests.Session()
+                sesion.verify = verificar_tls
+            cabeceras = {}
+            token = firmante.token(registro.get('usuario'))
+            if token:
+                cabeceras['Authorization'] = f"Bearer {token}"
+            inicio = time.perf_counter()
+            try:
+                respuesta = sesion.request(
+                    registro['metodo'], url + registro['ruta'], json=registro.get('cuerpo'),
+                    headers=cabeceras, timeout=30,
+                )
+                ms = (time.perf_counter() - inicio) * 1000
+                with lock:
+                    resultados[clave].append((ms, respuesta.status_code, registro.get('estado')))
+            except requests.RequestException:
+                with lock:
+                    errores_red[clave] += 1
+        finally:
+            huecos.release()
+
+    t0 = registros[0]['t'] - registros[0].get('ms', 0) / 1000 if registros else 0
+    comienzo = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrencia) as ejecutor:
+        for registro in registros:
+            if velocidad is not None:
+                llegada = registro['t'] - registro.get('ms', 0) / 1000
+                previsto = comienzo + (llegada - t0) / velocidad
+                espera = previsto - time.monotonic()
+                if espera > 0:
+                    time.sleep(espera)
+            huecos.acquire()
+            if velocidad is not None:
+                retrasos.append(max(0.0, time.monotonic() - previsto))
+            clave = f"{registro['metodo']} {registro.get('endpoint') or registro['ruta'].split('?')[0]}"
+            ejecutor.submit(ejecutar, registro, clave)
+    return resultados, errores_red, retrasos, time.monotonic() - comienzo
+
+
+def informe(resultados, errores_red, retrasos, segundos):
+    total = sum(len(v) for v in resultados.values()) + sum(errores_red.values())
+    print(f"Peticiones: {total} en {segundos:.1f}s ({total / max(segundos, 1e-9):.1f}/s)")
+    if retrasos:
+        ordenados = sorted(retrasos)
+        print(f"Retraso sobre el calendario: p50 {percentil(ordenados, 0.5) * 1000:.1f} ms, "
+              f"p95 {percentil(ordenados, 0.95) * 1000:.1f} ms (si crece, falta concurrencia o el servidor no da abasto)")
+
+    print(f"\n{'ENDPOINT':<46} {'N':>6} {'/s':>7} {'P50 ms':>8} {'P95 ms':>8} {'P99 ms':>8} "
+          f"{'5xx':>5} {'≠EST':>5} {'RED':>5}")
+    print("-" * 110)
+    for clave in sorted(set(resultados) | set(errores_red), key=lambda c: -len(resultados.get(c, []))):
+        medidas = resultados.get(clave, [])
+        tiempos = sorted(m[0] for m in medidas)
+        fallos = sum(1 for _, estado, _ in medidas if estado >= 500)
+        distintos = sum(1 for _, estado, capturado in medidas if capturado is not None and estado != capturado)
+        fila = f"{clave[:46]:<46} {len(medidas):>6} {len(medidas) / max(segundos, 1e-9):>7.1f} "
+        if tiempos:
+            fila += " ".join(f"{percentil(tiempos, p):>8.1f}" for p in (0.5, 0.95, 0.99))
+        else:
+            fila += " ".join(f"{'-':>8}" for _ in range(3))
+        print(fila + f" {fallos:>5} {distintos:>5} {errores_red.get(clave, 0):>5}")
+    print("\n≠EST: respuestas con un estado distinto del capturado. RED: errores de conexión.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('captura', help='Fichero NDJSON de CAPTURA_TRAFICO')
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help='URL base del backend')
+    parser.add_argument('--velocidad', default='1',
+                        help="Factor sobre el ritmo capturado (1, 10...) o 'max' para no esperar")
+    parser.add_argument('--concurrencia', type=int, default=16, help='Peticiones simultáneas como máximo')
+    parser.add_argument('--jwt-secret', default=os.environ.get('JWT_SECRET_KEY'),
+                        help='Secreto JWT del backend para firmar por usuario (por defecto JWT_SECRET_KEY)')
+    parser.add_argument('--token', help='Token para todas las peticiones si no se da el secreto')
+    parser.add_argument('--incluir-autenticacion', action='store_true',
+                        help='Reproduce también login y registro (fallarán: las claves están saneadas)')
+    parser.add_argument('--limite', type=int, help='Reproduce solo las primeras N peticiones')
+    parser.add_argument('--inseguro', action='store_true', help='No verifica el certificado TLS')
+    args = parser.parse_args()
+
+    if args.velocidad == 'max':
+        velocidad = None
+    else:
+        velocidad = float(args.velocidad)
+        if velocidad <= 0:
+            parser.error("--velocidad debe ser mayor que 0 o 'max'")
+    if not args.jwt_secret and not args.token:
+        print("Aviso: sin --jwt-secret ni --token las peticiones autenticadas darán 401.", file=sys.stderr)
+
+    registros = leer_captura(args.captura, args.incluir_autenticacion, args.limite)
+    if not registros:
+        print("La captura no tiene peticiones que reproducir.")
+        return
+    duracion = registros[-1]['t'] - registros[0]['t']
+    print(f"{len(registros)} peticiones capturadas en {duracion:.1f}s; "
+          f"reproduciendo a {'velocidad máxima' if velocidad is None else f'{velocidad:g}x'} "
+          f"con concurrencia {args.concurrencia}\n")
+
+    firmante = Firmante(args.jwt_secret, args.token)
+    resultados, errores_red, retrasos, segundos = reproducir(
+        registros, args.url.rstrip('/'), velocidad, args.concurrencia, firmante, not args.inseguro
+    )
+    informe(resultados, errores_red, retrasos, segundos)
+
+
+if __name__ == '__main__':
+    main()
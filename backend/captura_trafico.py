@@ -0,0 +1,149 @@
+"""
+Captura opcional de las peticiones HTTP del backend para reproducirlas después.
+
+Se activa con la variable de entorno CAPTURA_TRAFICO, que indica el fichero
+NDJSON donde se añade una línea por petición:
+
+    {"t": 1718000000.123, "metodo": "GET", "ruta": "/api/rooms/3/messages?limit=50",
+     "endpoint": "/api/rooms/<int:room_id>/messages", "usuario": "7",
+     "cuerpo": null, "estado": 200, "ms": 4.2}
+
+Los datos se sanean antes de escribirse: nunca se guardan cabeceras (ni el
+token ni las cookies), las claves y tokens del cuerpo o de la URL (también de
+las rutas de las subpeticiones de /api/batch) se sustituyen por "***" y el
+texto de los mensajes y búsquedas por "x" repetida, con la misma longitud
+para que la carga reproducida pese lo mismo. Solo se conserva el ID interno del
+usuario, que es lo que necesita ``benchmarks/reproducir_trafico.py`` para
+firmar las peticiones reproducidas.
+
+Las líneas se escriben desde un hilo aparte con una cola acotada: si el disco
+no da abasto se descartan capturas en lugar de frenar las peticiones.
+"""
+import json
+import logging
+import queue
+import random
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode
+
+from flask import g, request
+from flask_jwt_extended import decode_token
+
+# Valores que se sustituyen por "***"
+CAMPOS_SECRETOS = {'password', 'clave', 'token', 'access_token', 'refresh_token', 'secreto'}
+# Texto libre que se sustituye por "x" con la misma longitud
+CAMPOS_TEXTO = {'contenido', 'query'}
+# Rutas con query string dentro del cuerpo (subpeticiones de POST /api/batch)
+CAMPOS_RUTA = {'path'}
+
+# Rutas que no son tráfico de la API
+PREFIJOS_EXCLUIDOS = ('/socket.io', '/api/internal/', '/api/metrics')
+
+
+def sanear(valor, clave=None):
+    """Copia de ``valor`` sin secretos ni texto de los usuarios"""
+    if isinstance(valor, dict):
+        return {k: sanear(v, k) for k, v in valor.items()}
+    if isinstance(valor, list):
+        return [sanear(v, clave) for v in valor]
+    if clave in CAMPOS_SECRETOS and valor is not None:
+        return "***"
+    if clave in CAMPOS_TEXTO and isinstance(valor, str):
+        return "x" * len(valor)
+    if clave in CAMPOS_RUTA and isinstance(valor, str):
+        ruta, _, consulta = valor.partition('?')
+        return sanear_ruta(ruta, consulta)
+    return valor
+
+
+def sanear_ruta(ruta, consulta):
+    if not consulta:
+        return ruta
+    parametros = [(k, sanear(v, k)) for k, v in parse_qsl(consulta, keep_blank_values=True)]
+    return f"{ruta}?{urlencode(parametros, safe='*')}"
+
+
+class CapturaTrafico:
+    """
+    Registra las peticiones de una aplicación Flask en un fichero NDJSON.
+
+    Args:
+        app: Aplicación Flask
+        ruta: Fichero donde se añaden las capturas
+        muestreo: Fracción de peticiones que se capturan (0-1)
+        capacidad: Capturas pendientes de escribir como máximo
+    """
+
+    def __init__(self, app, ruta, muestreo=1.0, capacidad=10000):
+        self.ruta = ruta
+        self.muestreo = muestreo
+        self._cola = queue.Queue(maxsize=capacidad)
+        self.capturadas = 0
+        self.descartadas = 0
+
+        app.before_request(self._antes)
+        app.after_request(self._despues)
+        threading.Thread(target=self._escribir, name="captura-trafico", daemon=True).start()
+
+    def _antes(self):
+        if request.path.startswith(PREFIJOS_EXCLUIDOS) or random.random() >= self.muestreo:
+            return
+        g.captura_inicio = time.perf_counter()
+
+    def _despues(self, response):
+        inicio = g.pop('captura_inicio', None)
+        if inicio is None:
+            return response
+
+        registro = {
+            "t": round(time.time(), 3),
+            "metodo": request.method,
+            "ruta": sanear_ruta(request.path, request.query_string.decode('utf-8', 'replace')),
+            "endpoint": request.url_rule.rule if request.url_rule else None,
+            "usuario": self._usuario(),
+            "cuerpo": sanear(request.get_json(silent=True)),
+            "estado": response.status_code,
+            "ms": round((time.perf_counter() - inicio) * 1000, 2),
+        }
+        try:
+            self._cola.put_nowait(registro)
+            self.capturadas += 1
+        except queue.Full:
+            self.descartadas += 1
+        return response
+
+    @staticmethod
+    def _usuario():
+        cabecera = request.headers.get('Authorization', '')
+        if not cabecera.startswith('Bearer '):
+            return None
+        try:
+            return str(decode_token(cabecera[7:])['sub'])
+        except Exception:
+            return None
+
+    def _escribir(self):
+        with open(self.ruta, 'a', encoding='utf-8') as fichero:
+            while True:
+                registros = [self._cola.get()]
+                # Agrupa lo que se haya acumulado en una sola escritura
+                while len(registros) < 500:
+                    try:
+                        registros.append(self._cola.get_nowait())
+                    except queue.Empty:
+                        break
+                try:
+                    fichero.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in registros))
+                    fichero.flush()
+                except OSError as e:
+                    self.descartadas += len(registros)
+                    logging.error(f"Error al escribir la captura de tráfico: {str(e)}")
+
+    def estadisticas(self):
+        return {
+            "fichero": self.ruta,
+            "capturadas": self.capturadas,
+            "descartadas": self.descartadas,
+            "pendientes": self._cola.qsize(),
+        }
@@ -0,0 +1,238 @@
+"""
+Colas de salida acotadas por conexión de Socket.IO.
+
+Cada socket conectado tiene su propia cola de eventos pendientes con un tamaño
+máximo. Los eventos de una sala se encolan una sola vez por conexión (se
+comparte el mismo diccionario entre todas las colas) y una tarea en segundo
+plano los va entregando a cada cliente solo cuando el transporte de ese
+cliente ha vaciado lo que tenía pendiente. Así un cliente lento no hace que el
+servidor acumule sin límite el tráfico de la sala.
+
+Cuando la cola de una conexión se llena se aplica una de estas políticas:
+
+- ``descartar_antiguos``: se descarta el evento más antiguo.
+- ``resync``: se vacía la cola y se envía al cliente un único evento
+  ``resync_necesario`` con las salas afectadas para que recargue su historial.
+- ``desconectar``: se desconecta al cliente.
+
+Cada conexión tiene además un formato de serialización (JSON o MessagePack,
+ver ``serializacion.py``) que se aplica al entregar los eventos.
+"""
+import logging
+import threading
+from collections import deque
+
+from serializacion import CargaEvento, FORMATO_JSON
+
+POLITICA_DESCARTAR = 'descartar_antiguos'
+POLITICA_RESYNC = 'resync'
+POLITICA_DESCONECTAR = 'desconectar'
+POLITICAS = (POLITICA_DESCARTAR, POLITICA_RESYNC, POLITICA_DESCONECTAR)
+
+EVENTO_RESYNC = 'resync_necesario'
+
+
+class ColaConexion:
+    """Eventos pendientes de entrega para un único socket"""
+    __slots__ = ('sid', 'usuario_id', 'formato', 'eventos', 'salas_resync', 'descartados')
+
+    def __init__(self, sid, usuario_id, max_eventos, formato=FORMATO_JSON):
+        self.sid = sid
+        self.usuario_id = usuario_id
+        self.formato = formato
+        self.eventos = deque(maxlen=max_eventos)
+        self.salas_resync = set()
+        self.descartados = 0
+
+
+class GestorColasSocket:
+    """
+    Gestiona las colas de salida de todas las conexiones de Socket.IO.
+
+    Args:
+        socketio: Instancia de flask_socketio.SocketIO
+        max_eventos: Número máximo de eventos pendientes por conexión
+        politica: Política a aplicar cuando una cola se llena
+        max_pendientes_transporte: Paquetes que puede tener el transporte de
+            un socket sin enviar antes de dejar de entregarle eventos
+        lote: Número máximo de eventos entregados a un socket por iteración
+        intervalo: Segundos entre iteraciones de la tarea de entrega
+    """
+
+    def __init__(self, socketio, max_eventos=256, politica=POLITICA_RESYNC,
+                 max_pendientes_transporte=32, lote=64, intervalo=0.02,
+                 namespace='/'):
+        if politica not in POLITICAS:
+            raise ValueError(f"Política de cola desconocida: {politica}")
+
+        self.socketio = socketio
+        self.max_eventos = max_eventos
+        self.politica = politica
+        self.max_pendientes_transporte = max_pendientes_transporte
+        self.lote = lote
+        self.intervalo = intervalo
+        self.namespace = namespace
+
+        self._colas = {}
+        self._lock = threading.Lock()
+        self._tarea = None
+
+        # Contadores acumulados desde el arranque
+        self._eventos_encolados = 0
+        self._eventos_entregados = 0
+        self._eventos_descartados = 0
+        self._resyncs = 0
+        self._desconexiones = 0
+
+    # ===== REGISTRO DE CONEXIONES =====
+
+    def registrar(self, sid, usuario_id=None, formato=FORMATO_JSON):
+        """Crea la cola de una conexión nueva y arranca la tarea de entrega si hace falta"""
+        with self._lock:
+            self._colas[sid] = ColaConexion(sid, usuario_id, self.max_eventos, formato)
+            if self._tarea is None:
+                self._tarea = self.socketio.start_background_task(self._bucle_entrega)
+
+    def eliminar(self, sid):
+        """Libera la cola de una conexión cerrada"""
+        with self._lock:
+            self._colas.pop(sid, None)
+
+    def usuario_de(self, sid):
+        """Devuelve el ID del usuario de una conexión registrada o None"""
+        cola = self._colas.get(sid)
+        return cola.usuario_id if cola else None
+
+    # ===== ENCOLADO =====
+
+    def difundir(self, evento, datos, sala_id):
+        """
+        Encola un evento para todas las conexiones unidas a una sala.
+
+        Args:
+            evento: Nombre del evento de Socket.IO
+            datos: Datos del evento (se comparten entre todas las colas)
+            sala_id: ID de la sala a la que pertenece el evento
+        """
+        carga = CargaEvento(datos)
+        for sid in self._participantes(f"sala_{sala_id}"):
+            self.encolar(sid, evento, carga, sala_id)
+
+    def encolar(self, sid, evento, datos, sala_id=None):
+        """Encola un evento para una conexión aplicando la política si la cola está llena"""
+        carga = datos if isinstance(datos, CargaEvento) else CargaEvento(datos)
+        desconectar = False
+        with self._lock:
+            cola = self._colas.get(sid)
+            if cola is None:
+                return
+
+            self._eventos_encolados += 1
+            if len(cola.eventos) >= self.max_eventos:
+                if self.politica == POLITICA_DESCARTAR:
+                    # deque con maxlen descarta el más antiguo al añadir
+                    cola.descartados += 1
+                    self._eventos_descartados += 1
+                elif self.politica == POLITICA_RESYNC:
+                    descartados = len(cola.eventos) + 1
+                    cola.salas_resync.update(s for _, _, s in cola.eventos if s is not None)
+                    if sala_id is not None:
+                        cola.salas_resync.add(sala_id)
+                    cola.eventos.clear()
+                    cola.descartados += descartados
+                    self._eventos_descartados += descartados
+                    self._resyncs += 1
+                    return
+                else:
+                    self._colas.pop(sid, None)
+                    self._eventos_descartados += len(cola.eventos) + 1
+                    self._desconexiones += 1
+                    desconectar = True
+
+            if not desconectar:
+                cola.eventos.append((evento, carga, sala_id))
+
+        if desconectar:
+            logging.warning(f"Desconectando socket lento {sid} (usuario {cola.usuario_id})")
+            try:
+                self.socketio.server.disconnect(sid, namespace=self.namespace)
+            except Exception as e:
+                logging.warning(f"Error al desconectar el socket {sid}: {str(e)}")
+
+    # ===== ENTREGA =====
+
+    def _bucle_entrega(self):
+        """Tarea en segundo plano que entrega los eventos pendientes"""
+        while True:
+            try:
+                self._entregar_pendientes()
+            except Exception as e:
+                logging.error(f"Error en la entrega de eventos de socket: {str(e)}")
+            self.socketio.sleep(self.intervalo)
+
+    def _entregar_pendientes(self):
+        with self._lock:
+            colas = [c for c in self._colas.values() if c.eventos or c.salas_resync]
+
+        for cola in colas:
+            disponibles = self.max_pendientes_transporte - self._pendientes_transporte(cola.sid)
+            if disponibles <= 0:
+                continue
+
+            with self._lock:
+                salas_resync = cola.salas_resync
+                cola.salas_resync = set()
+                lote = []
+                while cola.eventos and len(lote) < min(disponibles, self.lote):
+                    lote.append(cola.eventos.popleft())
+
+            if salas_resync:
+                marcador = CargaEvento({"salas": sorted(salas_resync)})
+                self.socketio.emit(EVENTO_RESYNC, marcador.para(cola.formato), to=cola.sid)
+            for evento, carga, _ in lote:
+                self.socketio.emit(evento, carga.para(cola.formato), to=cola.sid)
+            self._eventos_entregados += len(lote)
+
+    def _participantes(self, sala):
+        try:
+            participantes = self.socketio.server.manager.get_participants(self.namespace, sala)
+            # Según la versión de python-socketio se obtiene sid o (sid, eio_sid)
+            return [p[0] if isinstance(p, tuple) else p for p in participantes]
+        except Exception:
+            return []
+
+    def _pendientes_transporte(self, sid):
+        """Paquetes que el transporte de Engine.IO aún no ha enviado al cliente"""
+        try:
+            servidor = self.socketio.server
+            eio_sid = servidor.manager.eio_sid_from_sid(sid, self.namespace)
+            socket = servidor.eio.sockets.get(eio_sid)
+            return socket.queue.qsize() if socket else 0
+        except Exception:
+            return 0
+
+    # ===== MÉTRICAS =====
+
+    def estadisticas(self):
+        """Devuelve un diccionario con la profundidad de las colas y los contadores de descartes"""
+        with self._lock:
+            profundidades = [len(c.eventos) for c in self._colas.values()]
+            conexiones_con_descartes = sum(1 for c in self._colas.values() if c.descartados)
+            formatos = {}
+            for c in self._colas.values():
+                formatos[c.formato] = formatos.get(c.formato, 0) + 1
+
+        return {
+            "politica": self.politica,
+            "max_eventos": self.max_eventos,
+            "conexiones": len(profundidades),
+            "conexiones_por_formato": formatos,
+            "profundidad_total": sum(profundidades),
+            "profundidad_maxima": max(profundidades, default=0),
+            "conexiones_con_descartes": conexiones_con_descartes,
+            "eventos_encolados": self._eventos_encolados,
+            "eventos_entregados": self._eventos_entregados,
+            "eventos_descartados": self._eventos_descartados,
+            "resyncs": self._resyncs,
+            "desconexiones": self._desconexiones,
+        }
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+Compresión opcional del contenido de los mensajes.
+
+Con COMPRESION_MENSAJES=zstd (o zlib) los mensajes de al menos
+COMPRESION_UMBRAL bytes en UTF-8 se guardan comprimidos si así ocupan menos.
+El resto se guarda como texto, igual que antes, así que las bases de datos
+existentes siguen siendo válidas y se pueden comprimir más tarde con el
+subcomando ``comprimir``. Sin zstandard instalado se usa zlib.
+
+El valor comprimido se guarda como BLOB en la misma columna (SQLite admite
+BLOB en una columna de texto): un byte de cabecera con el algoritmo, los 4
+bytes del identificador del diccionario si se usó uno, y los datos. Como el
+texto nunca es un BLOB, basta con el tipo del valor para saber si hay que
+descomprimirlo.
+
+Con COMPRESION_DICCIONARIO se usa un diccionario compartido (entrenado con el
+subcomando ``entrenar``), que es lo que hace rentable comprimir textos
+cortos y los registros pegados que se repiten entre salas. Un valor
+comprimido con un diccionario solo se puede leer con ese mismo diccionario.
+
+En database.py el tipo de la columna codifica y decodifica de forma
+transparente. Las consultas SQL que necesitan el texto (el fragmento de
+room_summary, el cliente de consola y la exportación) usan la función SQL
+``texto_mensaje()``, que registran las conexiones con registrar_funciones().
+
+Uso:
+    python compresion.py entrenar mensajeria.db diccionario.bin
+    COMPRESION_MENSAJES=zstd python compresion.py comprimir mensajeria.db
+"""
+import argparse
+import collections
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # zstandard es opcional
+    zstandard = None
+
+ZLIB = 'zlib'
+ZSTD = 'zstd'
+
+# Primer byte de los valores comprimidos
+_CABECERAS = {ZLIB: 1, ZSTD: 2}
+_ALGORITMOS = {cabecera: nombre for nombre, cabecera in _CABECERAS.items()}
+CON_DICCIONARIO = 0x80
+
+NIVELES = {ZLIB: 6, ZSTD: 3}
+UMBRAL = 512
+TAMANO_DICCIONARIO = 64 * 1024
+# zlib solo aprovecha los últimos 32 KB del diccionario
+TAMANO_DICCIONARIO_ZLIB = 32 * 1024
+
+TAMANO_LOTE = 1000
+
+
+def algoritmos_disponibles():
+    """Devuelve los algoritmos que se pueden usar en este servidor"""
+    if zstandard is None:
+        return (ZLIB,)
+    return (ZLIB, ZSTD)
+
+
+class Codec:
+    """
+    Comprime y descomprime el contenido de los mensajes.
+
+    Args:
+        algoritmo: ``'zstd'``, ``'zlib'`` o None para no comprimir (los valores
+            ya comprimidos se siguen pudiendo leer)
+        umbral: Tamaño mínimo en bytes del texto que se comprime
+        nivel: Nivel de compresión (por defecto, el habitual del algoritmo)
+        diccionario: Contenido del diccionario compartido, o None
+    """
+
+    def __init__(self, algoritmo=None, umbral=UMBRAL, nivel=None, diccionario=None):
+        if algoritmo == ZSTD and zstandard is None:
+            logging.warning("zstandard no está instalado; los mensajes se comprimen con zlib")
+            algoritmo = ZLIB
+        if algoritmo not in (None, ZLIB, ZSTD):
+            raise ValueError(f"Algoritmo de compresión desconocido: {algoritmo}")
+        self.algoritmo = algoritmo
+        self.umbral = umbral
+        self.nivel = nivel if nivel is not None else NIVELES.get(algoritmo)
+        self.diccionario = diccionario
+        self.id_diccionario = zlib.crc32(diccionario).to_bytes(4, 'big') if diccionario else None
+        # Los objetos de zstandard no se pueden compartir entre hilos
+        self._local = threading.local()
+
+    @classmethod
+    def desde_entorno(cls):
+        """Codec configurado con las variables COMPRESION_*"""
+        diccionario = None
+        ruta = os.environ.get('COMPRESION_DICCIONARIO')
+        if ruta:
+            with open(ruta, 'rb') as fichero:
+                diccionario = fichero.read()
+        nivel = os.environ.get('COMPRESION_NIVEL')
+        return cls(
+            algoritmo=os.environ.get('COMPRESION_MENSAJES') or None,
+            umbral=int(os.environ.get('COMPRESION_UMBRAL', UMBRAL)),
+            nivel=int(nivel) if nivel else None,
+            diccionario=diccionario,
+        )
+
+    def _zstd(self):
+        if not hasattr(self._local, 'compresor'):
+            datos = zstandard.ZstdCompressionDict(self.diccionario) if self.diccionario else None
+            self._local.compresor = zstandard.ZstdCompressor(level=self.nivel or NIVELES[ZSTD], dict_data=datos)
+            self._local.descompresor = zstandard.ZstdDecompressor(dict_data=datos)
+        return self._local.compresor, self._local.descompresor
+
+    def codificar(self, texto):
+        """Devuelve el texto tal cual o, si compensa, comprimido como bytes"""
+        if texto is None or self.algoritmo is None:
+            return texto
+        datos = texto.encode('utf-8')
+        if len(datos) < self.umbral:
+            return texto
+
+        if self.algoritmo == ZSTD:
+            comprimido = self._zstd()[0].compress(datos)
+        elif self.diccionario:
+            compresor = zlib.compressobj(self.nivel, zdict=self.diccionario)
+            comprimido = compresor.compress(datos) + compresor.flush()
+        else:
+            comprimido = zlib.compress(datos, self.nivel)
+
+        cabecera = _CABECERAS[self.algoritmo]
+        if self.diccionario:
+            valor = bytes([cabecera | CON_DICCIONARIO]) + self.id_diccionario + comprimido
+        else:
+            valor = bytes([cabecera]) + comprimido
+        return valor if len(valor) < len(datos) else texto
+
+    def decodificar(self, valor):
+        """Devuelve el texto de un valor guardado, comprimido o no"""
+        if not isinstance(valor, (bytes, bytearray, memoryview)):
+            return valor
+        valor = bytes(valor)
+        cabecera, datos = valor[0], valor[1:]
+        algoritmo = _ALGORITMOS.get(cabecera & ~CON_DICCIONARIO)
+        if algoritmo is None:
+            raise ValueError(f"Cabecera de compresión desconocida: {cabecera}")
+
+        diccionario = None
+        if cabecera & CON_DICCIONARIO:
+            if datos[:4] != self.id_diccionario:
+                raise ValueError("El mensaje se comprimió con otro diccionario (COMPRESION_DICCIONARIO)")
+            diccionario, datos = self.diccionario, datos[4:]
+
+        if algoritmo == ZSTD:
+            if zstandard is None:
+                raise RuntimeError("Hay mensajes comprimidos con zstd y zstandard no está instalado")
+            return self._zstd()[1].decompress(datos).decode('utf-8')
+        if diccionario:
+            descompresor = zlib.decompressobj(zdict=diccionario)
+            return (descompresor.decompress(datos) + descompresor.flush()).decode('utf-8')
+        return zlib.decompress(datos).decode('utf-8')
+
+
+codec = Codec.desde_entorno()
+
+
+def codificar(texto):
+    """Codifica un texto con el codec del proceso"""
+    return codec.codificar(texto)
+
+
+def texto_mensaje(valor):
+    """Texto de un contenido guardado (también como función SQL ``texto_mensaje``)"""
+    return codec.decodificar(valor)
+
+
+def registrar_funciones(conexion):
+    """Registra ``texto_mensaje()`` en una conexión sqlite3"""
+    conexion.create_function('texto_mensaje', 1, texto_mensaje, deterministic=True)
+
+
+def muestras(conn, umbral, limite):
+    """Textos de mensajes de al menos ``umbral`` caracteres, de los más recientes a los más antiguos"""
+    cursor = conn.execute(
+        "SELECT texto_mensaje(contenido) FROM mensajes ORDER BY id DESC LIMIT ?", (limite * 10,)
+    )
+    textos = [fila[0] for fila in cursor if len(fila[0]) >= umbral]
+    return textos[:limite]
+
+
+def crear_diccionario(textos, algoritmo, tamano=TAMANO_DICCIONARIO):
+    """
+    Diccionario para ``algoritmo`` de como mucho ``tamano`` bytes a partir de
+    textos de muestra (bytes).
+    """
+    if algoritmo == ZSTD:
+        return zstandard.train_dictionary(tamano, textos).as_bytes()
+    # zlib no entrena diccionarios: se usan los textos más repetidos, con los
+    # más frecuentes al final, que es la parte que mejor aprovecha
+    diccionario = b""
+    for texto, _ in collections.Counter(textos).most_common():
+        if len(diccionario) + len(texto) > min(tamano, TAMANO_DICCIONARIO_ZLIB):
+            break
+        diccionario = texto + diccionario
+    return diccionario
+
+
+def entrenar(ruta_db, ruta_salida, algoritmo, tamano, umbral, limite):
+    """Crea un diccionario con los mensajes largos de la base de datos"""
+    conn = sqlite3.connect(ruta_db)
+    registrar_funciones(conn)
+    try:
+        textos = [texto.encode('utf-8') for texto in muestras(conn, umbral, limite)]
+    finally:
+        conn.close()
+    if not textos:
+        raise SystemExit(f"No hay mensajes de al menos {umbral} caracteres para entrenar")
+
+    diccionario = crear_diccionario(textos, algoritmo, tamano)
+    with open(ruta_salida, 'wb') as salida:
+        salida.write(diccionario)
+    print(f"Diccionario de {len(diccionario):,} bytes con {len(textos):,} mensajes en {ruta_salida}")
+
+
+def comprimir(ruta_db):
+    """
+    Vuelve a codificar todos los mensajes con el codec del entorno, por lotes
+    de IDs, y devuelve (mensajes reescritos, mensajes recorridos). Sin
+    COMPRESION_MENSAJES los deja todos como texto.
+    """
+    conn = sqlite3.connect(ruta_db)
+    registrar_funciones(conn)
+    cambiados = total = 0
+    ultimo_id = -1
+    try:
+        while True:
+            filas = conn.execute(
+                "SELECT id, contenido FROM mensajes WHERE id > ? ORDER BY id LIMIT ?",
+                (ultimo_id, TAMANO_LOTE)
+            ).fetchall()
+            if not filas:
+                break
+            cambios = []
+            for mensaje_id, contenido in filas:
+                nuevo = codec.codificar(codec.decodificar(contenido))
+                if nuevo != contenido:
+                    cambios.append((nuevo, mensaje_id))
+            with conn:
+                conn.executemany("UPDATE mensajes SET contenido = ? WHERE id = ?", cambios)
+            cambiados += len(cambios)
+            total += len(filas)
+            ultimo_id = filas[-1][0]
+    finally:
+        conn.close()
+    return cambiados, total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    subparsers = parser.add_subparsers(dest='orden', required=True)
+
+    parser_entrenar = subparsers.add_parser('entrenar', help='Crea un diccionario con los mensajes largos')
+    parser_entrenar.add_argument('db', help='Base de datos SQLite')
+    parser_entrenar.add_argument('salida', help='Fichero del diccionario')
+    parser_entrenar.add_argument('--algoritmo', choices=algoritmos_disponibles(),
+                                 default=algoritmos_disponibles()[-1], help='Algoritmo que usará el diccionario')
+    parser_entrenar.add_argument('--tamano', type=int, default=TAMANO_DICCIONARIO, help='Tamaño máximo en bytes')
+    parser_entrenar.add_argument('--umbral', type=int, default=UMBRAL,
+                                 help='Caracteres mínimos de los mensajes de muestra')
+    parser_entrenar.add_argument('--muestras', type=int, default=10000, help='Número máximo de mensajes')
+
+    parser_comprimir = subparsers.add_parser(
+        'comprimir', help='Reescribe los mensajes con la configuración de COMPRESION_* (o como texto sin ella)')
+    parser_comprimir.add_argument('db', help='Base de datos SQLite')
+
+    args = parser.parse_args()
+    if args.orden == 'entrenar':
+        entrenar(args.db, args.salida, args.algoritmo, args.tamano, args.umbral, args.muestras)
+    else:
+        inicio = time.perf_counter()
+        cambiados, total = comprimir(args.db)
+        print(f"{cambiados:,} de {total:,} mensajes reescritos en {time.perf_counter() - inicio:.1f}s "
+              f"({codec.algoritmo or 'sin compresión'}). Ejecuta VACUUM para recuperar el espacio.",
+              file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,17 +2,54 @@
 Módulo de soporte para la base de datos usando SQLAlchemy.
 Proporciona modelos y funciones de acceso a datos para el sistema de mensajería.
 """
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime, ForeignKey, Table, func
+from sqlalchemy import (
+    create_engine, Column, Integer, BigInteger, String, Boolean, DateTime, ForeignKey, Table, Index,
+    func, inspect, text, bindparam, or_, and_, event, select, tuple_,
+)
+from sqlalchemy.schema import CreateColumn, CreateIndex
+from sqlalchemy.types import TypeDecorator
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship, sessionmaker, scoped_session
+from sqlalchemy.orm import relationship, sessionmaker, scoped_session, joinedload, selectinload
 from datetime import datetime
 import os
+import logging
 from contextlib import contextmanager
 import threading
 
+import compresion
+import identificadores
+import registro_consultas
+from identificadores import generador as generador_ids, siguiente_id
+
 # Configuración de la base de datos
 Base = declarative_base()
 
+# Caracteres del último mensaje que se guardan como vista previa de cada sala
+LONGITUD_FRAGMENTO = 100
+
+# IDs de mensaje ordenados por tiempo (identificadores.py): necesitan 64 bits.
+# En SQLite se mantiene INTEGER para que la clave primaria siga siendo el rowid.
+IdMensaje = BigInteger().with_variant(Integer, 'sqlite')
+
+class ContenidoMensaje(TypeDecorator):
+    """
+    Texto de un mensaje, comprimido en la base de datos si así lo configura
+    compresion.py (solo en SQLite, que admite un BLOB en una columna de texto).
+    """
+    impl = String
+    cache_ok = True
+    
+    def process_bind_param(self, value, dialect):
+        if dialect.name != 'sqlite':
+            return value
+        return compresion.codificar(value)
+    
+    def process_result_value(self, value, dialect):
+        return compresion.texto_mensaje(value)
+
+# Índices que ya no están en los modelos y se eliminan al migrar
+INDICES_OBSOLETOS = ('ix_mensajes_sala_fecha',)
+
 # Tabla de relación muchos a muchos entre usuarios y salas
 usuarios_salas = Table(
     'usuarios_salas',
@@ -20,7 +57,11 @@ usuarios_salas = Table(
     Column('usuario_id', Integer, ForeignKey('usuarios.id'), primary_key=True),
     Column('sala_id', Integer, ForeignKey('salas.id'), primary_key=True),
     Column('rol', String(20), default='miembro'),
-    Column('fecha_union', DateTime, default=datetime.utcnow)
+    Column('fecha_union', DateTime, default=datetime.utcnow),
+    # Marca de lectura: ID del último mensaje leído por el miembro en la sala
+    Column('last_read_message_id', IdMensaje, nullable=True),
+    # Permite buscar los miembros de una sala y sus lectores por rango de mensajes
+    Index('ix_usuarios_salas_sala_leido', 'sala_id', 'last_read_message_id')
 )
 
 class Usuario(Base):
@@ -49,6 +90,9 @@ class Usuario(Base):
             'activo': self.activo
         }
 
+# Búsqueda de usuarios por prefijo sin distinguir mayúsculas
+Index('ix_usuarios_nombre_minusculas', func.lower(Usuario.nombre))
+
 class Sala(Base):
     """Modelo de sala de chat"""
     __tablename__ = 'salas'
@@ -58,9 +102,18 @@ class Sala(Base):
     privada = Column(Boolean, default=True)
     fecha_creado = Column(DateTime, default=datetime.utcnow)
     
+    # Contadores mantenidos por las escrituras de DatabaseManager en la misma
+    # transacción, para listar salas sin contar miembros ni mensajes.
+    # recalcular_contadores_salas() los repara si se desajustan.
+    member_count = Column(Integer, nullable=False, default=0, server_default='0')
+    message_count = Column(Integer, nullable=False, default=0, server_default='0')
+    # Fecha del último mensaje enviado a la sala
+    last_activity = Column(DateTime, nullable=True)
+    
     # Relaciones
     miembros = relationship('Usuario', secondary=usuarios_salas, back_populates='salas')
     mensajes = relationship('Mensaje', back_populates='sala', cascade='all, delete-orphan')
+    resumen = relationship('ResumenSala', back_populates='sala', uselist=False, cascade='all, delete-orphan')
     
     def __repr__(self):
         return f"<Sala(id={self.id}, nombre='{self.nombre}', privada={self.privada})>"
@@ -70,16 +123,24 @@ class Sala(Base):
             'id': self.id,
             'nombre': self.nombre,
             'privada': self.privada,
-            'fecha_creado': self.fecha_creado
+            'fecha_creado': self.fecha_creado,
+            'member_count': self.member_count,
+            'message_count': self.message_count,
+            'last_activity': self.last_activity
         }
             
 
 class Mensaje(Base):
     """Modelo de mensaje en el chat"""
     __tablename__ = 'mensajes'
+    __table_args__ = (
+        # Historial y conteo de no leídos por sala ordenados por ID
+        Index('ix_mensajes_sala_id', 'sala_id', 'id'),
+    )
     
-    id = Column(Integer, primary_key=True)
-    contenido = Column(String(1000), nullable=False)
+    # Ordenado por el instante de envío: el historial se ordena y pagina por ID
+    id = Column(IdMensaje, primary_key=True, autoincrement=False, default=siguiente_id)
+    contenido = Column(ContenidoMensaje(1000), nullable=False)
     fecha_envio = Column(DateTime, default=datetime.utcnow)
     
     # Claves foráneas
@@ -89,30 +150,153 @@ class Mensaje(Base):
     # Relaciones
     sala = relationship('Sala', back_populates='mensajes')
     usuario = relationship('Usuario', back_populates='mensajes')
+    adjuntos = relationship('Adjunto', back_populates='mensaje', cascade='all, delete-orphan')
     
     def __repr__(self):
         return f"<Mensaje(id={self.id}, usuario_id={self.usuario_id}, sala_id={self.sala_id})>"
     
     def to_dict(self):
+        """
+        Mensaje tal y como lo reciben los clientes, tanto en la API como en los
+        eventos de Socket.IO (en directo o reproducidos al reconectarse)
+        """
         return {
             'id': self.id,
             'contenido': self.contenido,
-            'fecha_envio': self.fecha_envio,
+            'fecha_envio': self.fecha_envio.isoformat(),
+            'usuario_id': self.usuario_id,
+            'usuario_nombre': self.usuario.nombre if self.usuario else None,
             'sala_id': self.sala_id,
-            'usuario_id': self.usuario_id
+            'adjuntos': [adjunto.to_dict() for adjunto in self.adjuntos]
+        }
+
+class Adjunto(Base):
+    """
+    Fichero adjunto a un mensaje.
+    
+    Solo se guardan los metadatos: el contenido está en el almacén de
+    adjuntos.py con el SHA-256 como nombre, y varios adjuntos pueden
+    compartirlo.
+    """
+    __tablename__ = 'adjuntos'
+    __table_args__ = (
+        Index('ix_adjuntos_mensaje_id', 'mensaje_id'),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    mensaje_id = Column(IdMensaje, ForeignKey('mensajes.id'), nullable=False)
+    nombre = Column(String(255), nullable=False)
+    tipo = Column(String(100), nullable=False)  # Tipo MIME
+    tamano = Column(BigInteger, nullable=False)
+    sha256 = Column(String(64), nullable=False)
+    fecha_subida = Column(DateTime, default=datetime.utcnow)
+    
+    # Relaciones
+    mensaje = relationship('Mensaje', back_populates='adjuntos')
+    
+    def __repr__(self):
+        return f"<Adjunto(id={self.id}, mensaje_id={self.mensaje_id}, nombre='{self.nombre}')>"
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'nombre': self.nombre,
+            'tipo': self.tipo,
+            'tamano': self.tamano
+        }
+
+class ResumenSala(Base):
+    """
+    Último mensaje de cada sala, para mostrar su vista previa al listar salas
+    sin consultar los mensajes de cada una.
+    
+    Lo mantienen las escrituras de mensajes de DatabaseManager en la misma
+    transacción; al borrar el último mensaje pasa a ser el anterior.
+    recalcular_resumenes_salas() lo reconstruye si se desajusta.
+    """
+    __tablename__ = 'room_summary'
+    
+    sala_id = Column(Integer, ForeignKey('salas.id'), primary_key=True)
+    # Sin clave foránea: el mensaje se borra antes de elegir el anterior
+    last_message_id = Column(IdMensaje, nullable=True)
+    last_author_id = Column(Integer, ForeignKey('usuarios.id'), nullable=True)
+    last_snippet = Column(String(LONGITUD_FRAGMENTO), nullable=True)
+    last_message_at = Column(DateTime, nullable=True)
+    
+    # Relaciones
+    sala = relationship('Sala', back_populates='resumen')
+    autor = relationship('Usuario')
+    
+    def __repr__(self):
+        return f"<ResumenSala(sala_id={self.sala_id}, last_message_id={self.last_message_id})>"
+    
+    def to_dict(self):
+        """Vista previa del último mensaje, o None si la sala no tiene mensajes"""
+        if self.last_message_id is None:
+            return None
+        return {
+            'id': self.last_message_id,
+            'usuario_id': self.last_author_id,
+            'usuario_nombre': self.autor.nombre if self.autor else None,
+            'fragmento': self.last_snippet,
+            'fecha_envio': self.last_message_at.isoformat() if self.last_message_at else None
         }
 
+class EventoSala(Base):
+    """
+    Registro compacto de cambios en los mensajes de una sala.
+    
+    Cada alta, edición o borrado de un mensaje añade una fila. El ID es
+    creciente y sirve de cursor para que un cliente que se reconecta pueda
+    recuperar todo lo que se ha perdido de una sala con una sola consulta.
+    """
+    __tablename__ = 'eventos_sala'
+    __table_args__ = (
+        Index('ix_eventos_sala_sala_id', 'sala_id', 'id'),
+    )
+    
+    NUEVO = 'nuevo'
+    EDITADO = 'editado'
+    ELIMINADO = 'eliminado'
+    
+    id = Column(Integer, primary_key=True)
+    sala_id = Column(Integer, ForeignKey('salas.id'), nullable=False)
+    # Sin clave foránea: el mensaje puede haber sido eliminado
+    mensaje_id = Column(IdMensaje, nullable=False)
+    tipo = Column(String(10), nullable=False)
+    
+    def __repr__(self):
+        return f"<EventoSala(id={self.id}, sala_id={self.sala_id}, mensaje_id={self.mensaje_id}, tipo='{self.tipo}')>"
+
 class DatabaseManager:
     """Clase para gestionar la conexión y sesiones de la base de datos"""
     
     def __init__(self, db_url=None):
-        # Usar SQLite por defecto si no se especifica otra URL
+        # URL de DATABASE_URL o, si no está definida, SQLite junto a este módulo
+        if db_url is None:
+            db_url = os.environ.get('DATABASE_URL')
         if db_url is None:
             db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mensajeria.db')
             db_url = f'sqlite:///{db_path}'
         
-        self.engine = create_engine(db_url, echo=False)
-        self.Session = scoped_session(sessionmaker(bind=self.engine))
+        # Con REGISTRO_CONSULTAS_LECTURAS, conexiones de SQLite que miden también las lecturas
+        self.engine = create_engine(db_url, echo=False, connect_args=registro_consultas.argumentos_conexion(db_url))
+        if self.engine.dialect.name == 'sqlite':
+            # texto_mensaje() para las consultas que leen contenidos comprimidos
+            event.listen(self.engine, 'connect', lambda conexion, _: compresion.registrar_funciones(conexion))
+            # Número de trabajador de los IDs de mensaje propio de este proceso
+            event.listen(self.engine, 'connect', lambda conexion, _: identificadores.reservar_trabajador(conexion))
+        # Registro opcional de consultas lentas (REGISTRO_CONSULTAS_LENTAS)
+        self.registro_consultas = registro_consultas.desde_entorno(self.engine)
+        fabrica = sessionmaker(bind=self.engine)
+        self.Session = scoped_session(fabrica)
+        
+        # Funciones a las que se avisa, tras cada commit, de los usuarios cuya
+        # lista de salas ha cambiado y de las salas cuyos mensajes (y por tanto
+        # su último mensaje y sus no leídos) han cambiado: oyente(usuario_ids, sala_ids)
+        self.oyentes_salas = []
+        event.listen(fabrica, 'after_commit', self._tras_commit)
+        event.listen(fabrica, 'after_soft_rollback', self._tras_rollback)
 
     _local = threading.local()
 
@@ -126,12 +310,84 @@ class DatabaseManager:
     
     def init_db(self):
         """Crea todas las tablas en la base de datos"""
+        tablas_previas = set(inspect(self.engine).get_table_names())
         Base.metadata.create_all(self.engine)
+        nuevas = self._migrar_esquema()
+        
+        # Los contadores recién añadidos a una base de datos existente valen 0
+        if nuevas & {'salas.member_count', 'salas.message_count', 'salas.last_activity'}:
+            with self.session_scope():
+                self.recalcular_contadores_salas()
+        # Y los resúmenes de sus salas aún no existen
+        if 'salas' in tablas_previas and ResumenSala.__tablename__ not in tablas_previas:
+            with self.session_scope():
+                self.recalcular_resumenes_salas()
+        
+        # Aunque el reloj vaya atrasado, los IDs nuevos deben ser posteriores a los guardados
+        with self.engine.connect() as conn:
+            generador_ids.posterior_a(conn.execute(select(func.max(Mensaje.id))).scalar() or 0)
+
+    def _migrar_esquema(self):
+        """
+        Añade a las tablas existentes las columnas e índices nuevos de los modelos.
+        create_all solo crea las tablas que no existen, así que las bases de datos
+        creadas con versiones anteriores necesitan este paso.
+        
+        Returns:
+            Conjunto con las columnas añadidas, como 'tabla.columna'
+        """
+        inspector = inspect(self.engine)
+        tablas_existentes = set(inspector.get_table_names())
+        nuevas = set()
+        
+        with self.engine.begin() as conn:
+            for tabla in Base.metadata.sorted_tables:
+                if tabla.name not in tablas_existentes:
+                    continue
+                
+                columnas = {c['name'] for c in inspector.get_columns(tabla.name)}
+                for columna in tabla.columns:
+                    if columna.name not in columnas:
+                        definicion = CreateColumn(columna).compile(dialect=self.engine.dialect)
+                        conn.execute(text(f"ALTER TABLE {tabla.name} ADD COLUMN {definicion}"))
+                        nuevas.add(f"{tabla.name}.{columna.name}")
+                
+                # La reflexión no ve los índices sobre expresiones, así que
+                # checkfirst no sirve para ellos
+                for indice in tabla.indexes:
+                    conn.execute(CreateIndex(indice, if_not_exists=True))
+            
+            for nombre in INDICES_OBSOLETOS:
+                conn.execute(text(f"DROP INDEX IF EXISTS {nombre}"))
+
+            # Si la base de datos tiene estadísticas de ANALYZE, SQLite toma un
+            # índice sin ellas por muy selectivo y lo prefiere aunque sea peor
+            if self.engine.dialect.name == 'sqlite' and conn.exec_driver_sql(
+                    "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").first():
+                analizados = {fila[0] for fila in conn.exec_driver_sql("SELECT DISTINCT idx FROM sqlite_stat1")}
+                for tabla in Base.metadata.sorted_tables:
+                    for indice in tabla.indexes:
+                        if indice.name not in analizados:
+                            conn.exec_driver_sql(f"ANALYZE {indice.name}")
+        return nuevas
     
     @contextmanager
     def session_scope(self):
-        """Proporciona un contexto transaccional para las operaciones de base de datos"""
+        """
+        Proporciona un contexto transaccional para las operaciones de base de datos.
+        Si el hilo ya está dentro de un session_scope se reutiliza su sesión, y
+        es el contexto más externo el que confirma o deshace la transacción.
+        """
+        if getattr(DatabaseManager._local, 'profundidad', 0):
+            DatabaseManager._local.profundidad += 1
+            try:
+                yield DatabaseManager.get_session()
+            finally:
+                DatabaseManager._local.profundidad -= 1
+            return
+        
         session = self.Session()
+        DatabaseManager._local.profundidad = 1
         try:
             DatabaseManager.set_session(session)
             yield session
@@ -140,8 +396,189 @@ class DatabaseManager:
             session.rollback()
             raise e
         finally:
+            DatabaseManager._local.profundidad = 0
             session.close()
     
+    def _marcar_salas_cambiadas(self, usuario_ids):
+        """Anota en la sesión los usuarios cuya lista de salas cambia en esta transacción"""
+        session = DatabaseManager.get_session()
+        session.info.setdefault('salas_cambiadas', set()).update(int(u) for u in usuario_ids)
+
+    def _marcar_mensajes_cambiados(self, sala_id):
+        """Anota en la sesión una sala cuyos mensajes cambian en esta transacción"""
+        session = DatabaseManager.get_session()
+        session.info.setdefault('mensajes_cambiados', set()).add(int(sala_id))
+
+    def _ids_miembros(self, sala_id):
+        session = DatabaseManager.get_session()
+        return [fila.usuario_id for fila in
+                session.query(usuarios_salas.c.usuario_id).filter(usuarios_salas.c.sala_id == sala_id)]
+
+    def _tras_commit(self, session):
+        usuario_ids = session.info.pop('salas_cambiadas', None) or set()
+        sala_ids = session.info.pop('mensajes_cambiados', None) or set()
+        if not usuario_ids and not sala_ids:
+            return
+        for oyente in self.oyentes_salas:
+            try:
+                oyente(sorted(usuario_ids), sorted(sala_ids))
+            except Exception as e:
+                logging.error(f"Error al notificar cambios de salas: {str(e)}")
+
+    def _tras_rollback(self, session, previous_transaction):
+        session.info.pop('salas_cambiadas', None)
+        session.info.pop('mensajes_cambiados', None)
+
+    def _ajustar_contadores(self, sala_id, miembros=0, mensajes=0, actividad=None):
+        """
+        Suma ``miembros`` y ``mensajes`` a los contadores de la sala dentro de
+        la transacción en curso. El incremento se hace en el propio UPDATE, así
+        que dos escrituras concurrentes no se pisan.
+        """
+        valores = {}
+        if miembros:
+            valores[Sala.member_count] = Sala.member_count + miembros
+        if mensajes:
+            valores[Sala.message_count] = Sala.message_count + mensajes
+        if actividad is not None:
+            valores[Sala.last_activity] = actividad
+        if not valores:
+            return
+        session = DatabaseManager.get_session()
+        session.query(Sala).filter(Sala.id == sala_id).update(valores, synchronize_session='evaluate')
+
+    def recalcular_contadores_salas(self, sala_id=None):
+        """
+        Recalcula member_count, message_count y last_activity a partir de las
+        membresías y los mensajes. Cada subconsulta es un rango sobre un índice
+        por sala_id.
+        
+        Args:
+            sala_id: Sala a reparar, o todas si es None
+            
+        Returns:
+            Número de salas cuyos contadores estaban desajustados
+        """
+        session = DatabaseManager.get_session()
+        salas = Sala.__table__
+        miembros = (
+            session.query(func.count())
+            .select_from(usuarios_salas)
+            .filter(usuarios_salas.c.sala_id == salas.c.id)
+            .correlate(salas)
+            .scalar_subquery()
+        )
+        mensajes = (
+            session.query(func.count(Mensaje.id))
+            .filter(Mensaje.sala_id == salas.c.id)
+            .correlate(salas)
+            .scalar_subquery()
+        )
+        actividad = (
+            session.query(Mensaje.fecha_envio)
+            .filter(Mensaje.sala_id == salas.c.id)
+            .order_by(Mensaje.id.desc())
+            .limit(1)
+            .correlate(salas)
+            .scalar_subquery()
+        )
+        desajustadas = or_(
+            salas.c.member_count != miembros,
+            salas.c.message_count != mensajes,
+            func.coalesce(salas.c.last_activity, '') != func.coalesce(actividad, '')
+        )
+        stmt = salas.update().where(desajustadas).values(
+            member_count=miembros,
+            message_count=mensajes,
+            last_activity=actividad
+        )
+        if sala_id is not None:
+            stmt = stmt.where(salas.c.id == sala_id)
+        result = session.execute(stmt)
+        session.expire_all()
+        return result.rowcount
+    
+    def _valores_resumen(self):
+        """
+        Columnas de room_summary calculadas a partir del último mensaje de su
+        sala, como subconsultas correlacionadas por sala_id
+        """
+        resumen = ResumenSala.__table__
+        ultimo_id = (
+            select(func.max(Mensaje.id))
+            .where(Mensaje.sala_id == resumen.c.sala_id)
+            .correlate(resumen)
+            .scalar_subquery()
+        )
+        
+        def del_ultimo(columna):
+            return select(columna).where(Mensaje.id == ultimo_id).correlate(resumen).scalar_subquery()
+        
+        # En SQLite el contenido puede estar comprimido (ver ContenidoMensaje)
+        texto = Mensaje.contenido
+        if self.engine.dialect.name == 'sqlite':
+            texto = func.texto_mensaje(texto)
+        
+        return {
+            'last_message_id': ultimo_id,
+            'last_author_id': del_ultimo(Mensaje.usuario_id),
+            'last_snippet': del_ultimo(func.substr(texto, 1, LONGITUD_FRAGMENTO)),
+            'last_message_at': del_ultimo(Mensaje.fecha_envio),
+        }
+    
+    def recalcular_resumenes_salas(self, sala_id=None):
+        """
+        Crea el resumen de las salas que no lo tienen y corrige los que no
+        coinciden con el último mensaje de su sala.
+        
+        Args:
+            sala_id: Sala a reparar, o todas si es None
+            
+        Returns:
+            Número de resúmenes creados o corregidos
+        """
+        session = DatabaseManager.get_session()
+        salas = Sala.__table__
+        resumen = ResumenSala.__table__
+        
+        sin_resumen = select(salas.c.id).where(
+            ~select(resumen.c.sala_id).where(resumen.c.sala_id == salas.c.id).exists()
+        )
+        if sala_id is not None:
+            sin_resumen = sin_resumen.where(salas.c.id == sala_id)
+        session.execute(resumen.insert().from_select(['sala_id'], sin_resumen))
+        
+        valores = self._valores_resumen()
+        desajustados = or_(*(
+            func.coalesce(resumen.c[columna], '') != func.coalesce(valor, '')
+            for columna, valor in valores.items()
+        ))
+        stmt = resumen.update().where(desajustados).values(**valores)
+        if sala_id is not None:
+            stmt = stmt.where(resumen.c.sala_id == sala_id)
+        result = session.execute(stmt)
+        session.expire_all()
+        return result.rowcount
+    
+    def _resumir_mensaje_nuevo(self, mensaje):
+        """Hace de ``mensaje`` el último de su sala si es posterior al actual"""
+        session = DatabaseManager.get_session()
+        valores = {
+            ResumenSala.last_message_id: mensaje.id,
+            ResumenSala.last_author_id: mensaje.usuario_id,
+            ResumenSala.last_snippet: mensaje.contenido[:LONGITUD_FRAGMENTO],
+            ResumenSala.last_message_at: mensaje.fecha_envio,
+        }
+        actualizados = session.query(ResumenSala).filter(
+            ResumenSala.sala_id == mensaje.sala_id,
+            or_(ResumenSala.last_message_id == None, ResumenSala.last_message_id < mensaje.id)
+        ).update(valores, synchronize_session='evaluate')
+        
+        # Salas creadas sin resumen (por ejemplo desde sistema_mensajeria.py)
+        if not actualizados and session.query(ResumenSala).get(mensaje.sala_id) is None:
+            session.add(ResumenSala(sala_id=mensaje.sala_id, **{c.key: v for c, v in valores.items()}))
+            session.flush()
+    
     # Métodos de utilidad para operaciones comunes
     
     def get_usuario_por_nombre(self, nombre):
@@ -170,7 +607,10 @@ class DatabaseManager:
     def buscar_usuarios_por_nombre(self, query, limit=10):
         session = DatabaseManager.get_session()
         """
-        Busca usuarios cuyo nombre contenga la cadena de búsqueda.
+        Busca usuarios cuyo nombre empiece por la cadena de búsqueda, sin
+        distinguir mayúsculas. La búsqueda por prefijo es un rango sobre el
+        índice ix_usuarios_nombre_minusculas; buscar por subcadena ('%texto%')
+        obligaría a recorrer la tabla entera.
         
         Args:
             query (str): Texto a buscar en los nombres de usuario
@@ -182,10 +622,11 @@ class DatabaseManager:
         if not query or len(query.strip()) < 2:
             return []
             
-        search = f"%{query}%"
+        nombre = func.lower(Usuario.nombre)
+        prefijo = func.lower(query.strip())
         return (session.query(Usuario)
-                .filter(Usuario.nombre.ilike(search), Usuario.activo == True)
-                .order_by(Usuario.nombre)
+                .filter(nombre >= prefijo, nombre < prefijo + '\U0010ffff', Usuario.activo == True)
+                .order_by(nombre)
                 .limit(limit)
                 .all())
     
@@ -214,11 +655,42 @@ class DatabaseManager:
             query = query.filter(Sala.privada == False)
         
         return query.all()
+
+    def listar_salas_con_no_leidos(self, usuario_id):
+        """
+        Lista las salas de un usuario junto con su marca de lectura y el número
+        de mensajes no leídos. El resumen del último mensaje de cada sala se
+        carga en la misma consulta.
+        
+        El número de no leídos se obtiene de la misma fila de pertenencia que ya
+        se usa para filtrar las salas del usuario: es un rango sobre el índice
+        (sala_id, id) de mensajes a partir de la marca de lectura.
+        
+        Returns:
+            Lista de tuplas (Sala, last_read_message_id, no_leidos)
+        """
+        session = DatabaseManager.get_session()
+        no_leidos = (
+            session.query(func.count(Mensaje.id))
+            .filter(
+                Mensaje.sala_id == usuarios_salas.c.sala_id,
+                Mensaje.id > func.coalesce(usuarios_salas.c.last_read_message_id, 0)
+            )
+            .correlate(usuarios_salas)
+            .scalar_subquery()
+        )
+        return (
+            session.query(Sala, usuarios_salas.c.last_read_message_id, no_leidos)
+            .options(joinedload(Sala.resumen).joinedload(ResumenSala.autor))
+            .join(usuarios_salas, usuarios_salas.c.sala_id == Sala.id)
+            .filter(usuarios_salas.c.usuario_id == usuario_id)
+            .all()
+        )
     
     def crear_sala(self, nombre, privada=True, usuario_creador_id=None):
         session = DatabaseManager.get_session()
         """Crea una nueva sala y asigna al usuario como administrador"""
-        sala = Sala(nombre=nombre, privada=privada)
+        sala = Sala(nombre=nombre, privada=privada, resumen=ResumenSala())
         session.add(sala)
         session.flush()  # Para obtener el ID de la sala
             
@@ -230,6 +702,8 @@ class DatabaseManager:
                 rol='admin'
             )
             session.execute(stmt)
+            self._ajustar_contadores(sala.id, miembros=1)
+            self._marcar_salas_cambiadas([usuario_creador_id])
             
         return sala
     
@@ -246,6 +720,7 @@ class DatabaseManager:
         
         session.add(sala)
         session.flush()
+        self._marcar_salas_cambiadas(self._ids_miembros(sala_id))
         return sala
     
     def eliminar_sala(self, sala_id):
@@ -253,6 +728,9 @@ class DatabaseManager:
         sala = session.query(Sala).get(sala_id)
         if not sala:
             raise ValueError("Sala no encontrada")
+        self._marcar_salas_cambiadas(self._ids_miembros(sala_id))
+        # El registro de cambios no tiene relación con la sala: se borra aparte
+        session.query(EventoSala).filter(EventoSala.sala_id == sala_id).delete(synchronize_session=False)
         session.delete(sala)
         session.flush()
         return sala
@@ -296,6 +774,8 @@ class DatabaseManager:
             rol=rol
         )
         session.execute(stmt)
+        self._ajustar_contadores(sala_id, miembros=1)
+        self._marcar_salas_cambiadas([usuario_id])
         session.commit()
         return True
     
@@ -308,7 +788,9 @@ class DatabaseManager:
                 usuarios_salas.c.sala_id == sala_id
             )
         )
-        session.execute(stmt)
+        result = session.execute(stmt)
+        self._ajustar_contadores(sala_id, miembros=-result.rowcount)
+        self._marcar_salas_cambiadas([usuario_id])
         session.commit()
         return result.rowcount > 0
 
@@ -316,6 +798,15 @@ class DatabaseManager:
         session = DatabaseManager.get_session()
         return session.query(Usuario).join(usuarios_salas).filter(usuarios_salas.c.sala_id == sala_id).all()
 
+    def listar_miembros_de_sala(self, sala_id):
+        """Devuelve filas (id, nombre, rol, fecha_union) de los miembros de una sala"""
+        session = DatabaseManager.get_session()
+        return session.query(
+            Usuario.id, Usuario.nombre, usuarios_salas.c.rol, usuarios_salas.c.fecha_union
+        ).join(usuarios_salas, usuarios_salas.c.usuario_id == Usuario.id).filter(
+            usuarios_salas.c.sala_id == sala_id
+        ).all()
+
     def es_miembro(self, sala_id, usuario_id):
         session = DatabaseManager.get_session()
         return session.query(usuarios_salas).filter(
@@ -323,16 +814,215 @@ class DatabaseManager:
             usuarios_salas.c.usuario_id == usuario_id
         ).first() is not None
     
-    def agregar_mensaje(self, contenido, sala_id, usuario_id):
+    def marcar_leidos(self, marcas):
+        """
+        Avanza las marcas de lectura de varios miembros en una sola sentencia.
+        
+        Las marcas solo avanzan: si la marca guardada ya es mayor o igual, la
+        fila no se modifica. Cada marca se limita al último mensaje de su sala
+        (room_summary), para que un ID inventado no dé por leídos los mensajes
+        que aún no se han enviado, y se descartan las de quien no es miembro.
+        
+        Args:
+            marcas: Lista de tuplas (usuario_id, sala_id, mensaje_id)
+            
+        Returns:
+            Lista de tuplas (usuario_id, sala_id, mensaje_id) con las marcas que
+            se han avanzado, ya limitadas al último mensaje de cada sala
+        """
+        if not marcas:
+            return []
+        
+        session = DatabaseManager.get_session()
+        ultimos = dict(
+            session.query(ResumenSala.sala_id, ResumenSala.last_message_id)
+            .filter(ResumenSala.sala_id.in_({sala_id for _, sala_id, _ in marcas}))
+        )
+        limitadas = {}
+        for usuario_id, sala_id, mensaje_id in marcas:
+            ultimo = ultimos.get(sala_id)
+            if ultimo is not None:
+                limitadas[(usuario_id, sala_id)] = min(mensaje_id, ultimo)
+        if not limitadas:
+            return []
+        
+        # Marcas guardadas de los miembros; las claves que no aparecen no son miembros
+        actuales = dict(
+            ((fila.usuario_id, fila.sala_id), fila.last_read_message_id) for fila in
+            session.query(usuarios_salas.c.usuario_id, usuarios_salas.c.sala_id,
+                          usuarios_salas.c.last_read_message_id)
+            .filter(tuple_(usuarios_salas.c.usuario_id, usuarios_salas.c.sala_id).in_(list(limitadas)))
+        )
+        avanzadas = [
+            (usuario_id, sala_id, mensaje_id)
+            for (usuario_id, sala_id), mensaje_id in limitadas.items()
+            if (usuario_id, sala_id) in actuales
+            and (actuales[(usuario_id, sala_id)] is None or actuales[(usuario_id, sala_id)] < mensaje_id)
+        ]
+        if not avanzadas:
+            return []
+        
+        stmt = (
+            usuarios_salas.update()
+            .where(
+                usuarios_salas.c.usuario_id == bindparam('b_usuario_id'),
+                usuarios_salas.c.sala_id == bindparam('b_sala_id'),
+                or_(
+                    usuarios_salas.c.last_read_message_id.is_(None),
+                    usuarios_salas.c.last_read_message_id < bindparam('b_mensaje_id')
+                )
+            )
+            .values(last_read_message_id=bindparam('b_mensaje_id'))
+        )
+        session.execute(stmt, [
+            {'b_usuario_id': usuario_id, 'b_sala_id': sala_id, 'b_mensaje_id': mensaje_id}
+            for usuario_id, sala_id, mensaje_id in avanzadas
+        ])
+        # Sus mensajes no leídos han cambiado
+        self._marcar_salas_cambiadas({usuario_id for usuario_id, _, _ in avanzadas})
+        return avanzadas
+
+    def listar_marcas_de_lectura(self, sala_id, desde_mensaje_id):
+        """
+        Obtiene los miembros de una sala que han leído al menos hasta un mensaje.
+        
+        Un miembro ha leído todos los mensajes con ID menor o igual que su marca,
+        así que con el resultado se pueden calcular los lectores de cualquier
+        mensaje a partir de desde_mensaje_id sin consultar cada uno por separado.
+        
+        Args:
+            sala_id: ID de la sala
+            desde_mensaje_id: ID del mensaje más antiguo del rango que interesa
+            
+        Returns:
+            Lista de tuplas (usuario_id, last_read_message_id) ordenada por marca
+        """
+        session = DatabaseManager.get_session()
+        return (
+            session.query(usuarios_salas.c.usuario_id, usuarios_salas.c.last_read_message_id)
+            .filter(
+                usuarios_salas.c.sala_id == sala_id,
+                usuarios_salas.c.last_read_message_id >= desde_mensaje_id
+            )
+            .order_by(usuarios_salas.c.last_read_message_id)
+            .all()
+        )
+    
+    def agregar_mensaje(self, contenido, sala_id, usuario_id, adjuntos=()):
+        """
+        Agrega un nuevo mensaje a una sala.
+        
+        Args:
+            contenido: Contenido del mensaje
+            sala_id: ID de la sala
+            usuario_id: ID del autor
+            adjuntos: Metadatos de los ficheros adjuntos ya guardados, como
+                diccionarios con nombre, tipo, tamano y sha256
+        """
         session = DatabaseManager.get_session()
-        """Agrega un nuevo mensaje a una sala"""
         mensaje = Mensaje(
             contenido=contenido,
             sala_id=sala_id,
-            usuario_id=usuario_id
+            usuario_id=usuario_id,
+            adjuntos=[Adjunto(**adjunto) for adjunto in adjuntos]
             )
         session.add(mensaje)
+        session.flush()  # Para obtener el ID del mensaje
+        mensaje.seq = self._registrar_evento(sala_id, mensaje.id, EventoSala.NUEVO)
+        self._ajustar_contadores(sala_id, mensajes=1, actividad=mensaje.fecha_envio)
+        self._resumir_mensaje_nuevo(mensaje)
         return mensaje
+
+    def _registrar_evento(self, sala_id, mensaje_id, tipo):
+        """Añade un evento al registro de cambios de la sala y devuelve su ID"""
+        session = DatabaseManager.get_session()
+        self._marcar_mensajes_cambiados(sala_id)
+        result = session.execute(EventoSala.__table__.insert().values(
+            sala_id=sala_id,
+            mensaje_id=mensaje_id,
+            tipo=tipo
+        ))
+        return result.inserted_primary_key[0]
+
+    def purgar_eventos(self, conservar, sala_id=None):
+        """
+        Recorta el registro de cambios a los últimos eventos de cada sala.
+        
+        Un cliente con un cursor anterior al evento más antiguo que se conserva
+        tiene al menos `conservar` eventos pendientes, así que con `conservar`
+        mayor que el límite de reproducción recibe un resync en lugar de una
+        reproducción incompleta.
+        
+        Args:
+            conservar: Número de eventos más recientes que se conservan por sala
+            sala_id: Sala a recortar, o todas si es None (borra también los
+                eventos de salas que ya no existen)
+            
+        Returns:
+            Número de eventos eliminados
+        """
+        if conservar < 1:
+            raise ValueError("Hay que conservar al menos un evento por sala")
+        session = DatabaseManager.get_session()
+        eventos = EventoSala.__table__
+        if sala_id is None:
+            sala_ids = [fila.id for fila in session.query(Sala.id)]
+            eliminados = session.execute(
+                eventos.delete().where(~eventos.c.sala_id.in_(select(Sala.id)))
+            ).rowcount
+        else:
+            sala_ids = [sala_id]
+            eliminados = 0
+        
+        # ID del evento más antiguo que se conserva: el `conservar`-ésimo más reciente
+        frontera = (
+            select(eventos.c.id)
+            .where(eventos.c.sala_id == bindparam('b_sala_id'))
+            .order_by(eventos.c.id.desc())
+            .limit(1)
+            .offset(conservar - 1)
+            .scalar_subquery()
+        )
+        stmt = eventos.delete().where(
+            eventos.c.sala_id == bindparam('b_sala_id'),
+            eventos.c.id < frontera
+        )
+        for id_sala in sala_ids:
+            eliminados += session.execute(stmt, {'b_sala_id': id_sala}).rowcount
+        return eliminados
+
+    def get_eventos_desde(self, sala_id, desde_seq, limite):
+        """
+        Obtiene los cambios de una sala posteriores a un cursor junto con el
+        estado actual de cada mensaje.
+        
+        Args:
+            sala_id: ID de la sala
+            desde_seq: ID del último evento que conoce el cliente
+            limite: Número máximo de eventos a devolver
+            
+        Returns:
+            Lista de tuplas (EventoSala, Mensaje o None) ordenadas por ID de evento
+        """
+        session = DatabaseManager.get_session()
+        return (
+            session.query(EventoSala, Mensaje)
+            .outerjoin(Mensaje, Mensaje.id == EventoSala.mensaje_id)
+            .options(selectinload(Mensaje.usuario), selectinload(Mensaje.adjuntos))
+            .filter(EventoSala.sala_id == sala_id, EventoSala.id > desde_seq)
+            .order_by(EventoSala.id)
+            .limit(limite)
+            .all()
+        )
+
+    def get_ultimo_evento(self, sala_id):
+        """Devuelve el ID del último evento de una sala o 0 si no tiene ninguno"""
+        session = DatabaseManager.get_session()
+        return (
+            session.query(func.max(EventoSala.id))
+            .filter(EventoSala.sala_id == sala_id)
+            .scalar()
+        ) or 0
     
     def get_mensajes_por_sala(self, sala_id, limite=100):
         """Obtiene los mensajes de una sala específica"""
@@ -340,7 +1030,7 @@ class DatabaseManager:
         return (
                 session.query(Mensaje)
                 .filter(Mensaje.sala_id == sala_id)
-                .order_by(Mensaje.fecha_envio.desc())
+                .order_by(Mensaje.id.desc())
                 .limit(limite)
                 .all()
             )
@@ -355,22 +1045,23 @@ class DatabaseManager:
             limite: Número máximo de mensajes a devolver
             
         Returns:
-            Lista de mensajes ordenados por fecha de envío (más recientes primero)
+            Lista de mensajes ordenados por ID, que sigue el orden de envío
+            (más recientes primero)
         """
         session = DatabaseManager.get_session()
         query = (
             session.query(Mensaje)
+            .options(joinedload(Mensaje.usuario), selectinload(Mensaje.adjuntos))
             .filter(Mensaje.sala_id == sala_id)
         )
         
         if antes_de_id:
-            # Obtener la fecha del mensaje de referencia
-            mensaje_ref = session.query(Mensaje).get(antes_de_id)
-            if mensaje_ref:
-                query = query.filter(Mensaje.fecha_envio < mensaje_ref.fecha_envio)
+            # Rango sobre el índice (sala_id, id); el mensaje de referencia
+            # no necesita existir
+            query = query.filter(Mensaje.id < antes_de_id)
         
         return (
-            query.order_by(Mensaje.fecha_envio.desc())
+            query.order_by(Mensaje.id.desc())
             .limit(limite)
             .all()
         )
@@ -388,6 +1079,24 @@ class DatabaseManager:
         session = DatabaseManager.get_session()
         return session.query(Mensaje).get(mensaje_id)
         
+    def get_adjunto_por_id(self, adjunto_id):
+        """
+        Obtiene un adjunto junto con su mensaje.
+        
+        Args:
+            adjunto_id: ID del adjunto
+            
+        Returns:
+            El adjunto encontrado o None si no existe
+        """
+        session = DatabaseManager.get_session()
+        return (
+            session.query(Adjunto)
+            .options(joinedload(Adjunto.mensaje))
+            .filter(Adjunto.id == adjunto_id)
+            .first()
+        )
+        
     def eliminar_mensaje_por_id(self, mensaje_id):
         """
         Elimina un mensaje por su ID.
@@ -396,14 +1105,37 @@ class DatabaseManager:
             mensaje_id: ID del mensaje a eliminar
             
         Returns:
-            bool: True si el mensaje fue eliminado, False si no se encontró
+            int: ID del evento de borrado si el mensaje fue eliminado, False si no se encontró
         """
         session = DatabaseManager.get_session()
         mensaje = session.query(Mensaje).get(mensaje_id)
         if mensaje:
+            seq = self._registrar_evento(mensaje.sala_id, mensaje.id, EventoSala.ELIMINADO)
+            self._ajustar_contadores(mensaje.sala_id, mensajes=-1)
             session.delete(mensaje)
+            session.flush()
+            # last_activity es la fecha del último mensaje que queda, como en
+            # recalcular_contadores_salas()
+            ultima_fecha = (
+                select(Mensaje.fecha_envio)
+                .where(Mensaje.sala_id == mensaje.sala_id)
+                .order_by(Mensaje.id.desc())
+                .limit(1)
+                .scalar_subquery()
+            )
+            session.query(Sala).filter(Sala.id == mensaje.sala_id).update(
+                {Sala.last_activity: ultima_fecha}, synchronize_session='fetch'
+            )
+            # Si era el último de la sala, el resumen pasa al anterior
+            session.query(ResumenSala).filter(
+                ResumenSala.sala_id == mensaje.sala_id,
+                ResumenSala.last_message_id == mensaje.id
+            ).update(
+                {getattr(ResumenSala, c): v for c, v in self._valores_resumen().items()},
+                synchronize_session='fetch'
+            )
             session.commit()
-            return True
+            return seq
         return False
         
     def actualizar_mensaje(self, mensaje_id, nuevo_contenido):
@@ -421,7 +1153,13 @@ class DatabaseManager:
         mensaje = session.query(Mensaje).get(mensaje_id)
         if mensaje:
             mensaje.contenido = nuevo_contenido
+            seq = self._registrar_evento(mensaje.sala_id, mensaje.id, EventoSala.EDITADO)
+            session.query(ResumenSala).filter(
+                ResumenSala.sala_id == mensaje.sala_id,
+                ResumenSala.last_message_id == mensaje.id
+            ).update({ResumenSala.last_snippet: nuevo_contenido[:LONGITUD_FRAGMENTO]}, synchronize_session='evaluate')
             session.commit()
+            mensaje.seq = seq
             return mensaje
         return None
 
@@ -433,6 +1171,28 @@ def init_db():
     db.init_db()
 
 if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Inicializa la base de datos del sistema de mensajería")
+    parser.add_argument('--reparar-contadores', action='store_true',
+                        help='Recalcula los contadores y el resumen del último mensaje de todas las salas')
+    parser.add_argument('--purgar-eventos', type=int, metavar='N',
+                        help='Conserva solo los N últimos eventos de cada sala en el registro de cambios '
+                             '(usa un valor mayor que REPLAY_MAX_EVENTOS)')
+    args = parser.parse_args()
+    
     # Si se ejecuta directamente, inicializar la base de datos
     init_db()
     print("Base de datos inicializada correctamente.")
+    
+    if args.reparar_contadores:
+        with db.session_scope():
+            reparadas = db.recalcular_contadores_salas()
+            resumenes = db.recalcular_resumenes_salas()
+        print(f"Contadores recalculados: {reparadas} salas estaban desajustadas.")
+        print(f"Resúmenes recalculados: {resumenes} salas estaban desajustadas.")
+    
+    if args.purgar_eventos is not None:
+        with db.session_scope():
+            eliminados = db.purgar_eventos(args.purgar_eventos)
+        print(f"Registro de cambios recortado: {eliminados} eventos eliminados.")
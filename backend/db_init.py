@@ -23,7 +23,10 @@ CREATE TABLE IF NOT EXISTS salas (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     nombre TEXT,
     privada BOOLEAN NOT NULL DEFAULT 1,
-    fecha_creado TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    fecha_creado TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    member_count INTEGER NOT NULL DEFAULT 0,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    last_activity TIMESTAMP
 );
 """)
 
@@ -34,6 +37,7 @@ CREATE TABLE IF NOT EXISTS usuarios_salas (
     sala_id INTEGER NOT NULL,
     rol TEXT DEFAULT 'miembro',
     fecha_union TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_read_message_id INTEGER,
     PRIMARY KEY (usuario_id, sala_id),
     FOREIGN KEY (usuario_id) REFERENCES usuarios(id),
     FOREIGN KEY (sala_id) REFERENCES salas(id)
@@ -43,7 +47,7 @@ CREATE TABLE IF NOT EXISTS usuarios_salas (
 # Crear tabla de mensajes
 cursor.execute("""
 CREATE TABLE IF NOT EXISTS mensajes (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    id INTEGER PRIMARY KEY,  -- ordenado por tiempo, ver identificadores.py
     sala_id INTEGER NOT NULL,
     usuario_id INTEGER NOT NULL,
     contenido TEXT NOT NULL,
@@ -53,6 +57,71 @@ CREATE TABLE IF NOT EXISTS mensajes (
 );
 """)
 
+# Crear tabla de eventos de sala (registro de cambios para reconexiones)
+cursor.execute("""
+CREATE TABLE IF NOT EXISTS eventos_sala (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sala_id INTEGER NOT NULL,
+    mensaje_id INTEGER NOT NULL,
+    tipo TEXT NOT NULL,
+    FOREIGN KEY (sala_id) REFERENCES salas(id)
+);
+""")
+
+cursor.execute("""
+CREATE INDEX IF NOT EXISTS ix_eventos_sala_sala_id
+ON eventos_sala (sala_id, id);
+""")
+
+# Crear tabla con el último mensaje de cada sala (vista previa en la lista de salas)
+cursor.execute("""
+CREATE TABLE IF NOT EXISTS room_summary (
+    sala_id INTEGER PRIMARY KEY,
+    last_message_id INTEGER,
+    last_author_id INTEGER,
+    last_snippet TEXT,
+    last_message_at TIMESTAMP,
+    FOREIGN KEY (sala_id) REFERENCES salas(id),
+    FOREIGN KEY (last_author_id) REFERENCES usuarios(id)
+);
+""")
+
+# Crear tabla de adjuntos (solo metadatos; el contenido está en ADJUNTOS_DIR)
+cursor.execute("""
+CREATE TABLE IF NOT EXISTS adjuntos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    mensaje_id INTEGER NOT NULL,
+    nombre TEXT NOT NULL,
+    tipo TEXT NOT NULL,
+    tamano INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    fecha_subida TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (mensaje_id) REFERENCES mensajes(id)
+);
+""")
+
+# Índices para las marcas de lectura y el historial por sala
+cursor.execute("""
+CREATE INDEX IF NOT EXISTS ix_usuarios_salas_sala_leido
+ON usuarios_salas (sala_id, last_read_message_id);
+""")
+
+cursor.execute("""
+CREATE INDEX IF NOT EXISTS ix_mensajes_sala_id
+ON mensajes (sala_id, id);
+""")
+
+cursor.execute("""
+CREATE INDEX IF NOT EXISTS ix_adjuntos_mensaje_id
+ON adjuntos (mensaje_id);
+""")
+
+# Búsqueda de usuarios por prefijo sin distinguir mayúsculas
+cursor.execute("""
+CREATE INDEX IF NOT EXISTS ix_usuarios_nombre_minusculas
+ON usuarios (lower(nombre));
+""")
+
 # Confirmar cambios y cerrar conexión
 conn.commit()
 conn.close()
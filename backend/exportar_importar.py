@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Exporta e importa en bloque usuarios, salas, membresías, mensajes y adjuntos.
+
+El formato es NDJSON comprimido con gzip. Cada tabla empieza con una línea de
+cabecera ``{"tabla": ..., "columnas": [...]}`` seguida de una línea por fila
+con los valores como lista JSON, en el orden de las columnas.
+
+- ``exportar`` recorre cada tabla por lotes con ``fetchmany``, de modo que la
+  memoria usada no depende del tamaño de la base de datos.
+- ``importar`` carga las filas con ``executemany`` en una sola transacción,
+  con los índices secundarios eliminados durante la carga y recreados al
+  final (construir un índice de una vez es mucho más rápido que mantenerlo
+  fila a fila). La base de datos de destino debe tener ya el esquema
+  (``db_init.py``) y no contener filas con los mismos ids.
+
+Las claves se exportan tal y como están guardadas (hash), nunca en claro.
+El resumen del último mensaje de cada sala (room_summary) no se exporta
+porque se deduce de los mensajes: después de importar hay que ejecutar
+``python database.py --reparar-contadores``, que lo reconstruye y corrige
+también los contadores si el volcado procede de una base de datos sin ellos.
+De los adjuntos solo se exportan los metadatos: los ficheros del almacén
+(ADJUNTOS_DIR, ver adjuntos.py) se copian aparte. Los mensajes comprimidos
+(compresion.py) se exportan como texto y se importan sin comprimir; para
+comprimirlos de nuevo está ``python compresion.py comprimir``.
+
+Uso:
+    python exportar_importar.py exportar volcado.ndjson.gz
+    python exportar_importar.py importar volcado.ndjson.gz --db otra.db
+"""
+import argparse
+import gzip
+import itertools
+import json
+import os
+import sqlite3
+import sys
+import time
+
+import compresion
+
+# Tablas en orden de dependencia: las referenciadas van antes
+TABLAS = ("usuarios", "salas", "usuarios_salas", "mensajes", "adjuntos")
+
+# Columnas que se exportan a través de una función SQL
+EXPRESIONES_EXPORTACION = {("mensajes", "contenido"): "texto_mensaje(contenido)"}
+
+# Filas por lote al leer y al insertar
+TAMANO_LOTE = int(os.environ.get('EXPORTAR_TAMANO_LOTE', 10000))
+
+DB_POR_DEFECTO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mensajeria.db")
+
+
+def columnas_de(conn, tabla):
+    return [fila[1] for fila in conn.execute(f"PRAGMA table_info({tabla})")]
+
+
+def exportar(ruta_db, ruta_salida):
+    """Vuelca las tablas a ``ruta_salida`` y devuelve las filas escritas por tabla"""
+    conn = sqlite3.connect(ruta_db)
+    compresion.registrar_funciones(conn)
+    totales = {}
+    try:
+        with gzip.open(ruta_salida, 'wt', encoding='utf-8', compresslevel=6) as salida:
+            for tabla in TABLAS:
+                columnas = columnas_de(conn, tabla)
+                salida.write(json.dumps({"tabla": tabla, "columnas": columnas}) + "\n")
+
+                expresiones = [EXPRESIONES_EXPORTACION.get((tabla, columna), columna) for columna in columnas]
+                cursor = conn.execute(f"SELECT {', '.join(expresiones)} FROM {tabla} ORDER BY rowid")
+                total = 0
+                while True:
+                    filas = cursor.fetchmany(TAMANO_LOTE)
+                    if not filas:
+                        break
+                    salida.write("".join(json.dumps(fila, ensure_ascii=False) + "\n" for fila in filas))
+                    total += len(filas)
+                totales[tabla] = total
+    finally:
+        conn.close()
+    return totales
+
+
+def leer_volcado(ruta_entrada):
+    """
+    Recorre el volcado y genera ``(tabla, columnas, filas)`` por cada tabla,
+    donde ``filas`` es un iterador perezoso que hay que consumir antes de
+    pasar a la siguiente tabla.
+    """
+    with gzip.open(ruta_entrada, 'rt', encoding='utf-8') as entrada:
+        lineas = iter(entrada)
+        pendiente = next(lineas, None)
+        while pendiente is not None:
+            cabecera = json.loads(pendiente)
+            if not isinstance(cabecera, dict) or "tabla" not in cabecera:
+                raise ValueError("Volcado no válido: se esperaba una cabecera de tabla")
+            pendiente = None
+
+            def filas():
+                nonlocal pendiente
+                for linea in lineas:
+                    if linea.startswith("{"):
+                        pendiente = linea
+                        return
+                    yield json.loads(linea)
+
+            yield cabecera["tabla"], cabecera["columnas"], filas()
+
+
+def _indices_secundarios(conn, tablas):
+    """Índices creados con CREATE INDEX (los automáticos de las claves no tienen sql)"""
+    marcas = ", ".join("?" for _ in tablas)
+    return conn.execute(
+        f"SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL "
+        f"AND tbl_name IN ({marcas})", tablas
+    ).fetchall()
+
+
+def importar(ruta_db, ruta_entrada):
+    """Carga el volcado en ``ruta_db`` y devuelve las filas insertadas por tabla"""
+    conn = sqlite3.connect(ruta_db, isolation_level=None)
+    totales = {}
+    try:
+        # La carga es todo o nada: si falla se deshace la transacción, así que
+        # no hace falta diario en disco ni esperar a cada escritura
+        conn.execute("PRAGMA journal_mode = MEMORY")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute("PRAGMA cache_size = -200000")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        conn.execute("PRAGMA foreign_keys = OFF")
+
+        conn.execute("BEGIN")
+        indices = _indices_secundarios(conn, TABLAS)
+        for nombre, _ in indices:
+            conn.execute(f"DROP INDEX {nombre}")
+
+        for tabla, columnas, filas in leer_volcado(ruta_entrada):
+            if tabla not in TABLAS:
+                raise ValueError(f"Tabla desconocida en el volcado: {tabla}")
+            existentes = set(columnas_de(conn, tabla))
+            if not existentes:
+                raise ValueError(f"La tabla {tabla} no existe; ejecuta antes db_init.py")
+            faltan = [c for c in columnas if c not in existentes]
+            if faltan:
+                raise ValueError(f"Columnas de {tabla} que no existen en destino: {', '.join(faltan)}")
+
+            sql = (f"INSERT INTO {tabla} ({', '.join(columnas)}) "
+                   f"VALUES ({', '.join('?' for _ in columnas)})")
+            total = 0
+            while True:
+                lote = list(itertools.islice(filas, TAMANO_LOTE))
+                if not lote:
+                    break
+                conn.executemany(sql, lote)
+                total += len(lote)
+            totales[tabla] = total
+
+        for _, sql in indices:
+            conn.execute(sql)
+        conn.execute("COMMIT")
+        conn.execute("ANALYZE")
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    return totales
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('modo', choices=('exportar', 'importar'))
+    parser.add_argument('fichero', help='Volcado .ndjson.gz')
+    parser.add_argument('--db', default=DB_POR_DEFECTO, help='Base de datos SQLite')
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    try:
+        if args.modo == 'exportar':
+            totales = exportar(args.db, args.fichero)
+        else:
+            if not os.path.exists(args.db):
+                print(f"La base de datos {args.db} no existe; créala con db_init.py", file=sys.stderr)
+                sys.exit(1)
+            totales = importar(args.db, args.fichero)
+    except (sqlite3.Error, ValueError, OSError) as e:
+        print(f"Error al {args.modo}: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    segundos = time.perf_counter() - inicio
+    for tabla, total in totales.items():
+        print(f"{tabla:<16} {total:>12,} filas")
+    print(f"Completado en {segundos:.1f}s ({sum(totales.values()) / max(segundos, 1e-9):,.0f} filas/s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Genera bases de datos sintéticas y reproducibles para pruebas de capacidad.
+
+Con la misma semilla y los mismos parámetros el resultado es idéntico. Las
+distribuciones imitan un uso real:
+
+- El tamaño de las salas sigue una ley de Zipf: unas pocas salas enormes y
+  una larga cola de salas pequeñas.
+- Cada sala recibe mensajes en proporción a su tamaño.
+- Los mensajes llegan en ráfagas: durante una conversación se suceden en la
+  misma sala con poco tiempo entre ellos, separadas por periodos de calma.
+- La mayoría de los miembros tienen su marca de lectura al final de la sala y
+  el resto se quedan algo atrás.
+
+Las filas se insertan con ``insert()`` de SQLAlchemy Core por lotes
+(executemany), sin pasar por el ORM. Los índices secundarios se crean al
+final, y todos los usuarios comparten el mismo hash de clave para no calcular
+millones de hashes. Los ids de los mensajes se generan a partir de su fecha
+de envío con identificadores.py, como en producción. El registro de eventos
+(eventos_sala) queda vacío.
+
+Uso:
+    python generar_datos.py datos.db --usuarios 50000 --salas 5000 --mensajes 10000000
+"""
+import argparse
+import bisect
+import itertools
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import bindparam, event
+from werkzeug.security import generate_password_hash
+
+from database import DatabaseManager, Base, Usuario, Sala, Mensaje, usuarios_salas
+from identificadores import DESPLAZAMIENTO_MS, GeneradorIds
+
+# Clave de todos los usuarios generados
+CLAVE_GENERADA = os.environ.get('GENERAR_DATOS_CLAVE', 'clave')
+
+TAMANO_LOTE = 10000
+
+PALABRAS = (
+    "hola", "que", "tal", "reunion", "mañana", "despliegue", "error", "listo", "revisad", "el",
+    "la", "de", "en", "servidor", "cliente", "ok", "gracias", "vale", "ahora", "luego", "prueba",
+    "fallo", "arreglado", "version", "rama", "cambios", "comentarios", "base", "datos", "cola",
+    "mensaje", "sala", "usuario", "pendiente", "hecho", "mirad", "esto", "por", "favor", "ya",
+)
+
+# Mensajes seguidos en la misma sala durante una ráfaga, probabilidad de que
+# empiece una ráfaga tras cada mensaje en calma y separación relativa de los
+# mensajes de una ráfaga respecto a la media
+MENSAJES_POR_RAFAGA = 20
+PROBABILIDAD_RAFAGA = 0.05
+FACTOR_SEPARACION_RAFAGA = 0.1
+
+
+def tamanos_zipf(salas, membresias, usuarios, exponente, rnd):
+    """
+    Reparte ``membresias`` entre ``salas`` con pesos 1/rango^exponente.
+    Cada sala tiene al menos 2 miembros y como mucho ``usuarios``.
+    """
+    pesos = [1 / (k ** exponente) for k in range(1, salas + 1)]
+    escala = membresias / sum(pesos)
+    tamanos = [max(2, min(usuarios, round(p * escala))) for p in pesos]
+    # El rango no depende del id: la sala más grande no es siempre la 1
+    rnd.shuffle(tamanos)
+    return tamanos
+
+
+def texto_aleatorio(rnd):
+    palabras = max(1, min(150, int(rnd.lognormvariate(2.0, 0.8))))
+    return " ".join(rnd.choices(PALABRAS, k=palabras))
+
+
+def en_lotes(iterable, tamano=TAMANO_LOTE):
+    iterador = iter(iterable)
+    while True:
+        lote = list(itertools.islice(iterador, tamano))
+        if not lote:
+            return
+        yield lote
+
+
+class Generador:
+    def __init__(self, args):
+        self.args = args
+        self.rnd = random.Random(args.semilla)
+        self.tamanos = []
+        self.miembros = []
+
+    def usuarios(self, clave_hash, inicio):
+        for i in range(1, self.args.usuarios + 1):
+            yield {
+                "id": i,
+                "nombre": f"usuario{i:07d}",
+                "clave": clave_hash,
+                "fecha_creado": inicio,
+                "activo": True,
+            }
+
+    def salas(self, inicio):
+        for i in range(1, self.args.salas + 1):
+            yield {
+                "id": i,
+                "nombre": f"sala{i:06d}",
+                # Las salas grandes suelen ser públicas
+                "privada": self.tamanos[i - 1] < 50 and self.rnd.random() < 0.7,
+                "fecha_creado": inicio,
+            }
+
+    def membresias(self, inicio):
+        for sala_id, tamano in enumerate(self.tamanos, start=1):
+            miembros = self.rnd.sample(range(1, self.args.usuarios + 1), tamano)
+            self.miembros.append(miembros)
+            for posicion, usuario_id in enumerate(miembros):
+                yield {
+                    "usuario_id": usuario_id,
+                    "sala_id": sala_id,
+                    "rol": "admin" if posicion == 0 else "miembro",
+                    "fecha_union": inicio,
+                }
+
+    def mensajes(self, inicio, ultimos):
+        """
+        Genera los mensajes en orden cronológico y anota en ``ultimos`` el id
+        y la fecha del último mensaje de cada sala.
+        """
+        rnd = self.rnd
+        media = self.args.dias * 86400 / max(1, self.args.mensajes)
+        # La mitad de los mensajes caen en ráfagas, así que la calma se
+        # alarga para que la duración total sea la pedida
+        fraccion = MENSAJES_POR_RAFAGA / (MENSAJES_POR_RAFAGA + 1 / PROBABILIDAD_RAFAGA)
+        media_rafaga = media * FACTOR_SEPARACION_RAFAGA
+        media_calma = media * (1 - FACTOR_SEPARACION_RAFAGA * fraccion) / (1 - fraccion)
+
+        acumulados = list(itertools.accumulate(self.tamanos))
+        total = acumulados[-1]
+
+        ids = GeneradorIds(trabajador=0)
+        segundos = 0.0
+        restantes_rafaga = 0
+        sala_id = 1
+        for _ in range(self.args.mensajes):
+            if restantes_rafaga:
+                restantes_rafaga -= 1
+                segundos += rnd.expovariate(1 / media_rafaga)
+            else:
+                # Sala elegida en proporción a su tamaño
+                sala_id = bisect.bisect_right(acumulados, rnd.random() * total) + 1
+                segundos += rnd.expovariate(1 / media_calma)
+                if rnd.random() < PROBABILIDAD_RAFAGA:
+                    restantes_rafaga = int(rnd.expovariate(1 / MENSAJES_POR_RAFAGA))
+
+            fecha = inicio + timedelta(seconds=segundos)
+            mensaje_id = ids.siguiente(round(fecha.replace(tzinfo=timezone.utc).timestamp() * 1000))
+            ultimos[sala_id] = (mensaje_id, fecha)
+            yield {
+                "id": mensaje_id,
+                "contenido": texto_aleatorio(rnd),
+                "fecha_envio": fecha,
+                "sala_id": sala_id,
+                "usuario_id": rnd.choice(self.miembros[sala_id - 1]),
+            }
+
+    def marcas_de_lectura(self, ultimos):
+        # Los que se quedan atrás lo hacen unos cientos de mensajes del total,
+        # traducidos a tiempo porque los ids codifican la fecha de envío
+        media_ms = self.args.dias * 86400 * 1000 / max(1, self.args.mensajes)
+        for sala_id, miembros in enumerate(self.miembros, start=1):
+            ultimo_id = ultimos.get(sala_id, (None, None))[0]
+            if ultimo_id is None:
+                continue
+            for usuario_id in miembros:
+                azar = self.rnd.random()
+                if azar < 0.8:
+                    marca = ultimo_id
+                elif azar < 0.95:
+                    retraso_ms = int(self.rnd.expovariate(1 / 500) * media_ms)
+                    marca = max(1, ultimo_id - (retraso_ms << DESPLAZAMIENTO_MS))
+                else:
+                    marca = None
+                yield {"b_usuario_id": usuario_id, "b_sala_id": sala_id, "marca": marca}
+
+
+def cargar(conn, tabla, filas, etiqueta):
+    inicio = time.perf_counter()
+    total = 0
+    for lote in en_lotes(filas):
+        conn.execute(tabla.insert(), lote)
+        total += len(lote)
+        if total % (TAMANO_LOTE * 50) == 0:
+            print(f"  {etiqueta}: {total:,}", end="\r", file=sys.stderr)
+    segundos = time.perf_counter() - inicio
+    print(f"{etiqueta:<18} {total:>12,} filas en {segundos:6.1f}s")
+    return total
+
+
+def generar(args):
+    if os.path.exists(args.db):
+        if not args.sobrescribir:
+            raise SystemExit(f"{args.db} ya existe (usa --sobrescribir)")
+        os.remove(args.db)
+
+    gestor = DatabaseManager(f"sqlite:///{os.path.abspath(args.db)}")
+
+    @event.listens_for(gestor.engine, "connect")
+    def _pragmas_de_carga(conexion, _):
+        # Es un fichero nuevo: si la carga falla se vuelve a generar
+        cursor = conexion.cursor()
+        cursor.execute("PRAGMA journal_mode = OFF")
+        cursor.execute("PRAGMA synchronous = OFF")
+        cursor.execute("PRAGMA cache_size = -200000")
+        cursor.close()
+
+    # Tablas sin índices secundarios; se crean al final
+    Base.metadata.create_all(gestor.engine)
+    indices = [indice for tabla in Base.metadata.sorted_tables for indice in tabla.indexes]
+    with gestor.engine.begin() as conn:
+        for indice in indices:
+            indice.drop(conn)
+
+    generador = Generador(args)
+    generador.tamanos = tamanos_zipf(args.salas, args.membresias, args.usuarios, args.zipf, generador.rnd)
+    inicio = datetime(2025, 1, 1)
+    clave_hash = generate_password_hash(CLAVE_GENERADA)
+    ultimos = {}
+
+    comienzo = time.perf_counter()
+    with gestor.engine.begin() as conn:
+        cargar(conn, Usuario.__table__, generador.usuarios(clave_hash, inicio), "usuarios")
+        cargar(conn, Sala.__table__, generador.salas(inicio), "salas")
+        cargar(conn, usuarios_salas, generador.membresias(inicio), "membresías")
+        cargar(conn, Mensaje.__table__, generador.mensajes(inicio, ultimos), "mensajes")
+
+        if ultimos:
+            conn.execute(
+                usuarios_salas.update()
+                .where(usuarios_salas.c.usuario_id == bindparam("b_usuario_id"))
+                .where(usuarios_salas.c.sala_id == bindparam("b_sala_id"))
+                .values(last_read_message_id=bindparam("marca")),
+                list(generador.marcas_de_lectura(ultimos))
+            )
+
+    inicio_indices = time.perf_counter()
+    with gestor.engine.begin() as conn:
+        for indice in indices:
+            indice.create(conn)
+    print(f"{'índices':<18} {len(indices):>12} en {time.perf_counter() - inicio_indices:6.1f}s")
+
+    # Contadores, última actividad y resumen del último mensaje de las salas
+    with gestor.session_scope():
+        gestor.recalcular_contadores_salas()
+        gestor.recalcular_resumenes_salas()
+    with gestor.engine.connect() as conn:
+        conn.exec_driver_sql("ANALYZE")
+
+    print(f"Generado {args.db} en {time.perf_counter() - comienzo:.1f}s "
+          f"({os.path.getsize(args.db) / 2**20:,.0f} MiB). Clave de los usuarios: '{CLAVE_GENERADA}'")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('db', help='Fichero SQLite a generar')
+    parser.add_argument('--usuarios', type=int, default=10000)
+    parser.add_argument('--salas', type=int, default=1000)
+    parser.add_argument('--membresias', type=int, default=None,
+                        help='Membresías en total (por defecto 5 por usuario)')
+    parser.add_argument('--mensajes', type=int, default=1000000)
+    parser.add_argument('--zipf', type=float, default=1.1, help='Exponente de la ley de Zipf de tamaños de sala')
+    parser.add_argument('--dias', type=float, default=90, help='Días que abarcan los mensajes')
+    parser.add_argument('--semilla', type=int, default=42)
+    parser.add_argument('--sobrescribir', action='store_true', help='Reemplaza el fichero si existe')
+    args = parser.parse_args()
+    if args.membresias is None:
+        args.membresias = args.usuarios * 5
+    generar(args)
+
+
+if __name__ == '__main__':
+    main()
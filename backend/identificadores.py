@@ -0,0 +1,238 @@
+"""
+Identificadores de mensajes ordenados por tiempo.
+
+Cada ID se compone, de los bits más altos a los más bajos, de:
+
+- 41 bits con los milisegundos transcurridos desde EPOCA (unos 69 años);
+- 6 bits con el número de trabajador (IDENTIFICADORES_TRABAJADOR, 0-63);
+- 6 bits con una secuencia dentro del mismo milisegundo (64 IDs por
+  milisegundo y trabajador).
+
+En total 53 bits: caben en un entero de 64 bits de la base de datos y
+también en un Number de JavaScript sin perder precisión, que es como los
+maneja el frontend.
+
+Dentro de un proceso los IDs son estrictamente crecientes aunque el reloj
+retroceda (se sigue usando el último milisegundo) o se agote la secuencia
+(se toma el milisegundo siguiente). Entre trabajadores con números distintos
+no se repiten y quedan ordenados por el instante en que se generaron, salvo
+el desfase entre sus relojes.
+
+El número de trabajador se fija con IDENTIFICADORES_TRABAJADOR o, si no está
+definido, cada proceso reserva uno libre en la propia base de datos SQLite
+(tabla trabajadores_ids) al abrir su primera conexión; así el servidor, sus
+trabajadores y sistema_mensajeria.py nunca comparten número. Las reservas se
+liberan al salir y las de procesos que ya no existen en el equipo se
+reutilizan.
+
+Los IDs de autoincremento anteriores son mucho menores que cualquier ID
+generado, así que los mensajes antiguos siguen ordenándose antes que los
+nuevos sin migrar nada.
+"""
+import atexit
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from datetime import datetime, timezone
+
+# 2024-01-01T00:00:00Z en milisegundos
+EPOCA_MS = 1704067200000
+
+BITS_TRABAJADOR = 6
+BITS_SECUENCIA = 6
+MAX_TRABAJADOR = (1 << BITS_TRABAJADOR) - 1
+MAX_SECUENCIA = (1 << BITS_SECUENCIA) - 1
+DESPLAZAMIENTO_MS = BITS_TRABAJADOR + BITS_SECUENCIA
+
+# Tabla de SQLite con el número de trabajador reservado por cada proceso
+TABLA_TRABAJADORES = 'trabajadores_ids'
+
+
+class GeneradorIds:
+    """
+    Genera IDs crecientes para un trabajador.
+
+    Args:
+        trabajador: Número de trabajador (0-63), distinto en cada proceso que escribe
+    """
+
+    def __init__(self, trabajador):
+        if not 0 <= trabajador <= MAX_TRABAJADOR:
+            raise ValueError(f"El número de trabajador debe estar entre 0 y {MAX_TRABAJADOR}")
+        self.trabajador = trabajador
+        self._ultimo_ms = -1
+        self._secuencia = MAX_SECUENCIA
+        self._lock = threading.Lock()
+
+    def siguiente(self, instante_ms=None):
+        """
+        Devuelve un ID nuevo.
+
+        Args:
+            instante_ms: Milisegundos Unix del ID (por defecto, el reloj actual)
+        """
+        if instante_ms is None:
+            instante_ms = time.time_ns() // 1_000_000
+        with self._lock:
+            ms = max(instante_ms - EPOCA_MS, self._ultimo_ms)
+            if ms == self._ultimo_ms:
+                if self._secuencia == MAX_SECUENCIA:
+                    ms += 1
+                    self._secuencia = 0
+                else:
+                    self._secuencia += 1
+            else:
+                self._secuencia = 0
+            self._ultimo_ms = ms
+            return (ms << DESPLAZAMIENTO_MS) | (self.trabajador << BITS_SECUENCIA) | self._secuencia
+
+    def posterior_a(self, id_existente):
+        """Garantiza que los IDs siguientes serán mayores que ``id_existente``"""
+        with self._lock:
+            ms = id_existente >> DESPLAZAMIENTO_MS
+            if ms >= self._ultimo_ms:
+                self._ultimo_ms = ms
+                self._secuencia = MAX_SECUENCIA
+
+
+def instante_de(id_mensaje):
+    """Fecha UTC en la que se generó un ID (sin sentido para los IDs de autoincremento)"""
+    ms = (id_mensaje >> DESPLAZAMIENTO_MS) + EPOCA_MS
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc)
+
+
+def _trabajador_configurado():
+    valor = os.environ.get('IDENTIFICADORES_TRABAJADOR')
+    return int(valor) if valor is not None else None
+
+
+def _proceso_vivo(pid):
+    if os.name == 'nt':
+        # En Windows os.kill() terminaría el proceso: se da por vivo
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+_configurado = _trabajador_configurado()
+# Hasta reservar un número se usa uno derivado del PID (ver siguiente_id())
+generador = GeneradorIds(_configurado if _configurado is not None else os.getpid() & MAX_TRABAJADOR)
+
+# (ruta de la base de datos, número) reservado por este proceso
+_reserva = None
+_lock_reserva = threading.Lock()
+_avisado = False
+
+
+def reservar_trabajador(conexion):
+    """
+    Reserva para el proceso un número de trabajador libre en una base de datos SQLite.
+
+    No hace nada si IDENTIFICADORES_TRABAJADOR fija el número o el proceso ya
+    tiene una reserva. Se llama con una conexión recién abierta, fuera de
+    cualquier transacción.
+
+    Args:
+        conexion: sqlite3.Connection de la base de datos en la que se guardan los mensajes
+
+    Raises:
+        RuntimeError: Si los 64 números están reservados por procesos vivos
+    """
+    global _reserva
+    if _configurado is not None or _reserva is not None:
+        return
+    with _lock_reserva:
+        if _reserva is not None:
+            return
+        ruta = next((fila[2] for fila in conexion.execute("PRAGMA database_list") if fila[1] == 'main'), '')
+        if not ruta:
+            # Base de datos en memoria: no la comparte ningún otro proceso
+            _reserva = ('', generador.trabajador)
+            return
+
+        equipo = socket.gethostname()
+        pid = os.getpid()
+        conexion.execute(
+            f"CREATE TABLE IF NOT EXISTS {TABLA_TRABAJADORES} ("
+            "trabajador INTEGER PRIMARY KEY, equipo TEXT NOT NULL, pid INTEGER NOT NULL, desde TEXT)"
+        )
+        conexion.commit()
+        # BEGIN IMMEDIATE: dos procesos que arrancan a la vez no eligen el mismo número
+        conexion.execute("BEGIN IMMEDIATE")
+        try:
+            ocupados = {
+                trabajador for trabajador, equipo_reserva, pid_reserva in
+                conexion.execute(f"SELECT trabajador, equipo, pid FROM {TABLA_TRABAJADORES}")
+                if equipo_reserva != equipo or (pid_reserva != pid and _proceso_vivo(pid_reserva))
+            }
+            libres = [t for t in range(MAX_TRABAJADOR + 1) if t not in ocupados]
+            if not libres:
+                raise RuntimeError(
+                    f"No quedan números de trabajador libres en {TABLA_TRABAJADORES}; "
+                    "define IDENTIFICADORES_TRABAJADOR o libera reservas antiguas"
+                )
+            conexion.execute(
+                f"INSERT OR REPLACE INTO {TABLA_TRABAJADORES} (trabajador, equipo, pid, desde) "
+                "VALUES (?, ?, ?, datetime('now'))",
+                (libres[0], equipo, pid)
+            )
+            conexion.commit()
+        except Exception:
+            conexion.rollback()
+            raise
+
+        generador.trabajador = libres[0]
+        _reserva = (ruta, libres[0])
+        logging.info(f"Número de trabajador {libres[0]} reservado para los IDs de mensaje")
+
+
+def _liberar_reserva():
+    if _reserva is None or not _reserva[0]:
+        return
+    ruta, trabajador = _reserva
+    try:
+        with closing(sqlite3.connect(ruta)) as conexion, conexion:
+            conexion.execute(
+                f"DELETE FROM {TABLA_TRABAJADORES} WHERE trabajador = ? AND equipo = ? AND pid = ?",
+                (trabajador, socket.gethostname(), os.getpid())
+            )
+    except sqlite3.Error as e:
+        logging.warning(f"No se pudo liberar el número de trabajador {trabajador}: {str(e)}")
+
+
+def _tras_fork():
+    # El hijo necesita su propio número: la reserva del padre sigue siendo suya
+    global _reserva, _lock_reserva, _avisado
+    _reserva = None
+    _avisado = False
+    _lock_reserva = threading.Lock()
+    generador._lock = threading.Lock()
+    if _configurado is None:
+        generador.trabajador = os.getpid() & MAX_TRABAJADOR
+
+
+atexit.register(_liberar_reserva)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_tras_fork)
+
+
+def siguiente_id():
+    """ID nuevo del generador del proceso"""
+    global _avisado
+    if _reserva is None and _configurado is None and not _avisado:
+        _avisado = True
+        logging.warning(
+            f"IDENTIFICADORES_TRABAJADOR no está definido y no se ha reservado número de trabajador; "
+            f"se usa {generador.trabajador}, derivado del PID. Si otro proceso escribe mensajes en la "
+            f"misma base de datos puede coincidir y fallar la clave primaria"
+        )
+    return generador.siguiente()
@@ -0,0 +1,86 @@
+"""
+Agrupación de las marcas de lectura enviadas por los clientes.
+
+Los clientes avisan de que han leído una sala cada vez que se desplaza el
+historial o llega un mensaje nuevo, lo que puede suponer varias peticiones por
+segundo y usuario. En lugar de escribir cada aviso en la base de datos, se
+guarda en memoria el mayor mensaje leído por (usuario, sala) y una tarea en
+segundo plano los escribe todos juntos cada cierto intervalo.
+"""
+import logging
+import threading
+
+from database import db
+
+
+class CoalescedorLecturas:
+    """
+    Acumula marcas de lectura y las escribe periódicamente en bloque.
+
+    Args:
+        socketio: Instancia de flask_socketio.SocketIO usada para la tarea en segundo plano
+        al_escribir: Función opcional llamada después de cada escritura con la
+            lista de marcas (usuario_id, sala_id, mensaje_id) que han avanzado
+        intervalo: Segundos entre escrituras
+    """
+
+    def __init__(self, socketio, al_escribir=None, intervalo=1.0):
+        self.socketio = socketio
+        self.al_escribir = al_escribir
+        self.intervalo = intervalo
+
+        self._pendientes = {}
+        self._lock = threading.Lock()
+        self._tarea = None
+
+        self._avisos_recibidos = 0
+        self._marcas_escritas = 0
+
+    def registrar(self, usuario_id, sala_id, mensaje_id):
+        """Registra que un usuario ha leído una sala hasta un mensaje"""
+        clave = (int(usuario_id), int(sala_id))
+        mensaje_id = int(mensaje_id)
+
+        with self._lock:
+            self._avisos_recibidos += 1
+            if mensaje_id > self._pendientes.get(clave, 0):
+                self._pendientes[clave] = mensaje_id
+            if self._tarea is None:
+                self._tarea = self.socketio.start_background_task(self._bucle)
+
+    def escribir_pendientes(self):
+        """Escribe en la base de datos todas las marcas acumuladas"""
+        with self._lock:
+            pendientes = self._pendientes
+            self._pendientes = {}
+
+        if not pendientes:
+            return 0
+
+        marcas = [(usuario_id, sala_id, mensaje_id)
+                  for (usuario_id, sala_id), mensaje_id in pendientes.items()]
+        with db.session_scope() as session:
+            avanzadas = db.marcar_leidos(marcas)
+
+        self._marcas_escritas += len(avanzadas)
+        if self.al_escribir and avanzadas:
+            self.al_escribir(avanzadas)
+        return len(avanzadas)
+
+    def _bucle(self):
+        while True:
+            self.socketio.sleep(self.intervalo)
+            try:
+                self.escribir_pendientes()
+            except Exception as e:
+                logging.error(f"Error al escribir las marcas de lectura: {str(e)}")
+
+    def estadisticas(self):
+        """Devuelve los contadores de avisos recibidos y marcas escritas"""
+        with self._lock:
+            pendientes = len(self._pendientes)
+        return {
+            "avisos_recibidos": self._avisos_recibidos,
+            "marcas_escritas": self._marcas_escritas,
+            "pendientes": pendientes,
+        }
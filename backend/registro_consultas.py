@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+"""
+Registro de las consultas SQL lentas, con el método y el endpoint que las lanzan.
+
+Se activa con la variable de entorno REGISTRO_CONSULTAS_LENTAS, que indica el
+fichero donde se escribe una línea JSON por cada sentencia que tarda más de
+REGISTRO_CONSULTAS_UMBRAL_MS milisegundos (100 por defecto):
+
+    {"t": 1718000000.123, "ms": 182.4, "filas": 50, "origen": "get_mensajes_paginados",
+     "endpoint": "get_room_messages", "ruta": "/api/rooms/3/messages",
+     "sql": "SELECT mensajes.id ... WHERE mensajes.sala_id = ? ...", "parametros": [3, "2024-06-10 08:15:00.000000", 50]}
+
+La duración es la de la ejecución de la sentencia (``after_cursor_execute``),
+que se registra en ese momento aunque el resultado no llegue a leerse entero.
+SQLite, sin embargo, hace buena parte del trabajo de una SELECT mientras se
+leen sus filas; con REGISTRO_CONSULTAS_LECTURAS=1 las conexiones de SQLite usan
+un cursor propio (mediante el ``factory`` de ``sqlite3.connect``) que suma
+también el tiempo de las llamadas a fetch, y las SELECT se registran al
+terminar de leerse, al cerrarse el cursor o al liberarse. ``filas`` son las
+afectadas por las sentencias que no son SELECT y, con
+REGISTRO_CONSULTAS_LECTURAS, las leídas en las SELECT.
+
+Los parámetros se redactan: los números, fechas y booleanos se conservan (son
+IDs y límites, útiles para reproducir la consulta) y los textos y binarios se
+sustituyen por su tipo y longitud, para no guardar mensajes, nombres ni hashes.
+
+``origen`` es la cadena de métodos de DatabaseManager que ha lanzado la
+sentencia (por ejemplo ``agregar_mensaje>_ajustar_contadores``) o, si se lanza
+desde fuera de database.py (una carga perezosa de una relación, por ejemplo),
+el primer fichero, línea y función ajenos a SQLAlchemy que aparecen en la pila.
+
+El fichero rota al llegar a REGISTRO_CONSULTAS_MAX_BYTES (10 MB por defecto)
+y se conservan REGISTRO_CONSULTAS_COPIAS copias (5 por defecto). Para ver qué
+sentencias pesan más, agrupadas por sentencia normalizada:
+
+    python registro_consultas.py resumen consultas_lentas.log* --orden total
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import re
+import sqlite3
+import statistics
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import date, datetime, time as hora
+from decimal import Decimal
+from logging.handlers import RotatingFileHandler
+
+import sqlalchemy
+from sqlalchemy import event
+
+MODULO_DATABASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'database.py')
+DIRECTORIO_SQLALCHEMY = os.path.dirname(os.path.abspath(sqlalchemy.__file__))
+
+# Las fechas llegan a SQLite ya convertidas en texto y no hace falta redactarlas
+PATRON_FECHA = re.compile(r'^\d{4}-\d{2}-\d{2}(?:[ T]\d{2}:\d{2}:\d{2}(?:\.\d+)?)?$')
+
+
+def redactar(valor):
+    """Copia de los parámetros de una sentencia sin textos ni binarios"""
+    if isinstance(valor, dict):
+        return {k: redactar(v) for k, v in valor.items()}
+    if isinstance(valor, (list, tuple)):
+        return [redactar(v) for v in valor]
+    if valor is None or isinstance(valor, (bool, int, float)):
+        return valor
+    if isinstance(valor, Decimal):
+        return float(valor)
+    if isinstance(valor, (datetime, date, hora)):
+        return valor.isoformat()
+    if isinstance(valor, str):
+        return valor if PATRON_FECHA.match(valor) else f"<texto {len(valor)}>"
+    if isinstance(valor, (bytes, bytearray, memoryview)):
+        return f"<bytes {len(valor)}>"
+    return f"<{type(valor).__name__}>"
+
+
+def origen_de_la_llamada():
+    """Métodos de DatabaseManager en la pila o, si no hay, la primera función ajena a SQLAlchemy"""
+    metodos = []
+    externo = None
+    marco = sys._getframe(1)
+    while marco is not None:
+        fichero = marco.f_code.co_filename
+        if fichero == MODULO_DATABASE:
+            metodos.append(marco.f_code.co_name)
+        elif metodos:
+            break
+        elif externo is None and not fichero.startswith(DIRECTORIO_SQLALCHEMY) and fichero != __file__:
+            externo = f"{os.path.basename(fichero)}:{marco.f_lineno} {marco.f_code.co_name}"
+        marco = marco.f_back
+    if metodos:
+        return ">".join(reversed(metodos))
+    return externo
+
+
+def contexto_flask():
+    """(endpoint, ruta) de la petición o evento de Socket.IO en curso, si lo hay"""
+    try:
+        from flask import has_request_context, request
+    except ImportError:
+        return None, None
+    if not has_request_context():
+        return None, None
+    # Flask-SocketIO ejecuta cada evento en un contexto de petición propio
+    evento = getattr(request, 'event', None)
+    if evento:
+        return f"socket:{evento.get('message')}", request.path
+    return request.endpoint, request.path
+
+
+class _CursorMedido(sqlite3.Cursor):
+    """Cursor de SQLite que suma a la SELECT en curso el tiempo y las filas de sus lecturas"""
+
+    # [registro, sql, parámetros, segundos, filas, origen, (endpoint, ruta)]
+    medicion = None
+
+    def _leer(self, metodo, *args):
+        inicio = time.perf_counter()
+        resultado = metodo(self, *args)
+        if self.medicion is not None:
+            self.medicion[3] += time.perf_counter() - inicio
+        return resultado
+
+    def fetchone(self):
+        fila = self._leer(sqlite3.Cursor.fetchone)
+        if fila is None:
+            self.terminar_medicion()
+        elif self.medicion is not None:
+            self.medicion[4] += 1
+        return fila
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        filas = self._leer(sqlite3.Cursor.fetchmany, size)
+        if self.medicion is not None:
+            self.medicion[4] += len(filas)
+        if len(filas) < size:
+            self.terminar_medicion()
+        return filas
+
+    def fetchall(self):
+        filas = self._leer(sqlite3.Cursor.fetchall)
+        if self.medicion is not None:
+            self.medicion[4] += len(filas)
+        self.terminar_medicion()
+        return filas
+
+    def close(self):
+        self.terminar_medicion()
+        super().close()
+
+    def __del__(self):
+        # Resultado abandonado sin leerse entero ni cerrarse
+        self.terminar_medicion()
+
+    def terminar_medicion(self):
+        medicion, self.medicion = self.medicion, None
+        if medicion is not None:
+            registro, sql, parametros, segundos, filas, origen, contexto = medicion
+            registro._terminar(sql, parametros, segundos, filas, origen, contexto)
+
+
+class _ConexionMedida(sqlite3.Connection):
+    """Conexión de SQLite cuyos cursores miden también las lecturas"""
+
+    def cursor(self, factory=_CursorMedido):
+        return super().cursor(factory)
+
+
+def argumentos_conexion(db_url):
+    """
+    Argumentos para ``create_engine(connect_args=...)``: con REGISTRO_CONSULTAS_LENTAS
+    y REGISTRO_CONSULTAS_LECTURAS activados en SQLite, la conexión que mide las lecturas
+    """
+    if (not os.environ.get('REGISTRO_CONSULTAS_LENTAS')
+            or os.environ.get('REGISTRO_CONSULTAS_LECTURAS', '0') in ('', '0')
+            or not str(db_url).startswith('sqlite')):
+        return {}
+    return {'factory': _ConexionMedida}
+
+
+class RegistroConsultasLentas:
+    """
+    Escribe en un fichero rotativo las sentencias de un motor que superan un umbral.
+
+    Args:
+        engine: Motor de SQLAlchemy
+        ruta: Fichero donde se escriben las consultas lentas
+        umbral_ms: Duración a partir de la cual se registra una sentencia
+        max_bytes: Tamaño a partir del cual rota el fichero
+        copias: Ficheros rotados que se conservan
+    """
+
+    def __init__(self, engine, ruta, umbral_ms=100.0, max_bytes=10 * 1024 * 1024, copias=5):
+        self.ruta = ruta
+        self.umbral = umbral_ms / 1000
+        self.registradas = 0
+        self._lock = threading.Lock()
+
+        self._logger = logging.getLogger(f"consultas_lentas.{os.path.abspath(ruta)}")
+        self._logger.setLevel(logging.INFO)
+        self._logger.propagate = False
+        if not self._logger.handlers:
+            manejador = RotatingFileHandler(ruta, maxBytes=max_bytes, backupCount=copias, encoding='utf-8')
+            manejador.setFormatter(logging.Formatter('%(message)s'))
+            self._logger.addHandler(manejador)
+
+        event.listen(engine, 'before_cursor_execute', self._antes)
+        event.listen(engine, 'after_cursor_execute', self._despues)
+
+    def _antes(self, conn, cursor, sql, parametros, contexto, executemany):
+        conn.info.setdefault('consultas_lentas_inicio', []).append(time.perf_counter())
+
+    def _despues(self, conn, cursor, sql, parametros, contexto, executemany):
+        segundos = time.perf_counter() - conn.info['consultas_lentas_inicio'].pop()
+        if isinstance(cursor, _CursorMedido):
+            cursor.terminar_medicion()
+            if cursor.description is not None:
+                # SELECT con REGISTRO_CONSULTAS_LECTURAS: se registra al terminar
+                # de leerla, con el origen de ahora, que es cuando se lanza
+                cursor.medicion = [self, sql, parametros, segundos, 0, origen_de_la_llamada(), contexto_flask()]
+                return
+        self._terminar(sql, parametros, segundos, cursor.rowcount if cursor.description is None else None)
+
+    def _terminar(self, sql, parametros, segundos, filas, origen=None, contexto=None):
+        if segundos < self.umbral:
+            return
+        endpoint, ruta = contexto if contexto is not None else contexto_flask()
+        registro = {
+            "t": round(time.time(), 3),
+            "ms": round(segundos * 1000, 2),
+            "filas": filas if filas is not None and filas >= 0 else None,
+            "origen": origen if origen is not None else origen_de_la_llamada(),
+            "endpoint": endpoint,
+            "ruta": ruta,
+            "sql": " ".join(sql.split()),
+            "parametros": redactar(parametros),
+        }
+        with self._lock:
+            self.registradas += 1
+        try:
+            self._logger.info(json.dumps(registro, ensure_ascii=False))
+        except Exception as e:
+            logging.error(f"Error al registrar una consulta lenta: {str(e)}")
+
+    def estadisticas(self):
+        return {
+            "fichero": self.ruta,
+            "umbral_ms": self.umbral * 1000,
+            "registradas": self.registradas,
+        }
+
+
+def desde_entorno(engine):
+    """Registro configurado con las variables REGISTRO_CONSULTAS_*, o None si no está activado"""
+    ruta = os.environ.get('REGISTRO_CONSULTAS_LENTAS')
+    if not ruta:
+        return None
+    return RegistroConsultasLentas(
+        engine,
+        ruta,
+        umbral_ms=float(os.environ.get('REGISTRO_CONSULTAS_UMBRAL_MS', 100)),
+        max_bytes=int(os.environ.get('REGISTRO_CONSULTAS_MAX_BYTES', 10 * 1024 * 1024)),
+        copias=int(os.environ.get('REGISTRO_CONSULTAS_COPIAS', 5)),
+    )
+
+
+# Normalización de sentencias para agruparlas en el resumen
+PATRON_LISTA = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+PATRON_TEXTO = re.compile(r"'(?:[^']|'')*'")
+PATRON_NUMERO = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?\b')
+PATRON_NOMBRADO = re.compile(r'(?::\w+|%\(\w+\)s|\$\d+)')
+
+
+def normalizar(sql):
+    """Sentencia con los literales y listas de parámetros sustituidos por ?"""
+    sql = PATRON_TEXTO.sub('?', sql)
+    sql = PATRON_NOMBRADO.sub('?', sql)
+    sql = PATRON_NUMERO.sub('?', sql)
+    return PATRON_LISTA.sub('(?, ...)', sql)
+
+
+def leer_registros(patrones):
+    for patron in patrones:
+        for ruta in sorted(glob.glob(patron)) or [patron]:
+            with open(ruta, encoding='utf-8') as f:
+                for linea in f:
+                    if linea.strip():
+                        yield json.loads(linea)
+
+
+def resumen(args):
+    grupos = defaultdict(list)
+    for registro in leer_registros(args.ficheros):
+        grupos[normalizar(registro['sql'])].append(registro)
+    if not grupos:
+        print("No hay consultas registradas.")
+        return
+
+    filas = []
+    for sql, registros in grupos.items():
+        tiempos = sorted(r['ms'] for r in registros)
+        leidas = [r['filas'] for r in registros if r.get('filas') is not None]
+        filas.append({
+            "sql": sql,
+            "n": len(tiempos),
+            "total": sum(tiempos),
+            "p50": statistics.median(tiempos),
+            "p95": tiempos[max(0, int(len(tiempos) * 0.95) - 1)],
+            "max": tiempos[-1],
+            "filas": statistics.mean(leidas) if leidas else None,
+            "origenes": Counter(r.get('origen') or '-' for r in registros),
+            "endpoints": Counter(r.get('endpoint') or '-' for r in registros),
+        })
+    filas.sort(key=lambda f: -f[args.orden])
+
+    print(f"{'N':>6} {'TOTAL ms':>10} {'P50 ms':>8} {'P95 ms':>8} {'MAX ms':>8} {'FILAS':>8}  SENTENCIA")
+    print("-" * 110)
+    for fila in filas[:args.limite]:
+        media_filas = f"{fila['filas']:.0f}" if fila['filas'] is not None else '-'
+        print(f"{fila['n']:>6} {fila['total']:>10.1f} {fila['p50']:>8.1f} {fila['p95']:>8.1f} "
+              f"{fila['max']:>8.1f} {media_filas:>8}  {fila['sql'][:args.ancho]}")
+        origenes = ", ".join(f"{o} ({n})" for o, n in fila['origenes'].most_common(3))
+        endpoints = ", ".join(f"{e} ({n})" for e, n in fila['endpoints'].most_common(3))
+        print(f"{'':>52}  origen: {origenes}")
+        print(f"{'':>52}  endpoint: {endpoints}")
+    if len(filas) > args.limite:
+        print(f"\n... y {len(filas) - args.limite} sentencias más.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    subparsers = parser.add_subparsers(dest='comando', required=True)
+    parser_resumen = subparsers.add_parser('resumen', help='Agrupa las consultas lentas por sentencia normalizada')
+    parser_resumen.add_argument('ficheros', nargs='+', help='Ficheros del registro (admite comodines)')
+    parser_resumen.add_argument('--orden', default='total', choices=['total', 'n', 'p50', 'p95', 'max'],
+                                help='Criterio de ordenación')
+    parser_resumen.add_argument('--limite', type=int, default=20, help='Sentencias que se muestran')
+    parser_resumen.add_argument('--ancho', type=int, default=200, help='Caracteres de cada sentencia')
+    args = parser.parse_args()
+
+    if args.comando == 'resumen':
+        resumen(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Formatos de serialización de los eventos de Socket.IO.
+
+Por defecto los eventos se envían como JSON. Un cliente puede pedir al
+conectarse el formato ``msgpack``: entonces cada evento se envía como un único
+adjunto binario de Socket.IO codificado con MessagePack, con las fechas como
+milisegundos desde epoch (enteros) y los IDs siempre como enteros.
+
+La codificación se hace una sola vez por evento y formato, aunque el evento se
+entregue a muchas conexiones.
+"""
+from datetime import datetime, timezone
+
+try:
+    import msgpack
+except ImportError:  # msgpack es opcional
+    msgpack = None
+
+FORMATO_JSON = 'json'
+FORMATO_MSGPACK = 'msgpack'
+
+
+def formatos_disponibles():
+    """Devuelve los formatos que se pueden negociar en este servidor"""
+    if msgpack is None:
+        return (FORMATO_JSON,)
+    return (FORMATO_JSON, FORMATO_MSGPACK)
+
+
+def negociar_formato(pedido):
+    """Devuelve el formato pedido por el cliente si está disponible, o JSON"""
+    return pedido if pedido in formatos_disponibles() else FORMATO_JSON
+
+
+def _a_epoch_ms(valor):
+    try:
+        fecha = datetime.fromisoformat(valor.replace('Z', '+00:00'))
+    except ValueError:
+        return valor
+    if fecha.tzinfo is None:
+        # Las fechas del modelo se guardan en UTC sin zona horaria
+        fecha = fecha.replace(tzinfo=timezone.utc)
+    return int(fecha.timestamp() * 1000)
+
+
+def a_compacto(datos):
+    """
+    Convierte los datos de un evento a su forma compacta: fechas ISO a
+    milisegundos desde epoch e IDs en texto a enteros.
+    """
+    if isinstance(datos, dict):
+        compacto = {}
+        for clave, valor in datos.items():
+            if isinstance(valor, str):
+                if clave.startswith('fecha'):
+                    valor = _a_epoch_ms(valor)
+                elif (clave == 'id' or clave.endswith('_id')) and valor.isdigit():
+                    valor = int(valor)
+            elif isinstance(valor, datetime):
+                valor = _a_epoch_ms(valor.isoformat())
+            else:
+                valor = a_compacto(valor)
+            compacto[clave] = valor
+        return compacto
+    if isinstance(datos, list):
+        return [a_compacto(v) for v in datos]
+    return datos
+
+
+def codificar(datos, formato):
+    """Codifica los datos de un evento en el formato indicado"""
+    if formato == FORMATO_MSGPACK:
+        return msgpack.packb(a_compacto(datos), use_bin_type=True)
+    return datos
+
+
+class CargaEvento:
+    """
+    Datos de un evento compartidos por todas las colas de salida.
+
+    Guarda la versión codificada de cada formato la primera vez que se pide,
+    de modo que un evento difundido a mil conexiones MessagePack se codifica
+    una sola vez.
+    """
+    __slots__ = ('datos', '_codificados')
+
+    def __init__(self, datos):
+        self.datos = datos
+        self._codificados = None
+
+    def para(self, formato):
+        if formato == FORMATO_JSON:
+            return self.datos
+        if self._codificados is None:
+            self._codificados = {}
+        codificado = self._codificados.get(formato)
+        if codificado is None:
+            codificado = codificar(self.datos, formato)
+            self._codificados[formato] = codificado
+        return codificado
@@ -1,16 +1,22 @@
 #!/usr/bin/env python
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, send_file
 from flask_jwt_extended import (
-    JWTManager, create_access_token, 
+    JWTManager, create_access_token, decode_token,
     jwt_required, get_jwt_identity, get_jwt,
 )
 from flask_jwt_extended.exceptions import NoAuthorizationError
 from jwt.exceptions import ExpiredSignatureError
 from werkzeug.security import check_password_hash
 import os
+import hmac
+import json
+import mimetypes
+import threading
+import time
 from datetime import timedelta
 import logging
 from flask_socketio import SocketIO
+from flask_socketio import join_room as unir_a_sala_socket, leave_room as salir_de_sala_socket
 from flask_cors import CORS
 
 # Importar el módulo de base de datos
@@ -18,6 +24,12 @@ from database import db, Usuario
 from services.usuarios import UsuarioService
 from services.mensajes import MensajesService
 from services.salas import SalaService
+from colas_socket import GestorColasSocket, POLITICA_RESYNC, EVENTO_RESYNC
+from lecturas import CoalescedorLecturas
+from serializacion import negociar_formato
+from avisos_internos import CanalAvisos
+from captura_trafico import CapturaTrafico
+from adjuntos import AlmacenAdjuntos, AdjuntoDemasiadoGrande
 
 # Configuración de la aplicación
 app = Flask(__name__)
@@ -34,6 +46,49 @@ CORS(app, supports_credentials=False)
 # Inicializa SocketIO con la app Flask
 socketio = SocketIO(app, cors_allowed_origins="*")
 
+# Colas de salida acotadas por conexión para proteger al servidor de clientes lentos
+colas_socket = GestorColasSocket(
+    socketio,
+    max_eventos=int(os.environ.get('SOCKET_COLA_MAX_EVENTOS', 256)),
+    politica=os.environ.get('SOCKET_COLA_POLITICA', POLITICA_RESYNC),
+    max_pendientes_transporte=int(os.environ.get('SOCKET_COLA_MAX_PENDIENTES', 32)),
+)
+
+def notificar_lecturas(marcas):
+    """Avisa a cada sala de las marcas de lectura que acaban de avanzar"""
+    for usuario_id, sala_id, mensaje_id in marcas:
+        colas_socket.difundir("lectura_actualizada", {
+            "sala_id": sala_id,
+            "usuario_id": usuario_id,
+            "last_read_message_id": mensaje_id
+        }, sala_id)
+
+# Avisos internos para otros procesos (el frontend invalida su caché de salas
+# con ellos, también cuando cambian los mensajes de una sala). Solo se sirven si se configura un secreto compartido.
+INTERNAL_EVENTS_SECRET = os.environ.get('INTERNAL_EVENTS_SECRET')
+canal_avisos = CanalAvisos(socketio)
+db.oyentes_salas.append(
+    lambda usuario_ids, sala_ids: canal_avisos.publicar("salas", {"usuarios": usuario_ids, "salas": sala_ids})
+)
+
+# Límites de POST /api/batch: subpeticiones por lote y segundos de trabajo
+BATCH_MAX_PETICIONES = int(os.environ.get('BATCH_MAX_PETICIONES', 10))
+BATCH_MAX_SEGUNDOS = float(os.environ.get('BATCH_MAX_SEGUNDOS', 5))
+
+# Número máximo de eventos que se reproducen por sala al reconectarse un socket.
+# Si un cliente se ha perdido más, se le pide que recargue la sala completa.
+REPLAY_MAX_EVENTOS = int(os.environ.get('REPLAY_MAX_EVENTOS', 500))
+# Segundos entre recortes del registro de cambios, que conserva por sala un
+# evento más de los que se reproducen (ver DatabaseManager.purgar_eventos)
+EVENTOS_INTERVALO_PURGA = float(os.environ.get('EVENTOS_INTERVALO_PURGA', 3600))
+
+# Las marcas de lectura se agrupan en memoria y se escriben en bloque
+coalescedor_lecturas = CoalescedorLecturas(
+    socketio,
+    al_escribir=notificar_lecturas,
+    intervalo=float(os.environ.get('LECTURAS_INTERVALO', 1.0)),
+)
+
 # Configuración de JWT
 app.config['JWT_SECRET_KEY'] = os.environ.get('JWT_SECRET_KEY', 'tu_clave_secreta_super_segura')
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=1)  # El token expira en 1 hora
@@ -41,8 +96,23 @@ app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=1)  # El token expira e
 # Inicializar JWT
 jwt = JWTManager(app)
 
+# Ficheros adjuntos (ver adjuntos.py). Con ADJUNTOS_X_SENDFILE=1 la descarga
+# la sirve el proxy con la cabecera X-Sendfile en lugar del propio proceso.
+almacen_adjuntos = AlmacenAdjuntos()
+app.config['USE_X_SENDFILE'] = os.environ.get('ADJUNTOS_X_SENDFILE') == '1'
+
 TRUSTED_IPS = ["192.168.1.64", "93.176.176.101", "90.175.164.116"]
 
+# Captura opcional de las peticiones para reproducirlas con
+# benchmarks/reproducir_trafico.py (ver captura_trafico.py)
+captura_trafico = None
+if os.environ.get('CAPTURA_TRAFICO'):
+    captura_trafico = CapturaTrafico(
+        app,
+        os.environ['CAPTURA_TRAFICO'],
+        muestreo=float(os.environ.get('CAPTURA_TRAFICO_MUESTREO', 1.0)),
+    )
+
 #CORS FIX
 @app.after_request
 def add_cors_headers(response):
@@ -332,11 +402,11 @@ def get_user_profile(user_id):
 @jwt_required()
 def search_users():
     """
-    Busca usuarios por nombre parcial (case-insensitive).
+    Busca usuarios cuyo nombre empieza por el texto dado (case-insensitive).
     Requiere autenticación con JWT.
     
     Query Parameters:
-        query (str): Texto a buscar en los nombres de usuario (mínimo 2 caracteres)
+        query (str): Comienzo del nombre de usuario (mínimo 2 caracteres)
         limit (int, opcional): Número máximo de resultados (por defecto 10, máximo 50)
         
     Returns:
@@ -379,6 +449,126 @@ def search_users():
             "results": results
         }), 200
 
+# Ruta de métricas internas
+@app.route("/api/metrics", methods=["GET"])
+def get_metrics():
+    """
+    Devuelve métricas internas del servidor en formato JSON.
+    Solo accesible desde localhost o desde las IPs de confianza.
+    """
+    if request.remote_addr not in TRUSTED_IPS + ["127.0.0.1", "::1"]:
+        return jsonify({"msg": "No autorizado"}), 403
+
+    metricas = {
+        "sockets": colas_socket.estadisticas(),
+        "lecturas": coalescedor_lecturas.estadisticas()
+    }
+    if captura_trafico is not None:
+        metricas["captura_trafico"] = captura_trafico.estadisticas()
+    if db.registro_consultas is not None:
+        metricas["consultas_lentas"] = db.registro_consultas.estadisticas()
+    return jsonify(metricas), 200
+
+# Ruta de avisos internos (Server-Sent Events)
+@app.route("/api/internal/membership-events", methods=["GET"])
+def membership_events():
+    """
+    Flujo de avisos de cambios de pertenencia a salas para otros procesos.
+    Requiere la cabecera X-Internal-Secret con el valor de INTERNAL_EVENTS_SECRET.
+    
+    Query Parameters:
+        desde: Último número de secuencia recibido (opcional)
+    """
+    secreto = request.headers.get('X-Internal-Secret', '')
+    if not INTERNAL_EVENTS_SECRET or not hmac.compare_digest(secreto, INTERNAL_EVENTS_SECRET):
+        return jsonify({"msg": "No encontrado"}), 404
+    
+    desde = request.args.get('desde', type=int)
+    return Response(
+        stream_with_context(canal_avisos.suscribir(desde)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def ejecutar_subpeticion(ruta):
+    """
+    Ejecuta una subpetición GET de un lote dentro de la petición actual.
+    
+    La vista se llama sin su decorador jwt_required: el token ya se ha
+    verificado en /api/batch y la identidad sigue disponible en el contexto.
+    Tampoco pasa por los before_request/after_request de la aplicación (la
+    captura de tráfico y las cabeceras CORS), que ya se aplican al lote.
+    
+    Cada subpetición se ejecuta en un SAVEPOINT de la sesión del lote: si
+    falla, se deshace solo lo suyo y las siguientes pueden seguir usando la
+    sesión.
+    
+    Returns:
+        tuple: (código de estado, cuerpo JSON)
+    """
+    with app.test_request_context(ruta, method="GET", headers={
+        "Authorization": request.headers.get("Authorization", "")
+    }) as contexto:
+        peticion = contexto.request
+        if peticion.routing_exception is not None:
+            return peticion.routing_exception.code, {"error": peticion.routing_exception.description}
+        
+        vista = app.view_functions[peticion.url_rule.endpoint]
+        vista = getattr(vista, "__wrapped__", vista)
+        punto = db.get_session().begin_nested()
+        try:
+            respuesta = app.make_response(vista(**peticion.view_args))
+        except Exception as e:
+            punto.rollback()
+            logging.error(f"Error en la subpetición {ruta}: {str(e)}")
+            return 500, {"error": "Error interno"}
+        # Las vistas que capturan sus errores devuelven 500 sin propagarlos
+        if respuesta.status_code >= 500:
+            punto.rollback()
+        else:
+            punto.commit()
+        return respuesta.status_code, respuesta.get_json(silent=True)
+
+# Ruta de peticiones agrupadas
+@app.route("/api/batch", methods=["POST"])
+@jwt_required()
+def batch():
+    """
+    Ejecuta varias peticiones GET de la API en una sola llamada, con una única
+    verificación del token y una única sesión de base de datos.
+    
+    Body (JSON):
+        requests: Lista de {"method": "GET", "path": "/api/..."}
+        
+    Returns:
+        {"responses": [{"status": 200, "body": ...}, ...]} en el mismo orden
+    """
+    data = request.get_json(silent=True) or {}
+    peticiones = data.get("requests")
+    if not isinstance(peticiones, list) or not peticiones:
+        return jsonify({"error": "Se requiere una lista de peticiones"}), 400
+    if len(peticiones) > BATCH_MAX_PETICIONES:
+        return jsonify({"error": f"Como máximo {BATCH_MAX_PETICIONES} peticiones por lote"}), 400
+    
+    respuestas = []
+    limite = time.monotonic() + BATCH_MAX_SEGUNDOS
+    with db.session_scope():
+        for peticion in peticiones:
+            ruta = peticion.get("path") if isinstance(peticion, dict) else None
+            metodo = str(peticion.get("method", "GET")).upper() if isinstance(peticion, dict) else None
+            
+            if not isinstance(ruta, str) or not ruta.startswith("/api/") or ruta.startswith("/api/batch"):
+                status, cuerpo = 400, {"error": "Ruta no válida"}
+            elif metodo != "GET":
+                status, cuerpo = 405, {"error": "Solo se admiten peticiones GET"}
+            elif time.monotonic() > limite:
+                status, cuerpo = 503, {"error": "Tiempo máximo del lote agotado"}
+            else:
+                status, cuerpo = ejecutar_subpeticion(ruta)
+            respuestas.append({"status": status, "body": cuerpo})
+    
+    return jsonify({"responses": respuestas}), 200
+
 # Ruta de prueba
 @app.route("/")
 def index():
@@ -403,11 +593,11 @@ def get_rooms():
     # Obtener el ID del usuario autenticado
     user_id = get_jwt_identity()
     
-    # Obtener las salas a las que pertenece el usuario
+    # Obtener las salas a las que pertenece el usuario con sus mensajes no leídos
     with db.session_scope() as session:
-        salas = SalaService.listar_salas(usuario_id=user_id)
+        salas = SalaService.listar_salas_con_no_leidos(usuario_id=user_id)
 
-        for sala in salas:
+        for sala, _, _ in salas:
             socketio.emit("join_room", {"sala_id": sala.id}, to=f"user_{user_id}")
     
         # Convertir las salas a diccionario para la respuesta
@@ -415,8 +605,14 @@ def get_rooms():
             "id": sala.id,
             "nombre": sala.nombre,
             "privada": sala.privada,
-            "fecha_creado": sala.fecha_creado.isoformat()
-        } for sala in salas]
+            "fecha_creado": sala.fecha_creado.isoformat(),
+            "member_count": sala.member_count,
+            "message_count": sala.message_count,
+            "last_activity": sala.last_activity.isoformat() if sala.last_activity else None,
+            "last_message": sala.resumen.to_dict() if sala.resumen else None,
+            "last_read_message_id": ultimo_leido,
+            "no_leidos": no_leidos
+        } for sala, ultimo_leido, no_leidos in salas]
     
         return jsonify(salas_dict), 200
 
@@ -454,7 +650,10 @@ def get_room(room_id):
             "id": sala.id,
             "nombre": sala.nombre,
             "tipo": "privada" if sala.privada else "pública",
-            "fecha_creacion": sala.fecha_creado.isoformat()
+            "fecha_creacion": sala.fecha_creado.isoformat(),
+            "member_count": sala.member_count,
+            "message_count": sala.message_count,
+            "last_activity": sala.last_activity.isoformat() if sala.last_activity else None
         }), 200
 
 @app.route("/api/rooms", methods=["POST"])
@@ -516,7 +715,7 @@ def join_room(room_id):
         Mensaje de éxito o error
     """
     # Verificar que el usuario está autenticado
-    status_code, user_id, _ = verify_jwt_and_get_user()
+    status_code, user_id, _, _ = verify_jwt_and_get_user()
     if status_code != 200:
         return jsonify({"msg": "No autorizado"}), 401
         
@@ -532,7 +731,7 @@ def join_room(room_id):
         
         try:
             # Unir al usuario a la sala
-            SalaService.agregar_usuario_a_sala(room_id, user_id)
+            SalaService.agregar_usuario_a_sala(user_id, room_id)
             socketio.emit("join_room", {"sala_id": room_id}, to=f"user_{user_id}")
             return jsonify({"msg": "Te has unido a la sala correctamente"}), 200
         except Exception as e:
@@ -551,7 +750,7 @@ def leave_room(room_id):
         Mensaje de éxito o error
     """
     # Verificar que el usuario está autenticado
-    status_code, user_id, _ = verify_jwt_and_get_user()
+    status_code, user_id, _, _ = verify_jwt_and_get_user()
     if status_code != 200:
         return jsonify({"msg": "No autorizado"}), 401
         
@@ -586,7 +785,7 @@ def update_room(room_id):
         La sala actualizada
     """
     # Verificar que el usuario está autenticado
-    status_code, user_id, _ = verify_jwt_and_get_user()
+    status_code, user_id, _, _ = verify_jwt_and_get_user()
     if status_code != 200:
         return jsonify({"msg": "No autorizado"}), 401
         
@@ -637,7 +836,7 @@ def delete_room(room_id):
         Mensaje de éxito o error
     """
     # Verificar que el usuario está autenticado
-    status_code, user_id, _ = verify_jwt_and_get_user()
+    status_code, user_id, _, _ = verify_jwt_and_get_user()
     if status_code != 200:
         return jsonify({"msg": "No autorizado"}), 401
         
@@ -659,6 +858,72 @@ def delete_room(room_id):
     except Exception as e:
         return jsonify({"msg": f"Error al eliminar la sala: {str(e)}"}), 500
 
+@app.route("/api/rooms/<int:room_id>/read", methods=["POST"])
+@jwt_required()
+def mark_room_read(room_id):
+    """
+    Avanza la marca de lectura del usuario en una sala.
+    
+    Las marcas se agrupan en el servidor y se guardan en bloque, por lo que el
+    cliente puede llamar a este endpoint cada vez que muestra mensajes nuevos.
+    Al guardarse, la marca se limita al último mensaje de la sala.
+    
+    Body (JSON):
+        mensaje_id: ID del último mensaje leído (requerido)
+        
+    Returns:
+        La marca registrada
+    """
+    status_code, user_id, _, _ = verify_jwt_and_get_user()
+    if status_code != 200:
+        return jsonify({"msg": "No autorizado"}), 401
+    
+    data = request.get_json(silent=True) or {}
+    mensaje_id = data.get('mensaje_id')
+    if not isinstance(mensaje_id, int) or mensaje_id <= 0:
+        return jsonify({"msg": "Se requiere un mensaje_id válido"}), 400
+    
+    with db.session_scope() as session:
+        if not SalaService.es_miembro(room_id, user_id):
+            return jsonify({"msg": "No eres miembro de esta sala"}), 403
+    
+    coalescedor_lecturas.registrar(user_id, room_id, mensaje_id)
+    return jsonify({"sala_id": room_id, "last_read_message_id": mensaje_id}), 202
+
+@app.route("/api/rooms/<int:room_id>/read-marks", methods=["GET"])
+@jwt_required()
+def get_room_read_marks(room_id):
+    """
+    Obtiene las marcas de lectura de los miembros de una sala a partir de un mensaje.
+    
+    Un miembro ha leído todos los mensajes con ID menor o igual que su marca,
+    así que el cliente puede calcular los lectores de toda una página de
+    mensajes con una sola llamada.
+    
+    Query Parameters:
+        since: ID del mensaje más antiguo de la página (requerido)
+        
+    Returns:
+        Lista de marcas de lectura
+    """
+    status_code, user_id, _, _ = verify_jwt_and_get_user()
+    if status_code != 200:
+        return jsonify({"msg": "No autorizado"}), 401
+    
+    since = request.args.get('since', type=int)
+    if since is None:
+        return jsonify({"msg": "Se requiere el parámetro since"}), 400
+    
+    with db.session_scope() as session:
+        if not SalaService.es_miembro(room_id, user_id):
+            return jsonify({"msg": "No eres miembro de esta sala"}), 403
+        
+        marcas = SalaService.listar_marcas_de_lectura(room_id, since)
+        return jsonify([{
+            "usuario_id": usuario_id,
+            "last_read_message_id": ultimo_leido
+        } for usuario_id, ultimo_leido in marcas]), 200
+
 @app.route("/api/rooms/<int:room_id>/members", methods=["GET"])
 @jwt_required()
 def get_room_members(room_id):
@@ -672,7 +937,7 @@ def get_room_members(room_id):
         Lista de miembros de la sala
     """
     # Verificar que el usuario está autenticado
-    status_code, user_id, _ = verify_jwt_and_get_user()
+    status_code, user_id, _, _ = verify_jwt_and_get_user()
     if status_code != 200:
         return jsonify({"msg": "No autorizado"}), 401
         
@@ -687,12 +952,12 @@ def get_room_members(room_id):
         
     # Obtener los miembros de la sala
     try:
-        miembros = SalaService.listar_usuarios_de_sala(room_id)
+        miembros = SalaService.listar_miembros_de_sala(room_id)
         return jsonify([{
-            "id": m.usuario.id,
-            "nombre": m.usuario.nombre,
+            "id": m.id,
+            "nombre": m.nombre,
             "rol": m.rol,
-            "fecha_union": m.fecha_union.isoformat()
+            "fecha_union": m.fecha_union.isoformat() if m.fecha_union else None
         } for m in miembros]), 200
     except Exception as e:
         return jsonify({"msg": f"Error al obtener los miembros de la sala: {str(e)}"}), 500
@@ -725,13 +990,7 @@ def get_room_messages(room_id):
         )
         
         # Convertir mensajes a diccionarios
-        mensajes_dict = [{
-            'id': msg.id,
-            'contenido': msg.contenido,
-            'fecha_envio': msg.fecha_envio.isoformat(),
-            'usuario_id': msg.usuario_id,
-            'sala_id': msg.sala_id
-        } for msg in mensajes]
+        mensajes_dict = [msg.to_dict() for msg in mensajes]
         
         return jsonify(mensajes_dict), 200
         
@@ -773,21 +1032,117 @@ def send_message(room_id):
                 return jsonify({"error": str(e)}), 400
             
             # Convertir el mensaje a diccionario para la respuesta
-            mensaje_dict = {
-                'id': mensaje.id,
-                'contenido': mensaje.contenido,
-                'fecha_envio': mensaje.fecha_envio.isoformat(),
-                'usuario_id': mensaje.usuario_id,
-                'sala_id': mensaje.sala_id
-            }
+            mensaje_dict = dict(mensaje.to_dict(), seq=mensaje.seq)
 
-            socketio.emit("nuevo_mensaje", mensaje_dict, room=f"sala_{room_id}")
+            colas_socket.difundir("nuevo_mensaje", mensaje_dict, room_id)
             
             return jsonify(mensaje_dict), 201
         
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
+@app.route("/api/rooms/<int:room_id>/attachments", methods=["POST"])
+@jwt_required()
+def upload_attachment(room_id):
+    """
+    Envía un fichero adjunto a una sala como un mensaje nuevo.
+    
+    El cuerpo de la petición es el contenido del fichero tal cual (no
+    multipart) y se escribe en disco por bloques sin cargarlo en memoria.
+    
+    Query Parameters:
+        nombre: Nombre del fichero (requerido)
+        contenido: Texto del mensaje (por defecto, el nombre del fichero)
+        
+    Returns:
+        El mensaje creado con su adjunto
+    """
+    try:
+        nombre = os.path.basename((request.args.get('nombre') or '').replace('\\', '/'))[:255]
+        if not nombre:
+            return jsonify({"error": "El nombre del fichero es requerido"}), 400
+        tipo = (request.mimetype or mimetypes.guess_type(nombre)[0]
+                or 'application/octet-stream')
+        
+        user_id = get_jwt_identity()
+        
+        # Antes de leer el cuerpo, para no guardar ficheros de quien no puede enviarlos
+        with db.session_scope():
+            if not SalaService.es_miembro(room_id, user_id):
+                return jsonify({"error": "No puedes enviar mensajes a una sala de la que no eres miembro"}), 403
+        
+        if request.content_length is not None and request.content_length > almacen_adjuntos.max_bytes:
+            return jsonify({"error": f"El adjunto supera el tamaño máximo de {almacen_adjuntos.max_bytes} bytes"}), 413
+        
+        # Fuera de la transacción: la subida puede tardar
+        try:
+            sha256, tamano = almacen_adjuntos.guardar(request.stream)
+        except AdjuntoDemasiadoGrande as e:
+            return jsonify({"error": str(e)}), 413
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        with db.session_scope():
+            try:
+                mensaje = MensajesService.agregar_mensaje(
+                    contenido=request.args.get('contenido') or nombre,
+                    sala_id=room_id,
+                    usuario_id=user_id,
+                    adjuntos=[{'nombre': nombre, 'tipo': tipo, 'tamano': tamano, 'sha256': sha256}]
+                )
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            
+            mensaje_dict = dict(mensaje.to_dict(), seq=mensaje.seq)
+
+            colas_socket.difundir("nuevo_mensaje", mensaje_dict, room_id)
+            
+            return jsonify(mensaje_dict), 201
+        
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route("/api/attachments/<int:attachment_id>", methods=["GET"])
+@jwt_required()
+def download_attachment(attachment_id):
+    """
+    Descarga un fichero adjunto si el usuario es miembro de la sala del mensaje.
+    
+    Admite peticiones condicionales (ETag con el SHA-256) y de rangos
+    (cabecera Range) para reanudar descargas.
+    
+    Returns:
+        El contenido del fichero
+    """
+    try:
+        user_id = get_jwt_identity()
+        
+        with db.session_scope():
+            adjunto = MensajesService.obtener_adjunto(attachment_id, user_id)
+            if not adjunto:
+                return jsonify({"error": "Adjunto no encontrado"}), 404
+            ruta = almacen_adjuntos.ruta_de(adjunto.sha256)
+            nombre, tipo, sha256 = adjunto.nombre, adjunto.tipo, adjunto.sha256
+        
+        if not os.path.exists(ruta):
+            logging.error(f"Falta el fichero del adjunto {attachment_id} en el almacén: {ruta}")
+            return jsonify({"error": "Adjunto no encontrado"}), 404
+        
+        # Siempre como descarga: un HTML o SVG subido no debe ejecutarse en el origen de la API
+        respuesta = send_file(
+            ruta,
+            mimetype=tipo,
+            as_attachment=True,
+            download_name=nombre,
+            conditional=True,
+            etag=sha256,
+        )
+        respuesta.headers['X-Content-Type-Options'] = 'nosniff'
+        return respuesta
+        
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
 @app.route("/api/messages/<int:message_id>", methods=["GET"])
 @jwt_required()
 def get_message(message_id):
@@ -807,19 +1162,40 @@ def get_message(message_id):
         if not mensaje:
             return jsonify({"error": "Mensaje no encontrado"}), 404
             
-        mensaje_dict = {
-            'id': mensaje.id,
-            'contenido': mensaje.contenido,
-            'fecha_envio': mensaje.fecha_envio.isoformat(),
-            'usuario_id': mensaje.usuario_id,
-            'sala_id': mensaje.sala_id
-        }
+        mensaje_dict = mensaje.to_dict()
         
         return jsonify(mensaje_dict), 200
         
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
+@app.route("/api/messages/<int:message_id>/readers", methods=["GET"])
+@jwt_required()
+def get_message_readers(message_id):
+    """
+    Obtiene los usuarios que han leído un mensaje.
+    
+    Returns:
+        Lista de IDs de los usuarios cuya marca de lectura alcanza el mensaje
+    """
+    status_code, user_id, _, _ = verify_jwt_and_get_user()
+    if status_code != 200:
+        return jsonify({"msg": "No autorizado"}), 401
+    
+    with db.session_scope() as session:
+        mensaje = MensajesService.obtener_mensaje_por_id(message_id)
+        if not mensaje:
+            return jsonify({"error": "Mensaje no encontrado"}), 404
+        
+        if not SalaService.es_miembro(mensaje.sala_id, user_id):
+            return jsonify({"error": "No tienes permiso para ver este mensaje"}), 403
+        
+        marcas = SalaService.listar_marcas_de_lectura(mensaje.sala_id, message_id)
+        return jsonify({
+            "mensaje_id": message_id,
+            "lectores": [usuario_id for usuario_id, _ in marcas]
+        }), 200
+
 @app.route("/api/messages/<int:message_id>", methods=["PATCH"])
 @jwt_required()
 def edit_message(message_id):
@@ -855,15 +1231,9 @@ def edit_message(message_id):
                 return jsonify({"error": "No tienes permiso para editar este mensaje"}), 403
                 
             # Convertir el mensaje a diccionario para la respuesta
-            mensaje_dict = {
-                'id': mensaje_actualizado.id,
-                'contenido': mensaje_actualizado.contenido,
-                'fecha_envio': mensaje_actualizado.fecha_envio.isoformat(),
-                'usuario_id': mensaje_actualizado.usuario_id,
-                'sala_id': mensaje_actualizado.sala_id
-            }
+            mensaje_dict = dict(mensaje_actualizado.to_dict(), seq=mensaje_actualizado.seq)
             
-            socketio.emit("mensaje_actualizado", mensaje_dict, room=f"sala_{mensaje_actualizado.sala_id}")
+            colas_socket.difundir("mensaje_actualizado", mensaje_dict, mensaje_actualizado.sala_id)
             return jsonify(mensaje_dict), 200
         
     except Exception as e:
@@ -892,7 +1262,11 @@ def delete_message(message_id):
             if not eliminado:
                 return jsonify({"error": "No tienes permiso para eliminar este mensaje o el mensaje no existe"}), 403
                 
-            socketio.emit("mensaje_eliminado", {"id": message_id}, room=f"sala_{sala_id}")
+            colas_socket.difundir("mensaje_eliminado", {
+                "id": message_id,
+                "sala_id": sala_id,
+                "seq": eliminado
+            }, sala_id)
             return jsonify({"mensaje": "Mensaje eliminado correctamente"}), 200
         
     except Exception as e:
@@ -900,19 +1274,114 @@ def delete_message(message_id):
 
 # Parte de gestión de WebSockets
 
+def leer_cursores(auth):
+    """
+    Obtiene los cursores por sala que envía el cliente al conectarse.
+    
+    Se aceptan en el campo `cursores` de los datos de autenticación de Socket.IO
+    o como JSON en el parámetro de consulta del mismo nombre, con la forma
+    {"<sala_id>": <seq del último evento recibido>}.
+    """
+    cursores = auth.get("cursores") if isinstance(auth, dict) else None
+    if cursores is None and request.args.get("cursores"):
+        try:
+            cursores = json.loads(request.args["cursores"])
+        except ValueError:
+            cursores = None
+    
+    if not isinstance(cursores, dict):
+        return {}
+    
+    resultado = {}
+    for sala_id, seq in cursores.items():
+        try:
+            resultado[int(sala_id)] = int(seq)
+        except (TypeError, ValueError):
+            continue
+    return resultado
+
+_tarea_purga = None
+_lock_purga = threading.Lock()
+
+def purgar_eventos_periodicamente():
+    """Recorta periódicamente el registro de cambios de todas las salas"""
+    while True:
+        socketio.sleep(EVENTOS_INTERVALO_PURGA)
+        try:
+            with db.session_scope() as session:
+                eliminados = db.purgar_eventos(REPLAY_MAX_EVENTOS + 1)
+            if eliminados:
+                logging.info(f"Registro de cambios recortado: {eliminados} eventos eliminados")
+        except Exception as e:
+            logging.error(f"Error al recortar el registro de cambios: {str(e)}")
+
+def iniciar_purga_eventos():
+    """Arranca la tarea de recorte del registro de cambios si aún no lo está"""
+    global _tarea_purga
+    with _lock_purga:
+        if _tarea_purga is None and EVENTOS_INTERVALO_PURGA > 0:
+            _tarea_purga = socketio.start_background_task(purgar_eventos_periodicamente)
+
+def reproducir_eventos_perdidos(sid, sala_id, desde_seq):
+    """Encola para un socket los cambios de una sala posteriores a su cursor"""
+    eventos, ultimo_seq = MensajesService.obtener_eventos_perdidos(
+        sala_id, desde_seq, REPLAY_MAX_EVENTOS
+    )
+    
+    if eventos is None:
+        # Demasiados cambios: el cliente debe recargar la sala completa
+        colas_socket.encolar(sid, EVENTO_RESYNC, {
+            "salas": [sala_id],
+            "cursores": {str(sala_id): ultimo_seq}
+        }, sala_id)
+        return
+    
+    if not eventos:
+        return
+    
+    colas_socket.encolar(sid, "eventos_perdidos", {
+        "sala_id": sala_id,
+        "seq": ultimo_seq,
+        "eventos": [{
+            "seq": seq,
+            "tipo": tipo,
+            "id": mensaje_id,
+            # Mismo formato que los eventos en directo
+            "mensaje": mensaje.to_dict() if mensaje is not None else None
+        } for seq, tipo, mensaje_id, mensaje in eventos]
+    }, sala_id)
+
 @socketio.on("connect")
-def handle_connect():
+def handle_connect(auth=None):
     token = request.args.get("token")
     identidad = decode_token(token)["sub"]
+    cursores = leer_cursores(auth)
+    pedido = auth.get("formato") if isinstance(auth, dict) else None
+    formato = negociar_formato(pedido or request.args.get("formato"))
 
     # Sala privada
-    join_room(f"user_{identidad}")
+    unir_a_sala_socket(f"user_{identidad}")
+
+    # Se registra la cola antes de reproducir para no perder los eventos que
+    # lleguen mientras tanto; el cliente descarta los que tengan seq <= cursor
+    colas_socket.registrar(request.sid, identidad, formato)
+    iniciar_purga_eventos()
+    # Primer evento de la conexión: formato negociado para los siguientes
+    colas_socket.encolar(request.sid, "formato", {"formato": formato})
 
     with db.session_scope() as session:
         # Supongamos que cargas los grupos desde la base de datos:
         salas = SalaService.listar_salas(usuario_id=identidad)
+        cursores_actuales = {}
         for sala in salas:
-            join_room(f"sala_{sala.sala_id}")
+            unir_a_sala_socket(f"sala_{sala.id}")
+            if sala.id in cursores:
+                reproducir_eventos_perdidos(request.sid, sala.id, cursores[sala.id])
+            else:
+                cursores_actuales[str(sala.id)] = MensajesService.obtener_ultimo_evento(sala.id)
+
+    if cursores_actuales:
+        colas_socket.encolar(request.sid, "cursores", cursores_actuales)
 
     print(f"Usuario {identidad} conectado y unido a sus salas.")
 
@@ -921,25 +1390,27 @@ def handle_disconnect():
     token = request.args.get("token")
     identidad = decode_token(token)["sub"]
 
+    colas_socket.eliminar(request.sid)
+
     # Sala privada
-    leave_room(f"user_{identidad}")
+    salir_de_sala_socket(f"user_{identidad}")
 
     with db.session_scope() as session:
         # Supongamos que cargas los grupos desde la base de datos:
         salas = SalaService.listar_salas(usuario_id=identidad)
         for sala in salas:
-            leave_room(f"sala_{sala.sala_id}")
+            salir_de_sala_socket(f"sala_{sala.id}")
 
     print(f"Usuario {identidad} desconectado y liberado de sus salas.")
 
 @socketio.on("join_room")
 def handle_join_room(room_id):
-    join_room(f"sala_{room_id}")
+    unir_a_sala_socket(f"sala_{room_id}")
     print(f"Usuario {get_jwt_identity()} unido a la sala {room_id}")
 
 @socketio.on("leave_room")
 def handle_leave_room(room_id):
-    leave_room(f"sala_{room_id}")
+    salir_de_sala_socket(f"sala_{room_id}")
     print(f"Usuario {get_jwt_identity()} liberado de la sala {room_id}")
 
 @socketio.on("nuevo_mensaje")
@@ -950,6 +1421,29 @@ def handle_message(data):
 def handle_message_deleted(data):
     print(f"Usuario {get_jwt_identity()} elimino un mensaje: {data}")
 
+@socketio.on("marcar_leido")
+def handle_mark_read(data):
+    usuario_id = colas_socket.usuario_de(request.sid)
+    if usuario_id is None or not isinstance(data, dict):
+        return
+    
+    try:
+        sala_id = int(data["sala_id"])
+        mensaje_id = int(data["mensaje_id"])
+    except (KeyError, TypeError, ValueError):
+        logging.warning(f"Marca de lectura no válida del usuario {usuario_id}: {data}")
+        return
+    if mensaje_id <= 0:
+        logging.warning(f"Marca de lectura no válida del usuario {usuario_id}: {data}")
+        return
+    
+    with db.session_scope() as session:
+        if not SalaService.es_miembro(sala_id, usuario_id):
+            logging.warning(f"Marca de lectura del usuario {usuario_id} en la sala {sala_id}, de la que no es miembro")
+            return
+    
+    coalescedor_lecturas.registrar(usuario_id, sala_id, mensaje_id)
+
 @socketio.on("mensaje_actualizado")
 def handle_message_updated(data):
     print(f"Usuario {get_jwt_identity()} actualizo un mensaje: {data}")
@@ -1,4 +1,4 @@
-from database import db, Mensaje
+from database import db, Mensaje, EventoSala
 from services.salas import SalaService
 
 class MensajesService:
@@ -17,7 +17,7 @@ class MensajesService:
         return db.get_mensaje_por_id(mensaje_id)
 
     @staticmethod
-    def agregar_mensaje(contenido, sala_id, usuario_id):
+    def agregar_mensaje(contenido, sala_id, usuario_id, adjuntos=()):
         """
         Agrega un mensaje a una sala.
         
@@ -25,6 +25,8 @@ class MensajesService:
             contenido: Contenido del mensaje
             sala_id: ID de la sala
             usuario_id: ID del usuario que envía el mensaje
+            adjuntos: Metadatos de los ficheros ya guardados en el almacén
+                (nombre, tipo, tamano y sha256)
             
         Returns:
             El mensaje creado
@@ -38,7 +40,24 @@ class MensajesService:
         if not es_miembro:
             raise ValueError("No puedes enviar mensajes a una sala de la que no eres miembro")
             
-        return db.agregar_mensaje(contenido, sala_id, usuario_id)
+        return db.agregar_mensaje(contenido, sala_id, usuario_id, adjuntos)
+    
+    @staticmethod
+    def obtener_adjunto(adjunto_id, usuario_id):
+        """
+        Obtiene un adjunto si el usuario es miembro de la sala de su mensaje.
+        
+        Args:
+            adjunto_id: ID del adjunto
+            usuario_id: ID del usuario que lo pide
+            
+        Returns:
+            El adjunto, o None si no existe o el usuario no puede verlo
+        """
+        adjunto = db.get_adjunto_por_id(adjunto_id)
+        if not adjunto or not SalaService.es_miembro(adjunto.mensaje.sala_id, usuario_id):
+            return None
+        return adjunto
     
     @staticmethod
     def obtener_mensajes_por_sala(sala_id, limite=100):
@@ -80,7 +99,8 @@ class MensajesService:
             usuario_id: ID del usuario que solicita la eliminación
             
         Returns:
-            bool: True si el mensaje fue eliminado, False si el usuario no tiene permisos
+            tuple: (seq, sala_id) donde seq es el ID del evento de borrado, o (False, None)
+                si el usuario no tiene permisos
             
         Raises:
             ValueError: Si el mensaje no existe
@@ -99,6 +119,56 @@ class MensajesService:
             
         return False, None
         
+    @staticmethod
+    def obtener_eventos_perdidos(sala_id, desde_seq, limite):
+        """
+        Obtiene los cambios de una sala que un cliente se ha perdido desde su cursor.
+        
+        Los eventos de un mismo mensaje se compactan en uno solo: un mensaje
+        nuevo editado después se envía como nuevo con su contenido actual, y un
+        mensaje nuevo eliminado dentro del mismo intervalo no se envía.
+        
+        Args:
+            sala_id: ID de la sala
+            desde_seq: ID del último evento que conoce el cliente
+            limite: Número máximo de eventos a reproducir
+            
+        Returns:
+            tuple: (eventos, ultimo_seq) donde eventos es una lista de tuplas
+                (seq, tipo, mensaje_id, Mensaje o None) ordenada por seq, o
+                (None, ultimo_seq) si hay más de `limite` eventos y el cliente
+                debe recargar la sala completa
+        """
+        filas = db.get_eventos_desde(sala_id, desde_seq, limite + 1)
+        if len(filas) > limite:
+            return None, db.get_ultimo_evento(sala_id)
+        
+        compactados = {}
+        for evento, mensaje in filas:
+            anterior = compactados.pop(evento.mensaje_id, None)
+            tipo = evento.tipo
+            if anterior and anterior[1] == EventoSala.NUEVO:
+                if tipo == EventoSala.ELIMINADO:
+                    continue
+                tipo = EventoSala.NUEVO
+            compactados[evento.mensaje_id] = (evento.id, tipo, evento.mensaje_id, mensaje)
+        
+        ultimo_seq = filas[-1][0].id if filas else desde_seq
+        return sorted(compactados.values(), key=lambda e: e[0]), ultimo_seq
+    
+    @staticmethod
+    def obtener_ultimo_evento(sala_id):
+        """
+        Obtiene el cursor actual de una sala.
+        
+        Args:
+            sala_id: ID de la sala
+            
+        Returns:
+            ID del último evento de la sala o 0 si no tiene ninguno
+        """
+        return db.get_ultimo_evento(sala_id)
+    
     @staticmethod
     def editar_mensaje(mensaje_id, usuario_id, nuevo_contenido):
         """
@@ -85,6 +85,11 @@ class SalaService:
     def listar_usuarios_de_sala(sala_id):
         return db.listar_usuarios_de_sala(sala_id)
     
+    @staticmethod
+    def listar_miembros_de_sala(sala_id):
+        """Lista los miembros de una sala con su rol y fecha de unión"""
+        return db.listar_miembros_de_sala(sala_id)
+    
     @staticmethod
     def listar_salas(usuario_id=None, solo_publicas=False):
         """
@@ -98,6 +103,34 @@ class SalaService:
             Lista de salas que cumplen con los criterios
         """
         return db.listar_salas(usuario_id, solo_publicas)
+
+    @staticmethod
+    def listar_salas_con_no_leidos(usuario_id):
+        """
+        Lista las salas de un usuario con su marca de lectura y sus mensajes no leídos.
+        
+        Args:
+            usuario_id: ID del usuario
+            
+        Returns:
+            Lista de tuplas (Sala, last_read_message_id, no_leidos)
+        """
+        return db.listar_salas_con_no_leidos(usuario_id)
+
+    @staticmethod
+    def listar_marcas_de_lectura(sala_id, desde_mensaje_id):
+        """
+        Obtiene las marcas de lectura de los miembros que han leído al menos
+        hasta el mensaje indicado.
+        
+        Args:
+            sala_id: ID de la sala
+            desde_mensaje_id: ID del mensaje más antiguo del rango consultado
+            
+        Returns:
+            Lista de tuplas (usuario_id, last_read_message_id)
+        """
+        return db.listar_marcas_de_lectura(sala_id, desde_mensaje_id)
     
     @staticmethod
     def agregar_usuario_a_sala(usuario_id, sala_id, rol='miembro'):
@@ -1,10 +1,25 @@
 #!/usr/bin/env python3
 import sqlite3
 from datetime import datetime
+import argparse
 import getpass
 import os
+import time
 from werkzeug.security import generate_password_hash, check_password_hash
 
+import compresion
+import identificadores
+
+# Mensajes por página al ver una sala y segundos entre sondeos con --follow
+MENSAJES_POR_PAGINA = int(os.environ.get('MENSAJERIA_PAGINA', 20))
+INTERVALO_SEGUIR = float(os.environ.get('MENSAJERIA_INTERVALO_SEGUIR', 2))
+
+# Mayor id posible en SQLite, para la primera página
+MAX_ID = 2 ** 63 - 1
+
+# Caracteres del último mensaje que se guardan en room_summary (como en database.py)
+LONGITUD_FRAGMENTO = 100
+
 class SistemaMensajeria:
     def __init__(self, db_name="mensajeria.db"):
         # Obtener la ruta absoluta al directorio del script
@@ -19,6 +34,10 @@ class SistemaMensajeria:
         """Establece conexión con la base de datos"""
         try:
             self.conn = sqlite3.connect(self.db_name)
+            # Los mensajes pueden estar comprimidos (ver compresion.py)
+            compresion.registrar_funciones(self.conn)
+            # Número de trabajador propio para los ids de los mensajes (ver identificadores.py)
+            identificadores.reservar_trabajador(self.conn)
             self.cursor = self.conn.cursor()
             return True
         except sqlite3.Error as e:
@@ -101,11 +120,13 @@ class SistemaMensajeria:
         privada = input("¿Es privada? (s/n): ").lower() == 's'
         
         try:
+            # El creador cuenta ya como primer miembro
             self.cursor.execute(
-                "INSERT INTO salas (nombre, privada) VALUES (?, ?)",
+                "INSERT INTO salas (nombre, privada, member_count) VALUES (?, ?, 1)",
                 (nombre, privada)
             )
             sala_id = self.cursor.lastrowid
+            self.cursor.execute("INSERT INTO room_summary (sala_id) VALUES (?)", (sala_id,))
             
             # El creador de la sala se agrega como administrador
             self.cursor.execute(
@@ -123,12 +144,7 @@ class SistemaMensajeria:
     def listar_salas(self):
         """Muestra todas las salas disponibles"""
         print("\n=== SALAS DISPONIBLES ===")
-        self.cursor.execute("""
-            SELECT s.id, s.nombre, s.privada, COUNT(us.usuario_id) as miembros
-            FROM salas s
-            LEFT JOIN usuarios_salas us ON s.id = us.sala_id
-            GROUP BY s.id
-        """)
+        self.cursor.execute("SELECT id, nombre, privada, member_count FROM salas")
         salas = self.cursor.fetchall()
         
         if not salas:
@@ -162,12 +178,41 @@ class SistemaMensajeria:
                 print("No tienes acceso a esta sala o no existe.")
                 return
             
+            # Los ids se generan ordenados por tiempo, como en el servidor, y
+            # siempre por encima del último que haya en la base de datos
+            self.cursor.execute("SELECT MAX(id) FROM mensajes")
+            identificadores.generador.posterior_a(self.cursor.fetchone()[0] or 0)
+            mensaje_id = identificadores.siguiente_id()
             self.cursor.execute(
                 """
-                INSERT INTO mensajes (sala_id, usuario_id, contenido)
-                VALUES (?, ?, ?)
+                INSERT INTO mensajes (id, sala_id, usuario_id, contenido)
+                VALUES (?, ?, ?, ?)
                 """,
-                (sala_id, self.usuario_actual['id'], contenido)
+                (mensaje_id, sala_id, self.usuario_actual['id'], compresion.codificar(contenido))
+            )
+            # Los contadores de la sala se actualizan en la misma transacción
+            self.cursor.execute(
+                """
+                UPDATE salas
+                SET message_count = message_count + 1,
+                    last_activity = (SELECT fecha_envio FROM mensajes WHERE id = ?)
+                WHERE id = ?
+                """,
+                (mensaje_id, sala_id)
+            )
+            # Y el resumen del último mensaje, salvo que ya apunte a uno posterior
+            self.cursor.execute(
+                """
+                INSERT INTO room_summary (sala_id, last_message_id, last_author_id, last_snippet, last_message_at)
+                SELECT sala_id, id, usuario_id, substr(texto_mensaje(contenido), 1, ?), fecha_envio FROM mensajes WHERE id = ?
+                ON CONFLICT (sala_id) DO UPDATE SET
+                    last_message_id = excluded.last_message_id,
+                    last_author_id = excluded.last_author_id,
+                    last_snippet = excluded.last_snippet,
+                    last_message_at = excluded.last_message_at
+                WHERE coalesce(room_summary.last_message_id, 0) < excluded.last_message_id
+                """,
+                (LONGITUD_FRAGMENTO, mensaje_id)
             )
             self.conn.commit()
             print("Mensaje enviado correctamente!")
@@ -176,49 +221,128 @@ class SistemaMensajeria:
         except sqlite3.Error as e:
             print(f"Error al enviar el mensaje: {e}")
 
-    def ver_mensajes_sala(self):
-        """Muestra los mensajes de una sala específica"""
+    def _comprobar_acceso_sala(self, sala_id):
+        """Devuelve el nombre de la sala si el usuario actual es miembro, o None"""
+        self.cursor.execute("""
+            SELECT s.nombre
+            FROM salas s
+            JOIN usuarios_salas us ON us.sala_id = s.id
+            WHERE us.usuario_id = ? AND s.id = ?
+        """, (self.usuario_actual['id'], sala_id))
+        fila = self.cursor.fetchone()
+        return fila[0] if fila else None
+
+    def _imprimir_mensajes(self, filas):
+        """Imprime las filas según llegan del cursor y devuelve (cuántas, id menor, id mayor)"""
+        total, id_menor, id_mayor = 0, None, None
+        for mensaje_id, contenido, nombre, fecha_envio in filas:
+            print(f"\n[{fecha_envio}] {nombre}:")
+            print(f"  {contenido}")
+            total += 1
+            id_menor = mensaje_id if id_menor is None else min(id_menor, mensaje_id)
+            id_mayor = mensaje_id if id_mayor is None else max(id_mayor, mensaje_id)
+        return total, id_menor, id_mayor
+
+    def _pagina_mensajes(self, sala_id, antes_de=None, limite=MENSAJES_POR_PAGINA):
+        """
+        Cursor con una página de mensajes de la sala en orden cronológico.
+
+        La consulta interior toma los ``limite`` mensajes más recientes con id
+        menor que ``antes_de`` recorriendo el índice (sala_id, id) hacia atrás;
+        la exterior solo reordena esa página, así que nunca se lee la sala
+        entera ni se carga en memoria.
+        """
+        return self.conn.execute("""
+            SELECT id, contenido, nombre, fecha_envio FROM (
+                SELECT m.id, texto_mensaje(m.contenido) AS contenido, u.nombre, m.fecha_envio
+                FROM mensajes m
+                JOIN usuarios u ON m.usuario_id = u.id
+                WHERE m.sala_id = ? AND m.id < ?
+                ORDER BY m.id DESC
+                LIMIT ?
+            ) ORDER BY id
+        """, (sala_id, antes_de if antes_de is not None else MAX_ID, limite))
+
+    def _mensajes_nuevos(self, sala_id, despues_de, limite=MENSAJES_POR_PAGINA):
+        """Cursor con los mensajes de la sala posteriores a ``despues_de``"""
+        return self.conn.execute("""
+            SELECT m.id, texto_mensaje(m.contenido) AS contenido, u.nombre, m.fecha_envio
+            FROM mensajes m
+            JOIN usuarios u ON m.usuario_id = u.id
+            WHERE m.sala_id = ? AND m.id > ?
+            ORDER BY m.id
+            LIMIT ?
+        """, (sala_id, despues_de, limite))
+
+    def _ultimo_id_sala(self, sala_id):
+        self.cursor.execute("SELECT MAX(id) FROM mensajes WHERE sala_id = ?", (sala_id,))
+        return self.cursor.fetchone()[0] or 0
+
+    def seguir_sala(self, sala_id, desde_id=None, intervalo=INTERVALO_SEGUIR):
+        """
+        Muestra los mensajes nuevos de la sala a medida que llegan (Ctrl+C para salir).
+
+        Cada sondeo es una búsqueda por rango en el índice (sala_id, id) a
+        partir del último id mostrado, por lo que cuesta lo mismo en una sala
+        vacía que en una con millones de mensajes.
+        """
+        ultimo_id = self._ultimo_id_sala(sala_id) if desde_id is None else desde_id
+        print(f"\n--- Siguiendo la sala (cada {intervalo:g}s). Pulsa Ctrl+C para dejar de seguir ---")
+        try:
+            while True:
+                total, _, id_mayor = self._imprimir_mensajes(self._mensajes_nuevos(sala_id, ultimo_id))
+                if id_mayor is not None:
+                    ultimo_id = id_mayor
+                # Si la página vino llena quedan más pendientes: se piden sin esperar
+                if total < MENSAJES_POR_PAGINA:
+                    time.sleep(intervalo)
+        except KeyboardInterrupt:
+            print("\n--- Fin del seguimiento ---")
+
+    def ver_mensajes_sala(self, sala_id=None, seguir=False):
+        """
+        Muestra los mensajes de una sala específica.
+
+        Empieza por la página más reciente y permite ir cargando páginas más
+        antiguas o pasar a seguir los mensajes nuevos.
+        """
         if not self.usuario_actual:
             print("Debes iniciar sesión para ver mensajes.")
             return
         
-        self.listar_salas()
         try:
-            sala_id = int(input("\nID de la sala para ver mensajes: "))
+            if sala_id is None:
+                self.listar_salas()
+                sala_id = int(input("\nID de la sala para ver mensajes: "))
             
             # Verificar que el usuario pertenezca a la sala
-            self.cursor.execute(
-                "SELECT 1 FROM usuarios_salas WHERE usuario_id = ? AND sala_id = ?",
-                (self.usuario_actual['id'], sala_id)
-            )
-            if not self.cursor.fetchone():
+            nombre_sala = self._comprobar_acceso_sala(sala_id)
+            if nombre_sala is None:
                 print("No tienes acceso a esta sala o no existe.")
                 return
             
-            # Obtener nombre de la sala
-            self.cursor.execute("SELECT nombre FROM salas WHERE id = ?", (sala_id,))
-            nombre_sala = self.cursor.fetchone()[0]
-            
             print(f"\n=== MENSAJES EN LA SALA: {nombre_sala.upper()} ===")
             
-            # Obtener mensajes de la sala
-            self.cursor.execute("""
-                SELECT m.contenido, u.nombre, m.fecha_envio
-                FROM mensajes m
-                JOIN usuarios u ON m.usuario_id = u.id
-                WHERE m.sala_id = ?
-                ORDER BY m.fecha_envio
-            """, (sala_id,))
-            
-            mensajes = self.cursor.fetchall()
-            
-            if not mensajes:
+            total, id_menor, id_mayor = self._imprimir_mensajes(self._pagina_mensajes(sala_id))
+            if not total:
                 print("No hay mensajes en esta sala aún.")
-                return
-            
-            for mensaje in mensajes:
-                print(f"\n[{mensaje[2]}] {mensaje[1]}:")
-                print(f"  {mensaje[0]}")
+            ultimo_id = id_mayor or 0
+
+            while not seguir:
+                hay_anteriores = total == MENSAJES_POR_PAGINA
+                opciones = "[a] anteriores, " if hay_anteriores else ""
+                respuesta = input(f"\n{opciones}[s] seguir nuevos, [Enter] volver: ").strip().lower()
+                if respuesta == 'a' and hay_anteriores:
+                    print("\n--- Mensajes anteriores ---")
+                    total, id_menor, _ = self._imprimir_mensajes(self._pagina_mensajes(sala_id, antes_de=id_menor))
+                    if not total:
+                        print("No hay mensajes anteriores.")
+                elif respuesta == 's':
+                    seguir = True
+                else:
+                    return
+
+            self.seguir_sala(sala_id, desde_id=ultimo_id)
                 
         except ValueError:
             print("Por favor ingresa un ID de sala válido.")
@@ -306,8 +430,27 @@ class SistemaMensajeria:
         finally:
             self.desconectar_db()
 
+    def seguir_sala_directamente(self, sala_id):
+        """Inicia sesión y sigue una sala sin pasar por el menú (opción --follow)"""
+        if not self.conectar_db():
+            print("No se pudo conectar a la base de datos. Saliendo...")
+            return
+        
+        try:
+            if self.iniciar_sesion():
+                self.ver_mensajes_sala(sala_id, seguir=True)
+        except KeyboardInterrupt:
+            print("\n¡Hasta luego!")
+        finally:
+            self.desconectar_db()
+
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sistema de mensajería en terminal")
+    parser.add_argument('--follow', type=int, metavar='SALA_ID',
+                        help='Muestra los últimos mensajes de la sala y sigue los nuevos')
+    args = parser.parse_args()
+
     # Obtener la ruta al directorio del script
     script_dir = os.path.dirname(os.path.abspath(__file__))
     db_path = os.path.join(script_dir, "mensajeria.db")
@@ -322,4 +465,7 @@ if __name__ == "__main__":
     
     # Iniciar el sistema
     sistema = SistemaMensajeria()
-    sistema.ejecutar()
+    if args.follow is not None:
+        sistema.seguir_sala_directamente(args.follow)
+    else:
+        sistema.ejecutar()
@@ -0,0 +1,121 @@
+"""
+Pruebas de las colas de salida por conexión de colas_socket.py.
+
+    python -m unittest discover -s tests     # desde backend/
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from colas_socket import (  # noqa: E402
+    EVENTO_RESYNC, GestorColasSocket, POLITICA_DESCARTAR, POLITICA_DESCONECTAR, POLITICA_RESYNC,
+)
+
+
+class _Gestor:
+    def __init__(self):
+        self.participantes = {}
+
+    def get_participants(self, namespace, sala):
+        return iter(self.participantes.get(sala, []))
+
+    def eio_sid_from_sid(self, sid, namespace):
+        return sid
+
+
+class _Servidor:
+    def __init__(self):
+        self.manager = _Gestor()
+        self.desconectados = []
+        # Sin sockets de Engine.IO: el transporte nunca tiene paquetes pendientes
+        self.eio = type('Eio', (), {'sockets': {}})()
+
+    def disconnect(self, sid, namespace=None):
+        self.desconectados.append(sid)
+
+
+class _SocketIO:
+    """Lo justo de flask_socketio.SocketIO para GestorColasSocket, sin tarea en segundo plano"""
+
+    def __init__(self):
+        self.server = _Servidor()
+        self.emitidos = []
+
+    def start_background_task(self, funcion):
+        return object()
+
+    def emit(self, evento, datos, to=None):
+        self.emitidos.append((to, evento, datos))
+
+
+class PruebasColasSocket(unittest.TestCase):
+
+    def gestor(self, politica, max_eventos=3):
+        socketio = _SocketIO()
+        gestor = GestorColasSocket(socketio, max_eventos=max_eventos, politica=politica)
+        gestor.registrar('a', usuario_id=7)
+        return gestor, socketio
+
+    def test_politica_desconocida(self):
+        with self.assertRaises(ValueError):
+            GestorColasSocket(_SocketIO(), politica='otra')
+
+    def test_descartar_antiguos_conserva_los_ultimos(self):
+        gestor, socketio = self.gestor(POLITICA_DESCARTAR)
+        for i in range(5):
+            gestor.encolar('a', 'nuevo_mensaje', {'id': i}, sala_id=1)
+        gestor._entregar_pendientes()
+
+        self.assertEqual([datos['id'] for _, _, datos in socketio.emitidos], [2, 3, 4])
+        estadisticas = gestor.estadisticas()
+        self.assertEqual(estadisticas['eventos_descartados'], 2)
+        self.assertEqual(estadisticas['eventos_entregados'], 3)
+
+    def test_resync_vacia_la_cola_y_avisa_de_las_salas(self):
+        gestor, socketio = self.gestor(POLITICA_RESYNC)
+        for sala_id in (1, 2, 1):
+            gestor.encolar('a', 'nuevo_mensaje', {'sala': sala_id}, sala_id=sala_id)
+        gestor.encolar('a', 'nuevo_mensaje', {'sala': 3}, sala_id=3)
+        self.assertEqual(gestor.estadisticas()['profundidad_total'], 0)
+
+        gestor.encolar('a', 'nuevo_mensaje', {'sala': 4}, sala_id=4)
+        gestor._entregar_pendientes()
+
+        self.assertEqual(socketio.emitidos[0], ('a', EVENTO_RESYNC, {'salas': [1, 2, 3]}))
+        self.assertEqual(socketio.emitidos[1], ('a', 'nuevo_mensaje', {'sala': 4}))
+        self.assertEqual(gestor.estadisticas()['resyncs'], 1)
+
+    def test_desconectar_libera_la_cola(self):
+        gestor, socketio = self.gestor(POLITICA_DESCONECTAR)
+        for i in range(4):
+            gestor.encolar('a', 'nuevo_mensaje', {'id': i}, sala_id=1)
+
+        self.assertEqual(socketio.server.desconectados, ['a'])
+        self.assertIsNone(gestor.usuario_de('a'))
+        self.assertEqual(gestor.estadisticas()['desconexiones'], 1)
+
+    def test_difundir_comparte_el_evento_entre_los_participantes(self):
+        gestor, socketio = self.gestor(POLITICA_RESYNC)
+        gestor.registrar('b', usuario_id=8)
+        socketio.server.manager.participantes['sala_1'] = ['a', 'b']
+
+        gestor.difundir('nuevo_mensaje', {'id': 1}, 1)
+        self.assertIs(gestor._colas['a'].eventos[0][1], gestor._colas['b'].eventos[0][1])
+        gestor._entregar_pendientes()
+        self.assertEqual(sorted(to for to, _, _ in socketio.emitidos), ['a', 'b'])
+
+    def test_no_entrega_si_el_transporte_esta_lleno(self):
+        gestor, socketio = self.gestor(POLITICA_RESYNC)
+        gestor.max_pendientes_transporte = 2
+        gestor._pendientes_transporte = lambda sid: 2
+        gestor.encolar('a', 'nuevo_mensaje', {'id': 1}, sala_id=1)
+        gestor._entregar_pendientes()
+
+        self.assertEqual(socketio.emitidos, [])
+        self.assertEqual(gestor.estadisticas()['profundidad_total'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+"""
+Pruebas del codec de contenidos de mensajes de compresion.py.
+
+    python -m unittest discover -s tests     # desde backend/
+"""
+import os
+import sqlite3
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import compresion  # noqa: E402
+from compresion import CON_DICCIONARIO, Codec, ZLIB, ZSTD  # noqa: E402
+
+TEXTO_LARGO = "El mensaje se repite para que comprimirlo compense. " * 40
+DICCIONARIO = ("Buenos días a todos, ¿qué tal va la reunión de hoy? " * 50).encode('utf-8')
+
+
+class PruebasCodec(unittest.TestCase):
+
+    def test_sin_algoritmo_no_comprime(self):
+        self.assertEqual(Codec().codificar(TEXTO_LARGO), TEXTO_LARGO)
+
+    def test_textos_cortos_y_none_se_guardan_tal_cual(self):
+        codec = Codec(ZLIB, umbral=512)
+        self.assertEqual(codec.codificar("hola"), "hola")
+        self.assertIsNone(codec.codificar(None))
+        self.assertEqual(codec.decodificar("hola"), "hola")
+        self.assertIsNone(codec.decodificar(None))
+
+    def test_zlib_ida_y_vuelta(self):
+        codec = Codec(ZLIB)
+        valor = codec.codificar(TEXTO_LARGO)
+        self.assertIsInstance(valor, bytes)
+        self.assertEqual(valor[0], 1)
+        self.assertLess(len(valor), len(TEXTO_LARGO.encode('utf-8')))
+        self.assertEqual(codec.decodificar(valor), TEXTO_LARGO)
+        # memoryview, como los BLOB de algunos controladores
+        self.assertEqual(codec.decodificar(memoryview(valor)), TEXTO_LARGO)
+
+    def test_texto_que_no_se_reduce_se_guarda_tal_cual(self):
+        # Con la cabecera, dos bytes comprimidos ocupan más que el texto
+        self.assertEqual(Codec(ZLIB, umbral=1).codificar("ab"), "ab")
+
+    def test_zlib_con_diccionario(self):
+        codec = Codec(ZLIB, umbral=16, diccionario=DICCIONARIO)
+        texto = "Buenos días a todos, ¿qué tal va la reunión de hoy? Bien."
+        valor = codec.codificar(texto)
+        self.assertEqual(valor[0], 1 | CON_DICCIONARIO)
+        self.assertEqual(valor[1:5], codec.id_diccionario)
+        self.assertEqual(codec.decodificar(valor), texto)
+
+    def test_diccionario_distinto_falla(self):
+        valor = Codec(ZLIB, umbral=16, diccionario=DICCIONARIO).codificar(TEXTO_LARGO)
+        with self.assertRaises(ValueError):
+            Codec(ZLIB, diccionario=b"otro diccionario" * 10).decodificar(valor)
+        with self.assertRaises(ValueError):
+            Codec(ZLIB).decodificar(valor)
+
+    def test_se_leen_valores_de_otro_algoritmo(self):
+        # Al cambiar COMPRESION_MENSAJES los valores antiguos se siguen leyendo
+        valor = Codec(ZLIB).codificar(TEXTO_LARGO)
+        self.assertEqual(Codec().decodificar(valor), TEXTO_LARGO)
+
+    def test_cabecera_desconocida(self):
+        with self.assertRaises(ValueError):
+            Codec(ZLIB).decodificar(b"\x07datos")
+
+    def test_algoritmo_desconocido(self):
+        with self.assertRaises(ValueError):
+            Codec('lz4')
+
+    @unittest.skipIf(compresion.zstandard is None, "zstandard no está instalado")
+    def test_zstd_ida_y_vuelta(self):
+        for diccionario in (None, DICCIONARIO):
+            codec = Codec(ZSTD, umbral=16, diccionario=diccionario)
+            valor = codec.codificar(TEXTO_LARGO)
+            self.assertEqual(valor[0] & ~CON_DICCIONARIO, 2)
+            self.assertEqual(codec.decodificar(valor), TEXTO_LARGO)
+
+    def test_funcion_sql_texto_mensaje(self):
+        conexion = sqlite3.connect(':memory:')
+        compresion.registrar_funciones(conexion)
+        valor = Codec(ZLIB).codificar(TEXTO_LARGO)
+        fila = conexion.execute("SELECT texto_mensaje(?), texto_mensaje('corto')", (valor,)).fetchone()
+        self.assertEqual(fila, (TEXTO_LARGO, 'corto'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+"""
+Pruebas del generador de IDs de mensaje de identificadores.py.
+
+    python -m unittest discover -s tests     # desde backend/
+"""
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import unittest
+from datetime import datetime, timezone
+
+DIRECTORIO_BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DIRECTORIO_BACKEND)
+
+import identificadores  # noqa: E402
+from identificadores import (  # noqa: E402
+    BITS_SECUENCIA, DESPLAZAMIENTO_MS, EPOCA_MS, MAX_SECUENCIA, MAX_TRABAJADOR, GeneradorIds, instante_de,
+)
+
+# 2024-06-10T08:15:00Z
+INSTANTE_MS = 1718007300000
+
+
+def partes(id_mensaje):
+    """(milisegundos desde EPOCA_MS, trabajador, secuencia) de un ID"""
+    return (id_mensaje >> DESPLAZAMIENTO_MS,
+            (id_mensaje >> BITS_SECUENCIA) & MAX_TRABAJADOR,
+            id_mensaje & MAX_SECUENCIA)
+
+
+class PruebasGeneradorIds(unittest.TestCase):
+
+    def test_composicion_de_bits(self):
+        id_mensaje = GeneradorIds(5).siguiente(INSTANTE_MS)
+        self.assertEqual(partes(id_mensaje), (INSTANTE_MS - EPOCA_MS, 5, 0))
+        self.assertLess(id_mensaje, 2 ** 53)
+        self.assertEqual(instante_de(id_mensaje),
+                         datetime(2024, 6, 10, 8, 15, tzinfo=timezone.utc))
+
+    def test_trabajador_fuera_de_rango(self):
+        for trabajador in (-1, MAX_TRABAJADOR + 1):
+            with self.assertRaises(ValueError):
+                GeneradorIds(trabajador)
+
+    def test_crecientes_en_el_mismo_milisegundo(self):
+        generador = GeneradorIds(1)
+        ids = [generador.siguiente(INSTANTE_MS) for _ in range(MAX_SECUENCIA + 1)]
+        self.assertEqual([partes(i)[2] for i in ids], list(range(MAX_SECUENCIA + 1)))
+        # Agotada la secuencia se pasa al milisegundo siguiente
+        siguiente = generador.siguiente(INSTANTE_MS)
+        self.assertEqual(partes(siguiente), (INSTANTE_MS - EPOCA_MS + 1, 1, 0))
+        self.assertEqual(sorted(ids + [siguiente]), ids + [siguiente])
+
+    def test_reloj_que_retrocede(self):
+        generador = GeneradorIds(1)
+        primero = generador.siguiente(INSTANTE_MS)
+        segundo = generador.siguiente(INSTANTE_MS - 5000)
+        self.assertGreater(segundo, primero)
+        self.assertEqual(partes(segundo)[0], INSTANTE_MS - EPOCA_MS)
+
+    def test_trabajadores_distintos_no_coinciden(self):
+        a, b = GeneradorIds(1), GeneradorIds(2)
+        ids_a = {a.siguiente(INSTANTE_MS) for _ in range(100)}
+        ids_b = {b.siguiente(INSTANTE_MS) for _ in range(100)}
+        self.assertFalse(ids_a & ids_b)
+
+    def test_posterior_a(self):
+        generador = GeneradorIds(3)
+        existente = GeneradorIds(9).siguiente(INSTANTE_MS + 60000)
+        generador.posterior_a(existente)
+        self.assertGreater(generador.siguiente(INSTANTE_MS), existente)
+
+    def test_posterior_a_un_id_antiguo_no_retrocede(self):
+        generador = GeneradorIds(3)
+        ultimo = generador.siguiente(INSTANTE_MS)
+        # Los IDs de autoincremento anteriores son mucho menores
+        generador.posterior_a(1234)
+        self.assertGreater(generador.siguiente(INSTANTE_MS), ultimo)
+
+
+@unittest.skipIf(os.environ.get('IDENTIFICADORES_TRABAJADOR') is not None,
+                 "IDENTIFICADORES_TRABAJADOR fija el número de trabajador")
+class PruebasReservaTrabajador(unittest.TestCase):
+
+    def setUp(self):
+        self._estado = (identificadores._reserva, identificadores.generador.trabajador)
+        identificadores._reserva = None
+        self.directorio = tempfile.TemporaryDirectory()
+        self.ruta = os.path.join(self.directorio.name, 'mensajeria.db')
+
+    def tearDown(self):
+        identificadores._reserva, identificadores.generador.trabajador = self._estado
+        self.directorio.cleanup()
+
+    def reservas(self):
+        with sqlite3.connect(self.ruta) as conexion:
+            return conexion.execute(
+                f"SELECT trabajador, pid FROM {identificadores.TABLA_TRABAJADORES} ORDER BY trabajador"
+            ).fetchall()
+
+    def reservar_en_otro_proceso(self):
+        codigo = ("import sqlite3, identificadores; "
+                  f"identificadores.reservar_trabajador(sqlite3.connect({self.ruta!r})); "
+                  "print(identificadores.generador.trabajador)")
+        salida = subprocess.run([sys.executable, '-c', codigo], cwd=DIRECTORIO_BACKEND,
+                                env=dict(os.environ), capture_output=True, text=True, check=True)
+        return int(salida.stdout)
+
+    def test_reserva_y_libera(self):
+        identificadores.reservar_trabajador(sqlite3.connect(self.ruta))
+        self.assertEqual(self.reservas(), [(identificadores.generador.trabajador, os.getpid())])
+        # Una segunda llamada no reserva otro número
+        identificadores.reservar_trabajador(sqlite3.connect(self.ruta))
+        self.assertEqual(len(self.reservas()), 1)
+
+        identificadores._liberar_reserva()
+        self.assertEqual(self.reservas(), [])
+
+    def test_otro_proceso_recibe_otro_numero(self):
+        identificadores.reservar_trabajador(sqlite3.connect(self.ruta))
+        otro = self.reservar_en_otro_proceso()
+        self.assertNotEqual(otro, identificadores.generador.trabajador)
+        # El otro proceso libera su reserva al salir
+        self.assertEqual([t for t, _ in self.reservas()], [identificadores.generador.trabajador])
+        identificadores._liberar_reserva()
+
+    @unittest.skipIf(os.name == 'nt', "En Windows no se comprueba si el proceso sigue vivo")
+    def test_se_reutiliza_la_reserva_de_un_proceso_terminado(self):
+        proceso = subprocess.Popen([sys.executable, '-c', 'pass'])
+        proceso.wait()
+        with sqlite3.connect(self.ruta) as conexion:
+            conexion.execute(
+                f"CREATE TABLE {identificadores.TABLA_TRABAJADORES} ("
+                "trabajador INTEGER PRIMARY KEY, equipo TEXT NOT NULL, pid INTEGER NOT NULL, desde TEXT)"
+            )
+            conexion.execute(
+                f"INSERT INTO {identificadores.TABLA_TRABAJADORES} VALUES (0, ?, ?, NULL)",
+                (identificadores.socket.gethostname(), proceso.pid)
+            )
+        identificadores.reservar_trabajador(sqlite3.connect(self.ruta))
+        self.assertEqual(self.reservas(), [(0, os.getpid())])
+        identificadores._liberar_reserva()
+
+    def test_sin_numeros_libres(self):
+        with sqlite3.connect(self.ruta) as conexion:
+            conexion.execute(
+                f"CREATE TABLE {identificadores.TABLA_TRABAJADORES} ("
+                "trabajador INTEGER PRIMARY KEY, equipo TEXT NOT NULL, pid INTEGER NOT NULL, desde TEXT)"
+            )
+            conexion.executemany(
+                f"INSERT INTO {identificadores.TABLA_TRABAJADORES} VALUES (?, 'otro-equipo', 1, NULL)",
+                [(t,) for t in range(MAX_TRABAJADOR + 1)]
+            )
+        with self.assertRaises(RuntimeError):
+            identificadores.reservar_trabajador(sqlite3.connect(self.ruta))
+
+
+if __name__ == '__main__':
+    unittest.main()
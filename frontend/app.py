@@ -1,17 +1,28 @@
 #!/usr/bin/env python
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session
+from flask import (
+    Flask, Blueprint, render_template, request, jsonify, redirect, url_for, session,
+    send_from_directory, abort, Response, stream_template,
+)
+from jinja2 import FileSystemBytecodeCache
 from functools import wraps
-import requests
 import os
-import ssl
 import json
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+import mimetypes
+from urllib.parse import urlencode
 from datetime import datetime
 
-# Crear la aplicación Flask
-app = Flask(__name__)
-app.secret_key = os.urandom(24)  # Clave secreta para las sesiones
+from cliente_api import ClienteApi, API_PLAZO_PAGINA, API_BATCH
+from cache_salas import CacheSalas, EscuchaAvisos
+
+# Rutas del frontend; la aplicación se crea con create_app()
+web = Blueprint('web', __name__)
+
+DIRECTORIO_FRONTEND = os.path.dirname(os.path.abspath(__file__))
+
+# Directorio de las plantillas compiladas (build_assets.py las precompila)
+PLANTILLAS_CACHE_DIR = os.environ.get(
+    'PLANTILLAS_CACHE_DIR', os.path.join(DIRECTORIO_FRONTEND, '.cache', 'plantillas')
+)
 
 from datetime import datetime as dt
 
@@ -47,41 +58,93 @@ def datetimeformat(value, format='%d/%m/%Y %H:%M'):
 def to_json_filter(data):
     return json.dumps(data, ensure_ascii=False)
 
-# Aplicar filtros a la aplicación Flask
-app.jinja_env.filters['tojson'] = to_json_filter
-app.jinja_env.filters['datetimeformat'] = datetimeformat
-
 # Configuración de la API
 API_BASE_URL = 'https://90.175.164.116:11443'  # Ajusta según sea necesario
 
 # Configuración de SSL
 SSL_VERIFY = False  # Cambiar a True en producción con certificados válidos
 
-# Configurar la sesión de requests para manejar reintentos
-session_requests = requests.Session()
-retry_strategy = Retry(
-    total=3,
-    backoff_factor=1,
-    status_forcelist=[500, 502, 503, 504],
-)
-session_requests.mount('https://', HTTPAdapter(max_retries=retry_strategy))
+# Mensajes de la primera página de una sala que se renderizan en el servidor
+MENSAJES_POR_PAGINA = int(os.environ.get('MENSAJES_POR_PAGINA', 50))
+
+# Cliente de la API con pool de conexiones persistentes compartido por el proceso
+cliente_api = ClienteApi(API_BASE_URL, verify=SSL_VERIFY)
+
+# Caché de salas por usuario, invalidada por el canal de avisos del backend.
+# Sin secreto compartido no hay canal y la caché solo se usa como respaldo
+# cuando el backend no responde.
+INTERNAL_EVENTS_SECRET = os.environ.get('INTERNAL_EVENTS_SECRET')
+cache_salas = CacheSalas()
+escucha_avisos = EscuchaAvisos(
+    cache_salas,
+    f'{API_BASE_URL}/api/internal/membership-events',
+    INTERNAL_EVENTS_SECRET,
+    verify=SSL_VERIFY
+) if INTERNAL_EVENTS_SECRET else None
+
+# Recursos estáticos con hash en el nombre generados por build_assets.py
+DIRECTORIO_DIST = os.path.join(DIRECTORIO_FRONTEND, 'static', 'dist')
+CACHE_RECURSOS = 'public, max-age=31536000, immutable'
+CODIFICACIONES = (('br', '.br'), ('gzip', '.gz'))
+
+def cargar_manifiesto():
+    """Devuelve la correspondencia entre nombres originales y nombres con hash"""
+    try:
+        with open(os.path.join(DIRECTORIO_DIST, 'manifest.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        # Sin build se sirven los ficheros originales desde /static
+        return {}
+
+manifiesto_recursos = cargar_manifiesto()
+recursos_con_hash = set(manifiesto_recursos.values())
+
+def asset_url(ruta):
+    """URL de un recurso estático: la versión con hash si existe, o la original"""
+    destino = manifiesto_recursos.get(ruta)
+    if destino is None:
+        return url_for('static', filename=ruta)
+    return url_for('web.asset', filename=destino)
+
+def create_app():
+    """Crea y configura la aplicación Flask del frontend"""
+    app = Flask(__name__)
+    # Clave secreta para las sesiones; debe ser la misma en todos los workers
+    # para que las sesiones sobrevivan a los reinicios
+    app.secret_key = os.environ.get('FRONTEND_SECRET_KEY') or os.urandom(24)
+    
+    # Caché en disco de las plantillas compiladas, compartida por los workers
+    try:
+        os.makedirs(PLANTILLAS_CACHE_DIR, exist_ok=True)
+        app.jinja_options = dict(app.jinja_options,
+                                 bytecode_cache=FileSystemBytecodeCache(PLANTILLAS_CACHE_DIR))
+    except OSError:
+        pass
+    
+    # Aplicar filtros a la aplicación Flask
+    app.jinja_env.filters['tojson'] = to_json_filter
+    app.jinja_env.filters['datetimeformat'] = datetimeformat
+    app.jinja_env.globals['asset_url'] = asset_url
+    
+    app.register_blueprint(web)
+    return app
 
 # Decorador para verificar si el usuario está autenticado
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if 'access_token' not in session:
-            return redirect(url_for('login'))
+            return redirect(url_for('web.login'))
         return f(*args, **kwargs)
     return decorated_function
 
 # Ruta de inicio
-@app.route('/')
+@web.route('/')
 def index():
-    return redirect(url_for('login'))
+    return redirect(url_for('web.login'))
 
 # Ruta de login
-@app.route('/login', methods=['GET', 'POST'])
+@web.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         username = request.form.get('username')
@@ -92,26 +155,22 @@ def login():
             return render_template('login.html', error='Por favor ingrese usuario y contraseña')
         
         # Intentar autenticación con la API
-        try:
-            response = session_requests.post(
-                f'{API_BASE_URL}/api/auth/login',
-                json={'username': username, 'password': password},
-                verify=SSL_VERIFY,
-                timeout=10
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                # Almacenar el token en la sesión
-                session['access_token'] = data['access_token']
-                session['user_id'] = data['user_id']
-                session['username'] = data['username']
-                return redirect(url_for('chat'))
-            else:
-                return render_template('login.html', error='Usuario o contraseña incorrectos')
-                
-        except requests.exceptions.RequestException as e:
+        status_code, data = cliente_api.peticion(
+            'post',
+            '/api/auth/login',
+            json_data={'username': username, 'password': password}
+        )
+        
+        if status_code == 200:
+            # Almacenar el token en la sesión
+            session['access_token'] = data['access_token']
+            session['user_id'] = data['user_id']
+            session['username'] = data['username']
+            return redirect(url_for('web.chat'))
+        elif status_code >= 500:
             return render_template('login.html', error='Error al conectar con el servidor')
+        else:
+            return render_template('login.html', error='Usuario o contraseña incorrectos')
     
     return render_template('login.html')
 
@@ -129,81 +188,188 @@ def make_api_request(method, endpoint, data=None, json_data=None):
     Returns:
         Tupla con (código de estado, datos de la respuesta)
     """
-    headers = {
+    return cliente_api.peticion(method, endpoint, headers=api_headers(), json_data=json_data)
+
+def make_api_requests(llamadas, plazo=API_PLAZO_PAGINA, en_lote=API_BATCH):
+    """
+    Realiza en paralelo varias peticiones independientes a la API.
+    
+    Args:
+        llamadas: Lista de tuplas (method, endpoint) o (method, endpoint, json_data)
+        plazo: Segundos máximos a esperar por el conjunto (por defecto API_PLAZO_PAGINA)
+        en_lote: Si todas son GET, hacerlas en una sola llamada a /api/batch
+            (por defecto según API_BATCH)
+        
+    Returns:
+        Lista de tuplas (código de estado, datos de la respuesta) en el mismo
+        orden que las llamadas. Las que no terminan a tiempo devuelven 504.
+    """
+    # Las cabeceras se leen de la sesión aquí: los hilos del pool no tienen
+    # acceso al contexto de la petición de Flask
+    headers = api_headers()
+    
+    # En lote, varias lecturas se hacen en una sola llamada al backend
+    if en_lote and len(llamadas) > 1 and all(
+            llamada[0].lower() == 'get' and len(llamada) == 2 for llamada in llamadas):
+        return cliente_api.en_lote([llamada[1] for llamada in llamadas], headers, plazo=plazo)
+    
+    peticiones = [(llamada[0], llamada[1], headers, llamada[2] if len(llamada) > 2 else None)
+                  for llamada in llamadas]
+    return cliente_api.en_paralelo(peticiones, plazo=plazo)
+
+def api_headers():
+    """Cabeceras de autenticación de la API para el usuario de la sesión"""
+    return {
         'Authorization': f"Bearer {session.get('access_token')}",
         'Content-Type': 'application/json'
     }
+
+def obtener_salas_en_cache():
+    """Devuelve las salas del usuario de la sesión desde la caché, o None"""
+    if escucha_avisos is None:
+        return None
+    escucha_avisos.iniciar()
+    if not escucha_avisos.conectado:
+        return None
+    return cache_salas.obtener(session['user_id'])
+
+@web.route('/chat')
+@login_required
+def chat():
+    """
+    Vista del chat. Con ?room=<id> incluye ya renderizada la página más reciente
+    de mensajes de esa sala, obtenida junto con la lista de salas y el usuario
+    en una sola llamada a /api/batch, aunque API_BATCH no esté activado.
+    """
+    sala_actual = request.args.get('room', type=int)
+    rooms = obtener_salas_en_cache()
     
-    url = f"{API_BASE_URL}{endpoint}"
+    # Las llamadas de la página son independientes: van en un único lote
+    llamadas = [('get', '/api/user/me')]
+    if rooms is None:
+        # Antes de pedirla: si llega un aviso mientras tanto, la lista no se guarda
+        generacion = cache_salas.generacion()
+        llamadas.append(('get', '/api/rooms'))
+    if sala_actual is not None:
+        llamadas.append(('get', f'/api/rooms/{sala_actual}/messages?limit={MENSAJES_POR_PAGINA}'))
+    respuestas = iter(make_api_requests(llamadas, en_lote=True))
     
-    try:
-        if method.lower() == 'get':
-            response = session_requests.get(
-                url,
-                headers=headers,
-                verify=SSL_VERIFY,
-                timeout=10
-            )
-        elif method.lower() == 'post':
-            response = session_requests.post(
-                url,
-                headers=headers,
-                json=json_data,
-                verify=SSL_VERIFY,
-                timeout=10
-            )
-        elif method.lower() == 'put':
-            response = session_requests.put(
-                url,
-                headers=headers,
-                json=json_data,
-                verify=SSL_VERIFY,
-                timeout=10
-            )
-        elif method.lower() == 'delete':
-            response = session_requests.delete(
-                url,
-                headers=headers,
-                verify=SSL_VERIFY,
-                timeout=10
-            )
+    user_status, user_data = next(respuestas)
+    usuario = user_data if user_status == 200 else None
+    
+    error_message = None
+    if rooms is None:
+        status_code, response_data = next(respuestas)
+        if status_code == 200:
+            rooms = response_data
+            cache_salas.guardar(session['user_id'], response_data, generacion)
+        elif status_code >= 500 and cache_salas.obtener_caducada(session['user_id']) is not None:
+            # Backend no disponible: versión degradada con la última lista conocida
+            rooms = cache_salas.obtener_caducada(session['user_id'])
+            error_message = 'El servidor no está disponible; se muestran las últimas salas conocidas'
         else:
-            return 405, {'error': 'Método no permitido'}
-            
-        return response.status_code, response.json() if response.content else {}
-        
-    except requests.exceptions.RequestException as e:
-        print(f"Error en la petición a la API: {str(e)}")
-        return 500, {'error': 'Error al conectar con el servidor'}
+            # Si hay un error, mostramos un array vacío y pasamos el mensaje de error
+            rooms = []
+            error_message = response_data.get('msg', response_data.get('error', 'Error al cargar las salas'))
+    
+    # Mensajes de la sala seleccionada en orden cronológico, solo si el usuario
+    # es miembro; si no se han podido obtener los cargará el navegador
+    mensajes = None
+    if sala_actual is not None:
+        mensajes_status, mensajes_data = next(respuestas)
+        if mensajes_status == 200 and any(room['id'] == sala_actual for room in rooms):
+            mensajes = list(reversed(mensajes_data))
+        else:
+            sala_actual = None
+    
+    # La plantilla se envía según se renderiza, sin esperar a tenerla entera
+    return Response(stream_template(
+        'chat.html',
+        username=session.get('username'),
+        usuario=usuario,
+        rooms=rooms,
+        sala_actual=sala_actual,
+        mensajes=mensajes,
+        socket_url=API_BASE_URL,
+        error=error_message
+    ))
 
-@app.route('/chat')
-@login_required
-def chat():
-    # Obtener las salas del usuario
-    status_code, response_data = make_api_request('get', '/api/rooms')
-    
-    if status_code == 200:
-        rooms = response_data
-    else:
-        # Si hay un error, mostramos un array vacío y pasamos el mensaje de error
-        rooms = []
-        error_message = response_data.get('msg', 'Error al cargar las salas')
-        return render_template('chat.html', 
-                            username=session.get('username'),
-                            rooms=rooms,
-                            error=error_message)
-    
-    return render_template('chat.html', 
-                         username=session.get('username'),
-                         rooms=rooms)
+# Rutas de mensajes usadas por chat.js (reenvían al backend con el token de la sesión)
+@web.route('/api/rooms/<int:room_id>/messages', methods=['GET'])
+def room_messages(room_id):
+    """Página de mensajes de una sala (más recientes primero), con el cursor before"""
+    if 'access_token' not in session:
+        return jsonify({'error': 'No autenticado'}), 401
+    
+    params = {clave: request.args[clave] for clave in ('before', 'limit') if clave in request.args}
+    endpoint = f'/api/rooms/{room_id}/messages'
+    if params:
+        endpoint += '?' + urlencode(params)
+    status_code, response_data = make_api_request('get', endpoint)
+    return jsonify(response_data), status_code
+
+@web.route('/api/rooms/<int:room_id>/messages', methods=['POST'])
+def send_room_message(room_id):
+    """Envía un mensaje a una sala y devuelve el mensaje creado"""
+    if 'access_token' not in session:
+        return jsonify({'error': 'No autenticado'}), 401
+    
+    data = request.get_json(silent=True) or {}
+    status_code, response_data = make_api_request(
+        'post', f'/api/rooms/{room_id}/messages', json_data={'contenido': data.get('contenido')}
+    )
+    return jsonify(response_data), status_code
+
+# Ruta de métricas internas
+@web.route('/metrics')
+def metrics():
+    """Métricas internas del proceso del frontend (solo desde localhost)"""
+    if request.remote_addr not in ('127.0.0.1', '::1'):
+        return jsonify({'error': 'No autorizado'}), 403
+    
+    return jsonify({
+        'api': cliente_api.estadisticas(),
+        'cache_salas': dict(
+            cache_salas.estadisticas(),
+            canal_conectado=bool(escucha_avisos and escucha_avisos.conectado)
+        )
+    })
+
+# Ruta de recursos estáticos con hash
+@web.route('/assets/<path:filename>')
+def asset(filename):
+    """
+    Sirve un recurso generado por build_assets.py con caché permanente, en la
+    versión precomprimida que acepte el navegador.
+    """
+    if filename not in recursos_con_hash:
+        abort(404)
+    
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    codificacion, sufijo = None, ''
+    for nombre, extension in CODIFICACIONES:
+        if request.accept_encodings[nombre] and os.path.exists(os.path.join(DIRECTORIO_DIST, filename + extension)):
+            codificacion, sufijo = nombre, extension
+            break
+    
+    response = send_from_directory(DIRECTORIO_DIST, filename + sufijo, mimetype=mimetype)
+    if codificacion:
+        response.headers['Content-Encoding'] = codificacion
+    response.headers['Cache-Control'] = CACHE_RECURSOS
+    response.vary.add('Accept-Encoding')
+    return response
 
 # Ruta de cierre de sesión
-@app.route('/logout')
+@web.route('/logout')
 def logout():
     session.clear()
-    return redirect(url_for('login'))
+    return redirect(url_for('web.login'))
 
 if __name__ == '__main__':
+    import ssl
+    
+    app = create_app()
+    
     # Configuración para desarrollo con SSL
     context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
     context.load_cert_chain('cert.pem', 'key.pem')  # Asegúrate de tener estos archivos
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Mide el arranque de un worker del frontend y su primera petición.
+
+Cada repetición lanza un proceso nuevo de Python, como un worker recién
+creado en un reinicio escalonado, que mide:
+
+- importación del módulo ``app``
+- ``create_app()``
+- primera petición a /login (renderiza login.html y base.html)
+- lo que costaría importar requests, que ya no se importa al arrancar
+
+Se comparan dos escenarios: caché de plantillas vacía (cada worker compila
+las plantillas en su primera petición) y caché precompilada con
+``build_assets.py``.
+
+Uso:
+    python benchmarks/bench_arranque.py --repeticiones 20
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+DIRECTORIO_FRONTEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Código que ejecuta cada proceso hijo
+HIJO = """
+import json, sys, time
+inicio = time.perf_counter()
+import app
+importado = time.perf_counter()
+aplicacion = app.create_app()
+creado = time.perf_counter()
+respuesta = aplicacion.test_client().get('/login')
+assert respuesta.status_code == 200, respuesta.status_code
+primera = time.perf_counter()
+ya_importado = 'requests' in sys.modules
+import requests
+fin = time.perf_counter()
+print(json.dumps({
+    "importar_app": importado - inicio,
+    "create_app": creado - importado,
+    "primera_peticion": primera - creado,
+    "importar_requests": 0.0 if ya_importado else fin - primera,
+}))
+"""
+
+COLUMNAS = ("importar_app", "create_app", "primera_peticion", "importar_requests")
+
+
+def medir(directorio_cache, repeticiones):
+    entorno = dict(os.environ, PLANTILLAS_CACHE_DIR=directorio_cache)
+    muestras = []
+    for _ in range(repeticiones):
+        salida = subprocess.run(
+            [sys.executable, '-c', HIJO], cwd=DIRECTORIO_FRONTEND, env=entorno,
+            capture_output=True, text=True, check=True
+        ).stdout
+        muestras.append(json.loads(salida.strip().splitlines()[-1]))
+    return muestras
+
+
+def vaciar(directorio):
+    for fichero in os.listdir(directorio):
+        os.remove(os.path.join(directorio, fichero))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--repeticiones', type=int, default=10, help='Procesos por escenario')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directorio_cache:
+        # Sin caché: se vacía antes de cada proceso
+        sin_cache = []
+        for _ in range(args.repeticiones):
+            vaciar(directorio_cache)
+            sin_cache.extend(medir(directorio_cache, 1))
+
+        # Con caché: la llena la primera ejecución, como haría build_assets.py
+        vaciar(directorio_cache)
+        medir(directorio_cache, 1)
+        con_cache = medir(directorio_cache, args.repeticiones)
+
+    print(f"Repeticiones por escenario: {args.repeticiones} (mediana en ms)")
+    print(f"{'ESCENARIO':<22}" + "".join(f"{c.upper():>20}" for c in COLUMNAS) + f"{'TOTAL':>10}")
+    print("-" * (22 + 20 * len(COLUMNAS) + 10))
+    for nombre, muestras in (("plantillas sin caché", sin_cache), ("plantillas en caché", con_cache)):
+        medianas = [statistics.median(m[c] for m in muestras) * 1000 for c in COLUMNAS]
+        total = statistics.median(sum(m[c] for c in COLUMNAS[:3]) for m in muestras) * 1000
+        print(f"{nombre:<22}" + "".join(f"{v:>20.1f}" for v in medianas) + f"{total:>10.1f}")
+    print("\nTOTAL = importar_app + create_app + primera_peticion. importar_requests es el "
+          "coste que se aplaza a la primera llamada a la API.")
+
+
+if __name__ == '__main__':
+    main()
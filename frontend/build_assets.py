@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""
+Prepara los recursos estáticos del frontend para servirlos con caché permanente.
+
+Copia cada fichero de static/css y static/js a static/dist con el hash de su
+contenido en el nombre (por ejemplo ``css/style.3f2a9c1b.css``), junto con sus
+versiones precomprimidas ``.gz`` y ``.br`` (esta última solo si está instalado
+el paquete brotli), y escribe ``static/dist/manifest.json`` con la
+correspondencia entre nombres originales y nombres con hash.
+
+Las plantillas usan ``asset_url('css/style.css')``, que consulta el manifiesto,
+de modo que un cambio en un fichero cambia su URL y los navegadores nunca
+sirven una versión antigua aunque se cacheen un año.
+
+También compila todas las plantillas a la caché de bytecode de Jinja
+(PLANTILLAS_CACHE_DIR), para que los workers no tengan que compilarlas en su
+primera petición.
+
+Uso:
+    python build_assets.py
+"""
+import gzip
+import hashlib
+import json
+import os
+import shutil
+
+try:
+    import brotli
+except ImportError:  # brotli es opcional
+    brotli = None
+
+DIRECTORIO_STATIC = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+DIRECTORIO_DIST = os.path.join(DIRECTORIO_STATIC, 'dist')
+CARPETAS = ('css', 'js')
+LONGITUD_HASH = 8
+
+# Por debajo de este tamaño la versión comprimida no compensa
+MIN_BYTES_COMPRIMIR = 512
+
+
+def nombre_con_hash(ruta, contenido):
+    """Inserta el hash del contenido antes de la extensión: css/style.css -> css/style.<hash>.css"""
+    base, extension = os.path.splitext(ruta)
+    huella = hashlib.sha256(contenido).hexdigest()[:LONGITUD_HASH]
+    return f"{base}.{huella}{extension}"
+
+
+def escribir(ruta, contenido):
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    with open(ruta, 'wb') as f:
+        f.write(contenido)
+
+
+def precomprimir(ruta, contenido):
+    """Escribe las versiones .gz y .br del fichero si reducen su tamaño"""
+    if len(contenido) < MIN_BYTES_COMPRIMIR:
+        return []
+    versiones = [('.gz', gzip.compress(contenido, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        versiones.append(('.br', brotli.compress(contenido, quality=11)))
+
+    escritas = []
+    for sufijo, comprimido in versiones:
+        if len(comprimido) < len(contenido):
+            escribir(ruta + sufijo, comprimido)
+            escritas.append(sufijo)
+    return escritas
+
+
+def precompilar_plantillas():
+    """Compila las plantillas y guarda su bytecode en la caché de los workers"""
+    from app import create_app, PLANTILLAS_CACHE_DIR
+
+    entorno = create_app().jinja_env
+    nombres = entorno.list_templates(extensions=['html'])
+    for nombre in nombres:
+        entorno.get_template(nombre)
+    print(f"{len(nombres)} plantillas compiladas en {PLANTILLAS_CACHE_DIR}")
+
+
+def construir():
+    """Genera static/dist y devuelve el manifiesto"""
+    if os.path.isdir(DIRECTORIO_DIST):
+        shutil.rmtree(DIRECTORIO_DIST)
+
+    manifiesto = {}
+    for carpeta in CARPETAS:
+        for raiz, _, ficheros in os.walk(os.path.join(DIRECTORIO_STATIC, carpeta)):
+            for fichero in sorted(ficheros):
+                ruta = os.path.join(raiz, fichero)
+                relativa = os.path.relpath(ruta, DIRECTORIO_STATIC).replace(os.sep, '/')
+                with open(ruta, 'rb') as f:
+                    contenido = f.read()
+
+                destino = nombre_con_hash(relativa, contenido)
+                ruta_destino = os.path.join(DIRECTORIO_DIST, destino)
+                escribir(ruta_destino, contenido)
+                comprimidas = precomprimir(ruta_destino, contenido)
+
+                manifiesto[relativa] = destino
+                print(f"{relativa} -> dist/{destino} {' '.join(comprimidas)}".rstrip())
+
+    escribir(os.path.join(DIRECTORIO_DIST, 'manifest.json'),
+             json.dumps(manifiesto, indent=2, sort_keys=True).encode('utf-8'))
+    if brotli is None:
+        print("brotli no está instalado: solo se han generado versiones .gz (pip install brotli).")
+    return manifiesto
+
+
+if __name__ == '__main__':
+    construir()
+    precompilar_plantillas()
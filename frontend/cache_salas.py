@@ -0,0 +1,245 @@
+"""
+Caché de las listas de salas de cada usuario en el proceso del frontend.
+
+La vista /chat pide GET /api/rooms en cada carga de página. Esta caché guarda
+la respuesta por usuario durante un tiempo (TTL) con un número máximo de
+entradas (LRU), y se invalida cuando el backend avisa por su canal de avisos
+internos de cambios de pertenencia a salas o de marcas de lectura (avisos por
+usuario) y de mensajes nuevos, editados o eliminados (avisos por sala: se
+invalida la lista de todos los usuarios que tienen esa sala en caché, porque
+su último mensaje y sus no leídos han cambiado).
+
+La clave es siempre el ID del usuario de la sesión, y cada entrada guarda
+también ese ID, de modo que nunca se devuelven las salas de un usuario a otro.
+
+Un aviso puede llegar mientras se está pidiendo la lista al backend. Para no
+guardar entonces una lista ya anticuada, se toma ``generacion()`` antes de la
+petición y se pasa a ``guardar()``, que no guarda nada si el usuario o alguna
+de sus salas se han invalidado entretanto.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_SALAS_TTL = float(os.environ.get('CACHE_SALAS_TTL', 60))
+CACHE_SALAS_MAX = int(os.environ.get('CACHE_SALAS_MAX', 1000))
+
+
+class CacheSalas:
+    """
+    Caché LRU con caducidad de las listas de salas por usuario.
+
+    Args:
+        ttl: Segundos que una lista se considera válida
+        max_entradas: Número máximo de usuarios en caché
+    """
+
+    def __init__(self, ttl=CACHE_SALAS_TTL, max_entradas=CACHE_SALAS_MAX):
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self._entradas = OrderedDict()
+        # Sala -> claves de los usuarios con esa sala en su lista en caché
+        self._usuarios_por_sala = {}
+        self._lock = threading.Lock()
+
+        # Número creciente de invalidaciones y la última de cada usuario y de
+        # cada sala. Para los que ya se han olvidado vale _suelo, el valor más
+        # alto olvidado, lo que como mucho descarta alguna lista de más.
+        self._secuencia = 0
+        self._invalidados_en = OrderedDict()
+        self._salas_invalidadas_en = OrderedDict()
+        self._suelo = 0
+
+        self._aciertos = 0
+        self._fallos = 0
+        self._invalidaciones = 0
+        self._caducadas_servidas = 0
+        self._descartadas = 0
+
+    def obtener(self, usuario_id):
+        """Devuelve la lista de salas del usuario si está en caché y no ha caducado, o None"""
+        clave = str(usuario_id)
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None or entrada[0] != clave or entrada[1] < time.monotonic():
+                self._fallos += 1
+                return None
+            self._entradas.move_to_end(clave)
+            self._aciertos += 1
+            return entrada[2]
+
+    def obtener_caducada(self, usuario_id):
+        """
+        Devuelve la última lista guardada del usuario aunque haya caducado, o
+        None. Solo para mostrar una versión degradada cuando el backend falla.
+        """
+        clave = str(usuario_id)
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None or entrada[0] != clave:
+                return None
+            self._caducadas_servidas += 1
+            return entrada[2]
+
+    def generacion(self):
+        """Devuelve el número de invalidaciones hasta ahora, para pasarlo a guardar()"""
+        with self._lock:
+            return self._secuencia
+
+    def guardar(self, usuario_id, salas, generacion=None):
+        """
+        Guarda la lista de salas de un usuario.
+
+        Args:
+            usuario_id: ID del usuario
+            salas: Lista de salas devuelta por el backend
+            generacion: Valor de generacion() tomado antes de pedir la lista; si
+                el usuario o alguna de sus salas se han invalidado desde entonces
+                la lista no se guarda
+        """
+        clave = str(usuario_id)
+        sala_ids = {sala['id'] for sala in salas}
+        with self._lock:
+            if generacion is not None and (
+                    self._invalidados_en.get(clave, self._suelo) > generacion
+                    or any(self._salas_invalidadas_en.get(sala_id, self._suelo) > generacion
+                           for sala_id in sala_ids)):
+                self._descartadas += 1
+                return
+            self._quitar(clave)
+            self._entradas[clave] = (clave, time.monotonic() + self.ttl, salas, sala_ids)
+            for sala_id in sala_ids:
+                self._usuarios_por_sala.setdefault(sala_id, set()).add(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._quitar(next(iter(self._entradas)))
+
+    def _quitar(self, clave):
+        entrada = self._entradas.pop(clave, None)
+        if entrada is None:
+            return False
+        for sala_id in entrada[3]:
+            claves = self._usuarios_por_sala.get(sala_id)
+            if claves is not None:
+                claves.discard(clave)
+                if not claves:
+                    del self._usuarios_por_sala[sala_id]
+        return True
+
+    def _anotar(self, invalidados, clave):
+        self._secuencia += 1
+        invalidados[clave] = self._secuencia
+        invalidados.move_to_end(clave)
+        while len(invalidados) > self.max_entradas:
+            _, secuencia = invalidados.popitem(last=False)
+            self._suelo = max(self._suelo, secuencia)
+
+    def invalidar(self, usuario_ids, sala_ids=()):
+        """
+        Elimina de la caché las listas de los usuarios indicados y las de
+        cualquier usuario que tenga en su lista alguna de las salas indicadas
+        """
+        with self._lock:
+            claves = {str(usuario_id) for usuario_id in usuario_ids}
+            for sala_id in sala_ids:
+                self._anotar(self._salas_invalidadas_en, sala_id)
+                claves.update(self._usuarios_por_sala.get(sala_id, ()))
+            for clave in claves:
+                self._anotar(self._invalidados_en, clave)
+                if self._quitar(clave):
+                    self._invalidaciones += 1
+
+    def invalidar_todo(self):
+        """Vacía la caché"""
+        with self._lock:
+            self._secuencia += 1
+            self._suelo = self._secuencia
+            self._invalidados_en.clear()
+            self._salas_invalidadas_en.clear()
+            self._invalidaciones += len(self._entradas)
+            self._entradas.clear()
+            self._usuarios_por_sala.clear()
+
+    def estadisticas(self):
+        """Devuelve el número de entradas, aciertos, fallos y la tasa de aciertos"""
+        with self._lock:
+            consultas = self._aciertos + self._fallos
+            return {
+                "entradas": len(self._entradas),
+                "max_entradas": self.max_entradas,
+                "ttl": self.ttl,
+                "aciertos": self._aciertos,
+                "fallos": self._fallos,
+                "tasa_aciertos": round(self._aciertos / consultas, 4) if consultas else None,
+                "invalidaciones": self._invalidaciones,
+                "caducadas_servidas": self._caducadas_servidas,
+                "descartadas": self._descartadas,
+            }
+
+
+class EscuchaAvisos:
+    """
+    Hilo que escucha el canal de avisos internos del backend e invalida la caché.
+
+    Si la conexión se corta se vacía la caché entera, porque se han podido
+    perder avisos, y se vuelve a conectar con espera creciente. Mientras no hay
+    conexión (``conectado`` es False) la caché no debe usarse.
+
+    Args:
+        cache: CacheSalas a invalidar
+        url: URL del endpoint de avisos del backend
+        secreto: Secreto compartido con el backend (INTERNAL_EVENTS_SECRET)
+        verify: Verificar el certificado SSL del backend
+    """
+
+    def __init__(self, cache, url, secreto, verify=True):
+        self.cache = cache
+        self.url = url
+        self.secreto = secreto
+        self.verify = verify
+        self.conectado = False
+        self._hilo = None
+        self._lock = threading.Lock()
+
+    def iniciar(self):
+        """Arranca el hilo de escucha si no está ya en marcha"""
+        with self._lock:
+            if self._hilo is None:
+                self._hilo = threading.Thread(target=self._bucle, name='avisos-salas', daemon=True)
+                self._hilo.start()
+
+    def _bucle(self):
+        espera = 1
+        while True:
+            try:
+                self._escuchar()
+                espera = 1
+            except Exception as e:
+                logging.warning(f"Canal de avisos del backend no disponible: {str(e)}")
+            self.conectado = False
+            self.cache.invalidar_todo()
+            time.sleep(espera)
+            espera = min(espera * 2, 60)
+
+    def _escuchar(self):
+        import requests
+
+        # La caché se vacía al perder la conexión, así que no hace falta
+        # reanudar desde el último aviso recibido
+        with requests.get(self.url, stream=True, verify=self.verify,
+                          headers={'X-Internal-Secret': self.secreto},
+                          timeout=(5, 60)) as response:
+            response.raise_for_status()
+            self.conectado = True
+            for linea in response.iter_lines(decode_unicode=True):
+                if linea.startswith('data: '):
+                    self._procesar(json.loads(linea[6:]))
+
+    def _procesar(self, aviso):
+        tipo = aviso.get('tipo')
+        if tipo == 'salas':
+            self.cache.invalidar(aviso.get('usuarios', []), aviso.get('salas', []))
+        elif tipo == 'reset':
+            self.cache.invalidar_todo()
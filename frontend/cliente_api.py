@@ -0,0 +1,252 @@
+"""
+Cliente HTTP del frontend para la API del backend.
+
+Mantiene un único pool de conexiones persistentes (keep-alive) por proceso,
+dimensionado según los hilos que atienden peticiones en cada worker, y usa
+HTTP/2 cuando están instalados httpx y h2 y se activa con API_HTTP2=1.
+
+También permite lanzar en paralelo las llamadas independientes que necesita
+una misma página (por ejemplo las salas y el usuario actual) con un plazo
+global, de modo que el tiempo de la página es el de la llamada más lenta y
+nunca supera el plazo.
+
+Cada endpoint tiene su propio circuit breaker y los reintentos (solo de GET)
+están limitados por un presupuesto global; ver resiliencia.py.
+
+requests (o httpx) se importa en la primera llamada y no al arrancar el
+worker, para que arranque antes.
+"""
+import os
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from resiliencia import Interruptor, PresupuestoReintentos, clave_endpoint, espera_con_jitter
+
+# Hilos que atienden peticiones en cada worker del frontend y llamadas que
+# una misma página puede lanzar en paralelo
+FRONTEND_HILOS = int(os.environ.get('FRONTEND_HILOS', 8))
+API_MAX_PARALELO = int(os.environ.get('API_MAX_PARALELO', 4))
+
+# Tamaño del pool: suficiente para que todos los hilos lancen sus llamadas en
+# paralelo a la vez sin abrir conexiones nuevas
+API_POOL_SIZE = int(os.environ.get('API_POOL_SIZE', FRONTEND_HILOS * API_MAX_PARALELO))
+
+# Tiempos de espera (conexión, lectura) por llamada y plazo global por página
+API_TIMEOUT_CONEXION = float(os.environ.get('API_TIMEOUT_CONEXION', 3.05))
+API_TIMEOUT_LECTURA = float(os.environ.get('API_TIMEOUT_LECTURA', 10))
+API_PLAZO_PAGINA = float(os.environ.get('API_PLAZO_PAGINA', 5))
+
+API_HTTP2 = os.environ.get('API_HTTP2', '0') == '1'
+
+# Agrupar las llamadas GET de una misma página en POST /api/batch
+API_BATCH = os.environ.get('API_BATCH', '0') == '1'
+
+# Reintentos máximos de una misma llamada (además del presupuesto global)
+API_REINTENTOS_MAX = int(os.environ.get('API_REINTENTOS_MAX', 2))
+
+METODOS = ('get', 'post', 'put', 'patch', 'delete')
+# Solo se reintentan las llamadas de lectura
+METODOS_REINTENTABLES = ('get',)
+ESTADOS_REINTENTABLES = (502, 503, 504)
+
+ERROR_CONEXION = {'error': 'Error al conectar con el servidor'}
+ERROR_PLAZO = {'error': 'El servidor ha tardado demasiado en responder'}
+ERROR_NO_DISPONIBLE = {'error': 'El servidor no está disponible en este momento'}
+
+
+def _importar_httpx():
+    """Devuelve el módulo httpx si se puede usar HTTP/2, o None"""
+    try:
+        import httpx
+        import h2  # noqa: F401  (httpx solo habla HTTP/2 si h2 está instalado)
+    except ImportError:  # HTTP/2 es opcional
+        return None
+    return httpx
+
+
+class ClienteApi:
+    """
+    Cliente con pool de conexiones para la API del backend.
+
+    Args:
+        base_url: URL base de la API
+        verify: Verificar el certificado SSL del backend
+        tamano_pool: Conexiones persistentes máximas hacia el backend
+        http2: Usar HTTP/2 si httpx y h2 están disponibles
+    """
+
+    def __init__(self, base_url, verify=True, tamano_pool=API_POOL_SIZE, http2=API_HTTP2):
+        self.base_url = base_url
+        self.verify = verify
+        self.tamano_pool = tamano_pool
+        self.timeout = (API_TIMEOUT_CONEXION, API_TIMEOUT_LECTURA)
+        self.http2 = http2
+
+        # El cliente HTTP se crea en la primera llamada
+        self._cliente = None
+        self._errores_red = ()
+
+        self._ejecutor = ThreadPoolExecutor(max_workers=tamano_pool,
+                                            thread_name_prefix='api-paralelo')
+
+        self.presupuesto = PresupuestoReintentos()
+        self._interruptores = {}
+        self._lock = threading.Lock()
+
+    def _obtener_cliente(self):
+        with self._lock:
+            if self._cliente is not None:
+                return self._cliente
+
+            httpx = _importar_httpx() if self.http2 else None
+            if httpx is not None:
+                self._cliente = httpx.Client(
+                    http2=True,
+                    verify=self.verify,
+                    timeout=httpx.Timeout(API_TIMEOUT_LECTURA, connect=API_TIMEOUT_CONEXION),
+                    limits=httpx.Limits(max_connections=self.tamano_pool,
+                                        max_keepalive_connections=self.tamano_pool),
+                )
+                self._errores_red = (httpx.HTTPError,)
+            else:
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                self.http2 = False
+                cliente = requests.Session()
+                # Sin reintentos en el adaptador: los gestiona peticion()
+                adapter = HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=self.tamano_pool,
+                )
+                cliente.mount('https://', adapter)
+                cliente.mount('http://', adapter)
+                self._errores_red = (requests.exceptions.RequestException,)
+                self._cliente = cliente
+            return self._cliente
+
+    def _interruptor(self, clave):
+        with self._lock:
+            interruptor = self._interruptores.get(clave)
+            if interruptor is None:
+                interruptor = self._interruptores[clave] = Interruptor()
+            return interruptor
+
+    def peticion(self, metodo, endpoint, headers=None, json_data=None):
+        """
+        Realiza una petición a la API.
+
+        Si el circuit breaker del endpoint está abierto devuelve 503 al instante
+        sin llamar al backend. Las llamadas GET que fallan por conexión o con
+        502/503/504 se reintentan con espera exponencial con jitter mientras
+        quede presupuesto de reintentos.
+
+        Returns:
+            Tupla con (código de estado, datos de la respuesta)
+        """
+        metodo = metodo.lower()
+        if metodo not in METODOS:
+            return 405, {'error': 'Método no permitido'}
+
+        interruptor = self._interruptor(clave_endpoint(metodo, endpoint))
+        self.presupuesto.anotar_llamada()
+        intento = 0
+        while True:
+            if not interruptor.permitir():
+                return 503, dict(ERROR_NO_DISPONIBLE)
+
+            try:
+                status_code, datos, reintentable = self._enviar(metodo, endpoint, headers, json_data)
+            except BaseException:
+                # Un error inesperado cuenta como fallo: si era la llamada de
+                # prueba, el interruptor no puede quedarse esperándola
+                interruptor.registrar(False)
+                raise
+            interruptor.registrar(status_code < 500)
+
+            if (not reintentable or metodo not in METODOS_REINTENTABLES
+                    or intento >= API_REINTENTOS_MAX or not self.presupuesto.gastar()):
+                return status_code, datos
+            time.sleep(espera_con_jitter(intento))
+            intento += 1
+
+    def _enviar(self, metodo, endpoint, headers, json_data):
+        """Hace una única llamada. Devuelve (código de estado, datos, reintentable)"""
+        url = f"{self.base_url}{endpoint}"
+        cliente = self._obtener_cliente()
+        try:
+            if self.http2:
+                response = cliente.request(metodo, url, headers=headers, json=json_data)
+            else:
+                response = cliente.request(
+                    metodo,
+                    url,
+                    headers=headers,
+                    json=json_data,
+                    verify=self.verify,
+                    timeout=self.timeout
+                )
+            reintentable = response.status_code in ESTADOS_REINTENTABLES
+            return response.status_code, response.json() if response.content else {}, reintentable
+
+        except ValueError as e:
+            # Respuesta que no es JSON (por ejemplo una página de error de un proxy)
+            logging.warning(f"Respuesta no válida de la API: {str(e)}")
+            return 502, dict(ERROR_CONEXION), True
+        except self._errores_red as e:
+            logging.warning(f"Error en la petición a la API: {str(e)}")
+            return 500, dict(ERROR_CONEXION), True
+
+    def estadisticas(self):
+        """Estado de los circuit breakers por endpoint y del presupuesto de reintentos"""
+        with self._lock:
+            interruptores = dict(self._interruptores)
+        return {
+            "interruptores": {clave: i.estadisticas() for clave, i in sorted(interruptores.items())},
+            "reintentos": self.presupuesto.estadisticas(),
+        }
+
+    def en_lote(self, endpoints, headers=None, plazo=API_PLAZO_PAGINA):
+        """
+        Realiza varias peticiones GET en una sola llamada a POST /api/batch.
+
+        Args:
+            endpoints: Lista de endpoints (con su query string)
+            headers: Cabeceras de la llamada, con el token
+            plazo: Segundos máximos a esperar por el lote
+
+        Returns:
+            Lista de tuplas (código de estado, datos) en el mismo orden. Si falla
+            el lote entero, todas las entradas reciben ese error.
+        """
+        cuerpo = {'requests': [{'method': 'GET', 'path': endpoint} for endpoint in endpoints]}
+        status_code, datos = self.en_paralelo([('post', '/api/batch', headers, cuerpo)], plazo)[0]
+        if status_code != 200:
+            return [(status_code, datos)] * len(endpoints)
+        return [(r['status'], r['body'] if r['body'] is not None else {}) for r in datos['responses']]
+
+    def en_paralelo(self, llamadas, plazo=API_PLAZO_PAGINA):
+        """
+        Realiza varias peticiones independientes en paralelo.
+
+        Args:
+            llamadas: Lista de tuplas (metodo, endpoint, headers, json_data)
+            plazo: Segundos máximos a esperar por el conjunto de llamadas
+
+        Returns:
+            Lista de tuplas (código de estado, datos) en el mismo orden que las
+            llamadas. Las que no terminan dentro del plazo devuelven 504.
+        """
+        futuros = [self._ejecutor.submit(self.peticion, *llamada) for llamada in llamadas]
+        wait(futuros, timeout=plazo)
+
+        resultados = []
+        for futuro in futuros:
+            if futuro.done():
+                resultados.append(futuro.result())
+            else:
+                futuro.cancel()
+                resultados.append((504, dict(ERROR_PLAZO)))
+        return resultados
@@ -0,0 +1,172 @@
+"""
+Protección del backend frente a las llamadas del frontend cuando está caído o
+sobrecargado.
+
+- ``Interruptor``: circuit breaker por endpoint. Si en la ventana reciente
+  fallan demasiadas llamadas se abre y las siguientes fallan al instante sin
+  llegar al backend; pasado un tiempo deja pasar una llamada de prueba y se
+  cierra si tiene éxito.
+- ``PresupuestoReintentos``: los reintentos están limitados a un porcentaje
+  del tráfico total, de modo que cuando todo falla no se multiplica la carga.
+- ``espera_con_jitter``: espera exponencial con jitter completo entre
+  reintentos, para que los workers no reintenten todos a la vez.
+"""
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+
+# Interruptor: ventana de llamadas observadas, llamadas mínimas para decidir,
+# proporción de fallos que lo abre y segundos que permanece abierto
+API_CB_VENTANA = int(os.environ.get('API_CB_VENTANA', 20))
+API_CB_MIN_LLAMADAS = int(os.environ.get('API_CB_MIN_LLAMADAS', 10))
+API_CB_UMBRAL_FALLOS = float(os.environ.get('API_CB_UMBRAL_FALLOS', 0.5))
+API_CB_TIEMPO_ABIERTO = float(os.environ.get('API_CB_TIEMPO_ABIERTO', 15))
+
+# Presupuesto de reintentos: fracción del tráfico que se puede reintentar y
+# reintentos acumulables como máximo
+API_REINTENTOS_RATIO = float(os.environ.get('API_REINTENTOS_RATIO', 0.1))
+API_REINTENTOS_MAX_SALDO = float(os.environ.get('API_REINTENTOS_MAX_SALDO', 10))
+
+# Espera entre reintentos: base y máximo en segundos
+API_REINTENTOS_BASE = float(os.environ.get('API_REINTENTOS_BASE', 0.05))
+API_REINTENTOS_TOPE = float(os.environ.get('API_REINTENTOS_TOPE', 1.0))
+
+PATRON_ID = re.compile(r'/\d+(?=/|$)')
+
+CERRADO = 'cerrado'
+ABIERTO = 'abierto'
+SEMIABIERTO = 'semiabierto'
+
+
+def clave_endpoint(metodo, endpoint):
+    """Agrupa las URLs de un mismo endpoint: 'GET /api/rooms/<id>/messages'"""
+    ruta = PATRON_ID.sub('/<id>', endpoint.split('?', 1)[0])
+    return f"{metodo.upper()} {ruta}"
+
+
+def espera_con_jitter(intento, base=API_REINTENTOS_BASE, tope=API_REINTENTOS_TOPE):
+    """Segundos a esperar antes del reintento número ``intento`` (desde 0)"""
+    return random.uniform(0, min(tope, base * (2 ** intento)))
+
+
+class Interruptor:
+    """
+    Circuit breaker de un endpoint.
+
+    Args:
+        ventana: Número de llamadas recientes que se tienen en cuenta
+        min_llamadas: Llamadas mínimas en la ventana para poder abrirse
+        umbral_fallos: Proporción de fallos en la ventana que lo abre
+        tiempo_abierto: Segundos que permanece abierto antes de probar
+    """
+
+    def __init__(self, ventana=API_CB_VENTANA, min_llamadas=API_CB_MIN_LLAMADAS,
+                 umbral_fallos=API_CB_UMBRAL_FALLOS, tiempo_abierto=API_CB_TIEMPO_ABIERTO):
+        self.min_llamadas = min_llamadas
+        self.umbral_fallos = umbral_fallos
+        self.tiempo_abierto = tiempo_abierto
+
+        self.estado = CERRADO
+        self._resultados = deque(maxlen=ventana)
+        self._abierto_desde = 0.0
+        self._prueba_en_curso = False
+        self._lock = threading.Lock()
+
+        self.aperturas = 0
+        self.rechazadas = 0
+
+    def permitir(self):
+        """Indica si se puede hacer la llamada; si no, hay que fallar al instante"""
+        with self._lock:
+            if self.estado == ABIERTO:
+                if time.monotonic() - self._abierto_desde < self.tiempo_abierto:
+                    self.rechazadas += 1
+                    return False
+                self.estado = SEMIABIERTO
+                self._prueba_en_curso = False
+
+            if self.estado == SEMIABIERTO:
+                # Solo una llamada de prueba a la vez
+                if self._prueba_en_curso:
+                    self.rechazadas += 1
+                    return False
+                self._prueba_en_curso = True
+            return True
+
+    def registrar(self, exito):
+        """Anota el resultado de una llamada permitida"""
+        with self._lock:
+            if self.estado == SEMIABIERTO:
+                self._prueba_en_curso = False
+                if exito:
+                    self.estado = CERRADO
+                    self._resultados.clear()
+                else:
+                    self._abrir()
+                return
+
+            self._resultados.append(exito)
+            fallos = self._resultados.count(False)
+            if (self.estado == CERRADO and len(self._resultados) >= self.min_llamadas
+                    and fallos / len(self._resultados) >= self.umbral_fallos):
+                self._abrir()
+
+    def _abrir(self):
+        self.estado = ABIERTO
+        self._abierto_desde = time.monotonic()
+        self._resultados.clear()
+        self.aperturas += 1
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "estado": self.estado,
+                "fallos_recientes": self._resultados.count(False),
+                "llamadas_recientes": len(self._resultados),
+                "aperturas": self.aperturas,
+                "rechazadas": self.rechazadas,
+            }
+
+
+class PresupuestoReintentos:
+    """
+    Limita los reintentos a una fracción del tráfico total.
+
+    Cada llamada suma ``ratio`` al saldo (hasta ``max_saldo``) y cada
+    reintento gasta 1; sin saldo no se reintenta.
+    """
+
+    def __init__(self, ratio=API_REINTENTOS_RATIO, max_saldo=API_REINTENTOS_MAX_SALDO):
+        self.ratio = ratio
+        self.max_saldo = max_saldo
+        self._saldo = max_saldo
+        self._lock = threading.Lock()
+
+        self.reintentos = 0
+        self.denegados = 0
+
+    def anotar_llamada(self):
+        with self._lock:
+            self._saldo = min(self.max_saldo, self._saldo + self.ratio)
+
+    def gastar(self):
+        """Consume un reintento si queda saldo"""
+        with self._lock:
+            if self._saldo >= 1:
+                self._saldo -= 1
+                self.reintentos += 1
+                return True
+            self.denegados += 1
+            return False
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "saldo": round(self._saldo, 2),
+                "ratio": self.ratio,
+                "reintentos": self.reintentos,
+                "denegados": self.denegados,
+            }
@@ -0,0 +1,558 @@
+// Lógica de la vista de chat. Espera la variable global userData definida en
+// la plantilla chat.html.
+//
+// Los mensajes de la sala actual se guardan en un array en orden cronológico,
+// pero solo se mantienen en el DOM los de una ventana de como mucho MAX_NODOS.
+// Al hacer scroll hacia arriba la ventana se desplaza y, cuando llega al
+// mensaje más antiguo cargado, se pide la página anterior con el cursor
+// `before`. Los mensajes enviados y los eventos del socket se aplican de uno
+// en uno sin reconstruir la lista.
+
+// Mensajes por página pedida al servidor
+const TAMANO_PAGINA = 50;
+// Mensajes que se mantienen a la vez en el DOM
+const MAX_NODOS = 150;
+// Mensajes que se mantienen en memoria para la sala actual
+const MAX_EN_MEMORIA = 1000;
+// Distancia en píxeles a los bordes a partir de la cual se amplía la ventana
+const UMBRAL_SCROLL = 300;
+// Caracteres de la vista previa del último mensaje de cada sala (como en el backend)
+const LONGITUD_FRAGMENTO = 100;
+
+document.addEventListener('DOMContentLoaded', function() {
+    console.log('Chat cargado');
+
+    // Elementos del DOM
+    const roomsList = document.getElementById('rooms');
+    const chatMessages = document.getElementById('chat-messages');
+    const messageForm = document.getElementById('message-form');
+    const messageInput = document.getElementById('message-input');
+
+    // Variables de estado
+    let currentRoomId = null;
+    let mensajes = [];              // Mensajes cargados de la sala, en orden cronológico
+    const nodos = new Map();        // ID de mensaje -> elemento del DOM (solo la ventana)
+    let inicioVentana = 0;          // Índices [inicioVentana, finVentana) renderizados
+    let finVentana = 0;
+    let hayMasAntiguos = false;     // Quedan mensajes más antiguos en el servidor
+    let hayMasRecientes = false;    // Se han descartado de memoria mensajes recientes
+    let cargandoAntiguos = false;
+    let generacion = 0;             // Cambia con cada carga de sala para descartar respuestas viejas
+    const cursores = {};            // ID de sala -> mayor seq de evento aplicado
+    const nombres = new Map();      // ID de usuario -> nombre
+
+    // Función para formatear fechas
+    function formatDate(dateString) {
+        const options = {
+            year: 'numeric',
+            month: '2-digit',
+            day: '2-digit',
+            hour: '2-digit',
+            minute: '2-digit'
+        };
+        return new Date(dateString).toLocaleString('es-ES', options);
+    }
+
+    function nombreDe(mensaje) {
+        if (mensaje.usuario_nombre) {
+            nombres.set(String(mensaje.usuario_id), mensaje.usuario_nombre);
+            return mensaje.usuario_nombre;
+        }
+        return nombres.get(String(mensaje.usuario_id)) || 'Usuario ' + mensaje.usuario_id;
+    }
+
+    // Crea el elemento de un mensaje. El contenido se asigna como texto, nunca como HTML.
+    function crearNodo(mensaje) {
+        const messageElement = document.createElement('div');
+        // Verificar si el mensaje es del usuario actual
+        const isCurrentUser = mensaje.usuario_id != null &&
+                              String(mensaje.usuario_id) === userData.userId;
+        messageElement.className = 'message ' + (isCurrentUser ? 'message-sent' : 'message-received');
+        messageElement.dataset.messageId = mensaje.id;
+
+        const header = document.createElement('div');
+        header.className = 'message-header';
+        header.appendChild(document.createTextNode(nombreDe(mensaje) + ' '));
+        const time = document.createElement('span');
+        time.className = 'message-time';
+        time.textContent = formatDate(mensaje.fecha_envio);
+        header.appendChild(time);
+
+        const content = document.createElement('div');
+        content.className = 'message-content';
+        content.textContent = mensaje.contenido;
+
+        messageElement.appendChild(header);
+        messageElement.appendChild(content);
+        nodos.set(mensaje.id, messageElement);
+        return messageElement;
+    }
+
+    // Vista previa del último mensaje de una sala en la lista de salas. Con
+    // soloSiEsElUltimo (ediciones) solo cambia si el mensaje es el que se muestra.
+    function actualizarVistaPrevia(mensaje, soloSiEsElUltimo) {
+        const meta = document.querySelector(`.room[data-room-id="${mensaje.sala_id}"] .room-meta`);
+        if (!meta) return;
+        const ultimo = Number(meta.dataset.lastMessageId || 0);
+        if (soloSiEsElUltimo ? mensaje.id !== ultimo : mensaje.id < ultimo) return;
+        meta.dataset.lastMessageId = mensaje.id;
+
+        const vista = document.createElement('small');
+        vista.className = 'text-muted room-preview';
+        vista.textContent = nombreDe(mensaje) + ': ' + mensaje.contenido.slice(0, LONGITUD_FRAGMENTO);
+        const hora = document.createElement('small');
+        hora.className = 'text-muted room-preview-time';
+        hora.textContent = formatDate(mensaje.fecha_envio);
+        meta.replaceChildren(vista, hora);
+    }
+
+    function mostrarAviso(texto) {
+        const aviso = document.createElement('div');
+        aviso.className = 'text-center text-muted mt-5 aviso-chat';
+        aviso.textContent = texto;
+        chatMessages.replaceChildren(aviso);
+        nodos.clear();
+    }
+
+    function quitarAvisos() {
+        chatMessages.querySelectorAll(':scope > :not(.message)').forEach(el => el.remove());
+    }
+
+    // Posición del mensaje con ese ID en el array (búsqueda binaria), o -1
+    function indicePorId(id) {
+        const i = posicionInsercion(id);
+        return i < mensajes.length && mensajes[i].id === id ? i : -1;
+    }
+
+    // Primera posición cuyo ID es mayor o igual que el dado
+    function posicionInsercion(id) {
+        let bajo = 0, alto = mensajes.length;
+        while (bajo < alto) {
+            const medio = (bajo + alto) >> 1;
+            if (mensajes[medio].id < id) bajo = medio + 1; else alto = medio;
+        }
+        return bajo;
+    }
+
+    function estaAlFinal() {
+        return chatMessages.scrollHeight - chatMessages.scrollTop - chatMessages.clientHeight < UMBRAL_SCROLL;
+    }
+
+    // Ejecuta un cambio en el DOM por encima de lo visible sin mover lo que el usuario está viendo
+    function conAncla(cambio) {
+        const altoAntes = chatMessages.scrollHeight;
+        cambio();
+        chatMessages.scrollTop += chatMessages.scrollHeight - altoAntes;
+    }
+
+    function irAlFinal() {
+        chatMessages.scrollTop = chatMessages.scrollHeight;
+    }
+
+    // Renderiza desde cero los últimos mensajes cargados
+    function renderizarUltimos() {
+        nodos.clear();
+        if (mensajes.length === 0) {
+            mostrarAviso('No hay mensajes en esta sala. ¡Sé el primero en escribir!');
+            inicioVentana = finVentana = 0;
+            return;
+        }
+        finVentana = mensajes.length;
+        inicioVentana = Math.max(0, finVentana - MAX_NODOS);
+        const fragmento = document.createDocumentFragment();
+        for (let i = inicioVentana; i < finVentana; i++) {
+            fragmento.appendChild(crearNodo(mensajes[i]));
+        }
+        chatMessages.replaceChildren(fragmento);
+        irAlFinal();
+    }
+
+    // Quita nodos del principio de la ventana hasta dejar MAX_NODOS
+    function recortarArriba() {
+        if (finVentana - inicioVentana <= MAX_NODOS) return;
+        conAncla(() => {
+            while (finVentana - inicioVentana > MAX_NODOS) {
+                const id = mensajes[inicioVentana].id;
+                nodos.get(id).remove();
+                nodos.delete(id);
+                inicioVentana++;
+            }
+        });
+    }
+
+    // Quita nodos del final de la ventana hasta dejar MAX_NODOS
+    function recortarAbajo() {
+        while (finVentana - inicioVentana > MAX_NODOS) {
+            finVentana--;
+            const id = mensajes[finVentana].id;
+            nodos.get(id).remove();
+            nodos.delete(id);
+        }
+    }
+
+    // Desplaza la ventana hacia mensajes más antiguos
+    function ampliarArriba() {
+        if (inicioVentana === 0) {
+            cargarAntiguos();
+            return;
+        }
+        const nuevoInicio = Math.max(0, inicioVentana - TAMANO_PAGINA);
+        const fragmento = document.createDocumentFragment();
+        for (let i = nuevoInicio; i < inicioVentana; i++) {
+            fragmento.appendChild(crearNodo(mensajes[i]));
+        }
+        conAncla(() => chatMessages.prepend(fragmento));
+        inicioVentana = nuevoInicio;
+        recortarAbajo();
+        limitarMemoria();
+    }
+
+    // Desplaza la ventana hacia mensajes más recientes
+    function ampliarAbajo() {
+        if (finVentana === mensajes.length) {
+            if (hayMasRecientes) {
+                // Los más recientes se descartaron de memoria: volver a cargarlos
+                cargarSala(currentRoomId);
+            }
+            return;
+        }
+        const nuevoFin = Math.min(mensajes.length, finVentana + TAMANO_PAGINA);
+        const fragmento = document.createDocumentFragment();
+        for (let i = finVentana; i < nuevoFin; i++) {
+            fragmento.appendChild(crearNodo(mensajes[i]));
+        }
+        chatMessages.appendChild(fragmento);
+        finVentana = nuevoFin;
+        recortarArriba();
+    }
+
+    // Mantiene acotado el número de mensajes en memoria descartando los más
+    // alejados de la ventana; se pueden volver a pedir al servidor
+    function limitarMemoria() {
+        let sobran = mensajes.length - MAX_EN_MEMORIA;
+        if (sobran <= 0) return;
+
+        const antiguos = Math.min(sobran, inicioVentana);
+        if (antiguos > 0) {
+            mensajes.splice(0, antiguos);
+            inicioVentana -= antiguos;
+            finVentana -= antiguos;
+            hayMasAntiguos = true;
+            sobran -= antiguos;
+        }
+        const recientes = Math.min(sobran, mensajes.length - finVentana);
+        if (recientes > 0) {
+            mensajes.splice(mensajes.length - recientes, recientes);
+            hayMasRecientes = true;
+        }
+    }
+
+    // Añade un mensaje en su posición; si es el más reciente y la ventana está
+    // al final se muestra sin tocar el resto del DOM
+    function insertarMensaje(mensaje) {
+        if (indicePorId(mensaje.id) >= 0) {
+            actualizarMensaje(mensaje);
+            return;
+        }
+        const i = posicionInsercion(mensaje.id);
+        if (i === mensajes.length && hayMasRecientes) {
+            // Llegará al volver a cargar los mensajes recientes
+            return;
+        }
+
+        const alFinal = estaAlFinal();
+        const ventanaAlFinal = finVentana === mensajes.length;
+        mensajes.splice(i, 0, mensaje);
+
+        if (i < inicioVentana) {
+            inicioVentana++;
+            finVentana++;
+        } else if (i < finVentana || ventanaAlFinal) {
+            const siguiente = i + 1 < mensajes.length ? nodos.get(mensajes[i + 1].id) : null;
+            quitarAvisos();
+            chatMessages.insertBefore(crearNodo(mensaje), siguiente || null);
+            finVentana++;
+        }
+
+        if (alFinal && finVentana === mensajes.length) {
+            recortarArriba();
+            irAlFinal();
+        } else {
+            recortarAbajo();
+        }
+        limitarMemoria();
+    }
+
+    function actualizarMensaje(mensaje) {
+        const i = indicePorId(mensaje.id);
+        if (i < 0) return;
+        Object.assign(mensajes[i], mensaje);
+        const nodo = nodos.get(mensaje.id);
+        if (nodo) {
+            nodo.querySelector('.message-content').textContent = mensajes[i].contenido;
+        }
+    }
+
+    function eliminarMensaje(id) {
+        const i = indicePorId(id);
+        if (i < 0) return;
+        mensajes.splice(i, 1);
+        const nodo = nodos.get(id);
+        if (nodo) {
+            nodo.remove();
+            nodos.delete(id);
+        }
+        if (i < inicioVentana) {
+            inicioVentana--;
+            finVentana--;
+        } else if (i < finVentana) {
+            finVentana--;
+        }
+    }
+
+    // Pide una página de mensajes (más recientes primero) y la devuelve en orden cronológico
+    async function pedirPagina(roomId, antesDe) {
+        let url = `/api/rooms/${roomId}/messages?limit=${TAMANO_PAGINA}`;
+        if (antesDe != null) {
+            url += `&before=${antesDe}`;
+        }
+        const response = await fetch(url, {
+            headers: { 'Content-Type': 'application/json' }
+        });
+        if (!response.ok) {
+            throw new Error('Error al cargar los mensajes');
+        }
+        const pagina = await response.json();
+        return pagina.reverse();
+    }
+
+    // Cargar la página más reciente de una sala
+    async function cargarSala(roomId) {
+        const gen = ++generacion;
+        mensajes = [];
+        nodos.clear();
+        inicioVentana = finVentana = 0;
+        hayMasAntiguos = false;
+        hayMasRecientes = false;
+        cargandoAntiguos = false;
+        try {
+            const pagina = await pedirPagina(roomId);
+            if (gen !== generacion) return;
+            mensajes = pagina;
+            hayMasAntiguos = pagina.length === TAMANO_PAGINA;
+            renderizarUltimos();
+        } catch (error) {
+            console.error('Error:', error);
+        }
+    }
+
+    // Cargar la página anterior al mensaje más antiguo en memoria
+    async function cargarAntiguos() {
+        if (cargandoAntiguos || !hayMasAntiguos || mensajes.length === 0) return;
+        cargandoAntiguos = true;
+        const gen = generacion;
+        const roomId = currentRoomId;
+        try {
+            const pagina = await pedirPagina(roomId, mensajes[0].id);
+            if (gen !== generacion) return;
+            hayMasAntiguos = pagina.length === TAMANO_PAGINA;
+            const nuevos = pagina.filter(m => m.id < mensajes[0].id);
+            if (nuevos.length === 0) return;
+            mensajes.unshift(...nuevos);
+            inicioVentana += nuevos.length;
+            finVentana += nuevos.length;
+            ampliarArriba();
+        } catch (error) {
+            console.error('Error:', error);
+        } finally {
+            if (gen === generacion) cargandoAntiguos = false;
+        }
+    }
+
+    // Toma como estado inicial los mensajes renderizados en el servidor
+    function adoptarMensajesRenderizados() {
+        chatMessages.querySelectorAll('.message').forEach(nodo => {
+            const header = nodo.querySelector('.message-header');
+            const mensaje = {
+                id: Number(nodo.dataset.messageId),
+                usuario_id: Number(nodo.dataset.usuarioId),
+                usuario_nombre: header.firstChild.textContent.trim(),
+                fecha_envio: nodo.dataset.fechaEnvio,
+                contenido: nodo.querySelector('.message-content').textContent
+            };
+            // Misma presentación de la fecha que los mensajes creados en el navegador
+            header.querySelector('.message-time').textContent = formatDate(mensaje.fecha_envio);
+            nombreDe(mensaje);
+            mensajes.push(mensaje);
+            nodos.set(mensaje.id, nodo);
+        });
+        inicioVentana = 0;
+        finVentana = mensajes.length;
+        hayMasAntiguos = mensajes.length > 0;
+        irAlFinal();
+    }
+
+    // Manejar clic en una sala
+    function handleRoomClick(roomElement) {
+        if (roomElement.dataset.roomId === currentRoomId) return;
+
+        // Remover clase activa de todas las salas
+        document.querySelectorAll('.room').forEach(room => {
+            room.classList.remove('active');
+        });
+
+        // Añadir clase activa a la sala seleccionada
+        roomElement.classList.add('active');
+
+        // Actualizar la sala actual
+        currentRoomId = roomElement.dataset.roomId;
+
+        // Mostrar el formulario de mensajes
+        messageForm.style.display = 'flex';
+
+        // Recordar la sala en la URL para que al recargar llegue ya renderizada
+        history.replaceState(null, '', '?room=' + currentRoomId);
+
+        // Cargar mensajes de la sala
+        mostrarAviso('Cargando mensajes...');
+        cargarSala(currentRoomId);
+    }
+
+    // Ampliar la ventana al acercarse a los bordes, como mucho una vez por frame
+    let scrollPendiente = false;
+    chatMessages.addEventListener('scroll', function() {
+        if (scrollPendiente || currentRoomId === null) return;
+        scrollPendiente = true;
+        requestAnimationFrame(() => {
+            scrollPendiente = false;
+            if (chatMessages.scrollTop < UMBRAL_SCROLL) {
+                ampliarArriba();
+            } else if (estaAlFinal()) {
+                ampliarAbajo();
+            }
+        });
+    });
+
+    // Manejar envío de mensajes
+    messageForm.addEventListener('submit', async function(e) {
+        e.preventDefault();
+
+        if (!currentRoomId || !messageInput.value.trim()) return;
+
+        try {
+            const response = await fetch(`/api/rooms/${currentRoomId}/messages`, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify({
+                    contenido: messageInput.value.trim()
+                })
+            });
+
+            if (response.ok) {
+                // Limpiar el input
+                messageInput.value = '';
+
+                // Añadir el mensaje confirmado; el evento del socket con el
+                // mismo ID se ignorará
+                const mensaje = await response.json();
+                if (String(mensaje.sala_id) === currentRoomId) {
+                    mensaje.usuario_nombre = mensaje.usuario_nombre || userData.username;
+                    insertarMensaje(mensaje);
+                    irAlFinal();
+                }
+            } else {
+                console.error('Error al enviar el mensaje');
+            }
+        } catch (error) {
+            console.error('Error:', error);
+        }
+    });
+
+    // Aplica un evento de una sala si es posterior a su cursor
+    function aplicarEvento(salaId, seq, aplicar) {
+        const clave = String(salaId);
+        if (seq != null) {
+            if (cursores[clave] != null && seq <= cursores[clave]) return;
+            cursores[clave] = seq;
+        }
+        if (clave === currentRoomId) {
+            aplicar();
+        }
+    }
+
+    // Eventos en tiempo real del backend
+    if (typeof io !== 'undefined' && userData.socketUrl) {
+        const socket = io(userData.socketUrl, {
+            query: { token: userData.accessToken },
+            // Al reconectar se envían los cursores para recibir solo lo perdido
+            auth: (cb) => cb({ cursores: cursores })
+        });
+
+        socket.on('cursores', function(datos) {
+            Object.entries(datos).forEach(([salaId, seq]) => {
+                if (cursores[salaId] == null || seq > cursores[salaId]) {
+                    cursores[salaId] = seq;
+                }
+            });
+        });
+
+        socket.on('nuevo_mensaje', function(mensaje) {
+            actualizarVistaPrevia(mensaje, false);
+            aplicarEvento(mensaje.sala_id, mensaje.seq, () => insertarMensaje(mensaje));
+        });
+
+        socket.on('mensaje_actualizado', function(mensaje) {
+            actualizarVistaPrevia(mensaje, true);
+            aplicarEvento(mensaje.sala_id, mensaje.seq, () => actualizarMensaje(mensaje));
+        });
+
+        socket.on('mensaje_eliminado', function(datos) {
+            aplicarEvento(datos.sala_id, datos.seq, () => eliminarMensaje(datos.id));
+        });
+
+        socket.on('eventos_perdidos', function(datos) {
+            datos.eventos.forEach(evento => {
+                aplicarEvento(datos.sala_id, evento.seq, () => {
+                    if (evento.tipo === 'eliminado') {
+                        eliminarMensaje(evento.id);
+                    } else if (evento.tipo === 'nuevo') {
+                        insertarMensaje(evento.mensaje);
+                    } else if (evento.mensaje) {
+                        actualizarMensaje(evento.mensaje);
+                    }
+                });
+            });
+        });
+
+        socket.on('resync_necesario', function(datos) {
+            Object.assign(cursores, datos.cursores || {});
+            if (datos.salas.map(String).includes(currentRoomId)) {
+                cargarSala(currentRoomId);
+            }
+        });
+    }
+
+    // Agregar manejadores de eventos a las salas
+    const roomElements = document.querySelectorAll('.room');
+    roomElements.forEach(function(room) {
+        room.addEventListener('click', function() {
+            handleRoomClick(room);
+        });
+    });
+
+    // Si el servidor ya ha renderizado los mensajes de una sala, usarlos;
+    // si no, y hay una sala en la URL, seleccionarla automáticamente
+    const urlParams = new URLSearchParams(window.location.search);
+    const roomId = urlParams.get('room');
+    if (chatMessages.dataset.roomId) {
+        currentRoomId = chatMessages.dataset.roomId;
+        adoptarMensajesRenderizados();
+    } else if (roomId) {
+        const roomElement = document.querySelector('.room[data-room-id="' + roomId + '"]');
+        if (roomElement) {
+            handleRoomClick(roomElement);
+        }
+    }
+});
@@ -0,0 +1,148 @@
+"""
+Pruebas del circuit breaker y del presupuesto de reintentos de resiliencia.py.
+
+    python -m unittest discover -s tests     # desde frontend/
+"""
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cliente_api import ClienteApi  # noqa: E402
+from resiliencia import (  # noqa: E402
+    ABIERTO, CERRADO, SEMIABIERTO, Interruptor, PresupuestoReintentos, clave_endpoint, espera_con_jitter,
+)
+
+
+class _Reloj:
+    """Sustituto de time.monotonic que solo avanza cuando se le pide"""
+
+    def __init__(self):
+        self.ahora = 1000.0
+
+    def __call__(self):
+        return self.ahora
+
+
+class PruebasInterruptor(unittest.TestCase):
+
+    def setUp(self):
+        self.reloj = _Reloj()
+        parche = mock.patch('resiliencia.time.monotonic', self.reloj)
+        parche.start()
+        self.addCleanup(parche.stop)
+        self.interruptor = Interruptor(ventana=10, min_llamadas=4, umbral_fallos=0.5, tiempo_abierto=15)
+
+    def llamar(self, exito):
+        self.assertTrue(self.interruptor.permitir())
+        self.interruptor.registrar(exito)
+
+    def abrir(self):
+        for _ in range(4):
+            self.llamar(False)
+        self.assertEqual(self.interruptor.estado, ABIERTO)
+
+    def test_no_se_abre_con_pocas_llamadas(self):
+        for _ in range(3):
+            self.llamar(False)
+        self.assertEqual(self.interruptor.estado, CERRADO)
+
+    def test_no_se_abre_por_debajo_del_umbral(self):
+        for exito in (True, True, True, False, True, False):
+            self.llamar(exito)
+        self.assertEqual(self.interruptor.estado, CERRADO)
+
+    def test_abierto_rechaza_hasta_que_pasa_el_tiempo(self):
+        self.abrir()
+        self.assertFalse(self.interruptor.permitir())
+        self.reloj.ahora += 14.9
+        self.assertFalse(self.interruptor.permitir())
+        self.assertEqual(self.interruptor.estadisticas()['rechazadas'], 2)
+
+        self.reloj.ahora += 0.2
+        self.assertTrue(self.interruptor.permitir())
+        self.assertEqual(self.interruptor.estado, SEMIABIERTO)
+
+    def test_semiabierto_deja_pasar_una_sola_prueba(self):
+        self.abrir()
+        self.reloj.ahora += 15
+        self.assertTrue(self.interruptor.permitir())
+        self.assertFalse(self.interruptor.permitir())
+
+    def test_prueba_con_exito_cierra(self):
+        self.abrir()
+        self.reloj.ahora += 15
+        self.llamar(True)
+        self.assertEqual(self.interruptor.estado, CERRADO)
+        # La ventana empieza de cero: hacen falta min_llamadas para volver a abrirse
+        for _ in range(3):
+            self.llamar(False)
+        self.assertEqual(self.interruptor.estado, CERRADO)
+
+    def test_prueba_fallida_vuelve_a_abrir(self):
+        self.abrir()
+        self.reloj.ahora += 15
+        self.llamar(False)
+        self.assertEqual(self.interruptor.estado, ABIERTO)
+        self.assertFalse(self.interruptor.permitir())
+        self.assertEqual(self.interruptor.estadisticas()['aperturas'], 2)
+
+
+class PruebasPresupuestoReintentos(unittest.TestCase):
+
+    def test_sin_saldo_no_se_reintenta(self):
+        presupuesto = PresupuestoReintentos(ratio=0.5, max_saldo=2)
+        self.assertTrue(presupuesto.gastar())
+        self.assertTrue(presupuesto.gastar())
+        self.assertFalse(presupuesto.gastar())
+
+        presupuesto.anotar_llamada()
+        self.assertFalse(presupuesto.gastar())
+        presupuesto.anotar_llamada()
+        self.assertTrue(presupuesto.gastar())
+        self.assertEqual(presupuesto.estadisticas()['reintentos'], 3)
+        self.assertEqual(presupuesto.estadisticas()['denegados'], 2)
+
+    def test_el_saldo_no_pasa_del_maximo(self):
+        presupuesto = PresupuestoReintentos(ratio=1, max_saldo=2)
+        for _ in range(10):
+            presupuesto.anotar_llamada()
+        self.assertEqual(presupuesto.estadisticas()['saldo'], 2)
+
+
+class PruebasAuxiliares(unittest.TestCase):
+
+    def test_clave_endpoint_agrupa_ids_y_consulta(self):
+        self.assertEqual(clave_endpoint('get', '/api/rooms/12/messages?limit=50'), 'GET /api/rooms/<id>/messages')
+        self.assertEqual(clave_endpoint('delete', '/api/messages/3'), 'DELETE /api/messages/<id>')
+
+    def test_espera_con_jitter_acotada(self):
+        for intento in range(10):
+            self.assertTrue(0 <= espera_con_jitter(intento, base=0.05, tope=1.0) <= min(1.0, 0.05 * 2 ** intento))
+
+
+class PruebasClienteApi(unittest.TestCase):
+
+    def test_error_inesperado_libera_la_prueba(self):
+        cliente = ClienteApi('http://backend.invalid')
+        self.addCleanup(cliente._ejecutor.shutdown)
+        interruptor = cliente._interruptor(clave_endpoint('get', '/api/rooms'))
+        interruptor.estado = ABIERTO
+        interruptor._abierto_desde = -interruptor.tiempo_abierto
+
+        with mock.patch.object(cliente, '_enviar', side_effect=TypeError('no serializable')):
+            with self.assertRaises(TypeError):
+                cliente.peticion('get', '/api/rooms')
+        # La prueba ha fallado: vuelve a estar abierto en lugar de esperar para siempre
+        self.assertEqual(interruptor.estado, ABIERTO)
+
+        interruptor._abierto_desde = -interruptor.tiempo_abierto
+        with mock.patch.object(cliente, '_enviar', return_value=(200, {}, False)):
+            self.assertEqual(cliente.peticion('get', '/api/rooms'), (200, {}))
+        self.assertEqual(interruptor.estado, CERRADO)
+
+
+if __name__ == '__main__':
+    unittest.main()